@@ -1,17 +1,332 @@
-from QuizGeneratorModel.quiz_craft_package.quiz_database import QuizDataBase
+"""
+Module for the client of the vector database of quizzes.
 
+The database is opened lazily on the first call and kept in a pool of
+at most `SEARCH_CLIENT["POOL_SIZE"]` open instances reused by all
+threads of the process. Every call has a timeout, and a circuit breaker
+opened after `SEARCH_CLIENT["FAILURE_THRESHOLD"]` failures in a row makes
+calls fail fast with `SearchUnavailable` until
+`SEARCH_CLIENT["RESET_TIMEOUT"]` seconds pass and a trial call succeeds.
+Only calls that did not reach the database or timed out are failures,
+errors raised by the database itself show that it is up.
+"""
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as CallTimeout
 
-def singleton(cls):
-    instances = {}
+from asgiref.sync import sync_to_async
+from django.conf import settings
 
-    def getinstance(path):
-        if cls not in instances:
-            instances[cls] = cls(path)
-        return instances[cls]
 
-    return getinstance
+class SearchUnavailable(Exception):
+    """
+    The vector database cannot serve the call now.
+    """
 
 
-@singleton
-class SearchDB(QuizDataBase):
-    pass
+class CircuitBreaker:
+    """
+    Breaker of calls to a failing service.
+
+    Attributes:
+        threshold: Number of failures in a row opening the breaker.
+        reset_timeout: Seconds before a trial call is let through.
+        failures: Number of failures in a row.
+        opened_at: Time the breaker was opened, None if it is closed.
+    """
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Check if the call can be made.
+
+        Returns:
+            bool: True if the breaker is closed or the call is the trial
+                of the half-open breaker.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._trial:
+                return False  # Other calls wait for the trial call
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self._trial = True
+            return True
+
+    def success(self):
+        """
+        Close the breaker after a successful call.
+        """
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def failure(self):
+        """
+        Count a failed call and open the breaker if needed.
+        """
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.threshold:
+                if self.opened_at is None:
+                    print(f"Search circuit opened after {self.failures} fails")
+                self.opened_at = time.monotonic()
+                self._trial = False
+
+
+def is_transport_error(error):
+    """
+    Check if the call failed to reach the database or to get an answer
+    from it.
+
+    Args:
+        error: Exception raised by the call.
+
+    Returns:
+        bool: True for connection and timeout errors.
+    """
+    if isinstance(error, (OSError, SearchUnavailable)):
+        return True  # Including ConnectionError and socket timeouts
+    name = type(error).__name__
+    return any(word in name for word in ("Connect", "Timeout", "Transport"))
+
+
+def open_database(path):
+    """
+    Open the vector database.
+
+    Args:
+        path: Address of the database.
+
+    Returns:
+        QuizDataBase: The database.
+    """
+    from QuizGeneratorModel.quiz_craft_package.quiz_database import (
+        QuizDataBase,
+    )
+
+    return QuizDataBase(path)
+
+
+class SearchClient:
+    """
+    Pooled client of the vector database with timeouts and circuit
+    breaking.
+
+    Attributes:
+        path: Address of the database.
+        pool_size: Maximal number of open instances.
+        timeout: Seconds to wait for a call.
+        breaker: Circuit breaker of calls.
+    """
+
+    def __init__(self, path, pool_size, timeout, breaker):
+        self.path = path
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.breaker = breaker
+        self._idle = queue.LifoQueue()  # Recently used instances first
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            pool_size, thread_name_prefix="search"
+        )
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            opening = self._opened < self.pool_size
+            if opening:
+                self._opened += 1
+        if opening:
+            try:
+                return open_database(self.path)
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise SearchUnavailable("All search connections are busy")
+
+    def _release(self, database):
+        self._idle.put(database)
+
+    def call(self, method, *args, timeout=None, **kwargs):
+        """
+        Call the method of the database within the timeout.
+
+        Args:
+            method: Name of the method.
+            *args: Arguments of the method.
+            timeout: Seconds to wait, defaults to the client timeout.
+            **kwargs: Keyword arguments of the method.
+
+        Returns:
+            Result of the method.
+
+        Raises:
+            SearchUnavailable: If the breaker is open, the pool is
+                exhausted or the call timed out.
+        """
+        database = self._checkout()
+        future = self._submit(database, method, args, kwargs)
+        try:
+            result = future.result(timeout=timeout or self.timeout)
+        except CallTimeout:
+            self.breaker.failure()
+            raise SearchUnavailable(f"Search call {method} timed out")
+        except Exception as e:
+            self._settle(e)
+            raise
+        self.breaker.success()
+        return result
+
+    async def acall(self, method, *args, timeout=None, **kwargs):
+        """
+        Call the method of the database within the timeout without
+        blocking the event loop.
+
+        Args:
+            method: Name of the method.
+            *args: Arguments of the method.
+            timeout: Seconds to wait, defaults to the client timeout.
+            **kwargs: Keyword arguments of the method.
+
+        Returns:
+            Result of the method.
+
+        Raises:
+            SearchUnavailable: If the breaker is open, the pool is
+                exhausted or the call timed out.
+        """
+        database = await sync_to_async(
+            self._checkout, thread_sensitive=False
+        )()
+        future = self._submit(database, method, args, kwargs)
+        try:
+            result = await asyncio.wait_for(
+                asyncio.wrap_future(future), timeout or self.timeout
+            )
+        except asyncio.TimeoutError:
+            self.breaker.failure()
+            raise SearchUnavailable(f"Search call {method} timed out")
+        except Exception as e:
+            self._settle(e)
+            raise
+        self.breaker.success()
+        return result
+
+    def _checkout(self):
+        if not self.breaker.allow():
+            raise SearchUnavailable("Search circuit is open")
+        try:
+            return self._acquire()
+        except Exception as e:
+            self._settle(e)
+            raise
+
+    def _settle(self, error):
+        if is_transport_error(error):
+            self.breaker.failure()
+        else:
+            self.breaker.success()  # The database answered with an error
+
+    def _submit(self, database, method, args, kwargs):
+        future = self._executor.submit(
+            getattr(database, method), *args, **kwargs
+        )
+        # The instance returns to the pool when the call really ends
+        future.add_done_callback(lambda _: self._release(database))
+        return future
+
+    def search_quiz(self, text, number_of_results=10):
+        """
+        Search quizzes similar to the text.
+
+        Args:
+            text: Search query.
+            number_of_results: Number of quizzes.
+
+        Returns:
+            list: Results of the database with quiz ids.
+        """
+        return self.call(
+            "search_quiz", text, number_of_results=number_of_results
+        )
+
+    async def asearch_quiz(self, text, number_of_results=10):
+        """
+        Search quizzes similar to the text without blocking the event
+        loop.
+
+        Args:
+            text: Search query.
+            number_of_results: Number of quizzes.
+
+        Returns:
+            list: Results of the database with quiz ids.
+        """
+        return await self.acall(
+            "search_quiz", text, number_of_results=number_of_results
+        )
+
+    def save_quiz(self, quiz, unique_id):
+        """
+        Save the quiz to the database.
+
+        Args:
+            quiz: Quiz generated by the model.
+            unique_id: Id of the quiz.
+        """
+        self.call(
+            "save_quiz",
+            quiz=quiz,
+            unique_id=unique_id,
+            timeout=settings.SEARCH_CLIENT["SAVE_TIMEOUT"],
+        )
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_search_db(path=None):
+    """
+    Get client of the vector database.
+
+    Args:
+        path: Address of the database, defaults to the configured one.
+
+    Returns:
+        SearchClient: Client shared inside the process.
+    """
+    config = settings.SEARCH_CLIENT
+    path = path or config["PATH"]
+    with _clients_lock:
+        if path not in _clients:
+            _clients[path] = SearchClient(
+                path,
+                config["POOL_SIZE"],
+                config["TIMEOUT"],
+                CircuitBreaker(
+                    config["FAILURE_THRESHOLD"], config["RESET_TIMEOUT"]
+                ),
+            )
+        return _clients[path]
@@ -15,14 +15,27 @@ from pathlib import Path
 
 import environ
 
-from app.SearchDB import SearchDB
-
 env = environ.Env()
 environ.Env.read_env()
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
-SEARCH_DB = SearchDB(env("SEARCH_DB_PATH", default="http://127.0.0.1:1234"))
+
+# Client of the vector database of quizzes opened on the first call.
+# Calls fail fast for RESET_TIMEOUT seconds after FAILURE_THRESHOLD
+# calls in a row failed to connect or timed out. Quizzes that were not
+# indexed are retried INDEX_RETRIES times, after INDEX_RETRY_DELAY
+# seconds doubled with every retry
+SEARCH_CLIENT = {
+    "PATH": env("SEARCH_DB_PATH", default="http://127.0.0.1:1234"),
+    "POOL_SIZE": int(env("SEARCH_POOL_SIZE", default=4)),
+    "TIMEOUT": float(env("SEARCH_TIMEOUT", default=3)),
+    "SAVE_TIMEOUT": float(env("SEARCH_SAVE_TIMEOUT", default=60)),
+    "FAILURE_THRESHOLD": int(env("SEARCH_FAILURE_THRESHOLD", default=5)),
+    "RESET_TIMEOUT": float(env("SEARCH_RESET_TIMEOUT", default=30)),
+    "INDEX_RETRIES": int(env("SEARCH_INDEX_RETRIES", default=5)),
+    "INDEX_RETRY_DELAY": int(env("SEARCH_INDEX_RETRY_DELAY", default=60)),
+}
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/4.2/howto/deployment/checklist/
@@ -85,6 +98,277 @@ CELERY_RESULT_BACKEND = (
     f"{REDIS['PROTOCOL']}://:{REDIS['PASSWORD']}@{REDIS['HOST']}:"
     f"{REDIS['PORT']}/{REDIS['DATABASE']}"
 )
+
+# Time limits of quiz generation in seconds. After the soft limit the
+# quiz is saved with questions generated so far, after the hard limit
+# the worker process is killed. Generation tasks are acknowledged after
+# they finish, so the hard limit must stay below consumer_timeout of
+# RabbitMQ (set to 1 hour in docker compose, 30 minutes by default),
+# otherwise the broker closes the channel and redelivers the task, and
+# the quiz is generated and charged twice.
+GENERATION_TIME_LIMITS = {
+    "SOFT": int(env("GENERATION_SOFT_TIME_LIMIT", default=30 * 60)),
+    "HARD": int(env("GENERATION_HARD_TIME_LIMIT", default=35 * 60)),
+}
+
+# Number of attempts to generate a quiz after crashes of the worker,
+# every attempt resumes from the last checkpoint
+GENERATION_MAX_ATTEMPTS = int(env("GENERATION_MAX_ATTEMPTS", default=3))
+
+# Generated quiz is checkpointed every this number of chunks, progress is
+# saved after every chunk
+GENERATION_CHECKPOINT_EVERY = int(
+    env("GENERATION_CHECKPOINT_EVERY", default=5)
+)
+
+# Long tasks are acknowledged after they finish, so every worker process
+# reserves only one task at a time
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# Size of the thread pool for database calls of tasks when the worker
+# runs generation tasks as green threads (CELERY_POOL=gevent)
+GREEN_POOL_DB_THREADS = int(env("GREEN_POOL_DB_THREADS", default=8))
+
+# Celery queues for generation tasks, large materials go to the bulk queue
+GENERATION_QUEUES = {
+    "DEFAULT": env("GENERATION_QUEUE", default="celery"),
+    "BULK": env("GENERATION_BULK_QUEUE", default="bulk"),
+    "DEFERRED": env("GENERATION_DEFERRED_QUEUE", default="deferred"),
+    # Description and indexing of generated quizzes
+    "INDEXING": env("GENERATION_INDEXING_QUEUE", default="celery"),
+}
+
+# Limits of uploaded materials checked before the generation is enqueued
+GENERATION_LIMITS = {
+    "MAX_PAGES": int(env("GENERATION_MAX_PAGES", default=300)),
+    "MAX_TOKENS": int(env("GENERATION_MAX_TOKENS", default=250_000)),
+    # Materials above this number of tokens are generated in bulk queue
+    "BULK_TOKENS": int(env("GENERATION_BULK_TOKENS", default=50_000)),
+}
+
+# Parameters of generation cost and duration estimation
+GENERATION_ESTIMATE = {
+    "CHARS_PER_PAGE": int(env("ESTIMATE_CHARS_PER_PAGE", default=1800)),
+    "CHARS_PER_TOKEN": float(env("ESTIMATE_CHARS_PER_TOKEN", default=4)),
+    # Used for PDF files whose pages cannot be counted
+    "BYTES_PER_PDF_PAGE": int(
+        env("ESTIMATE_BYTES_PER_PDF_PAGE", default=50_000)
+    ),
+    # Completion tokens per prompt token
+    "COMPLETION_RATIO": float(env("ESTIMATE_COMPLETION_RATIO", default=0.3)),
+    "TOKENS_PER_QUESTION": int(
+        env("ESTIMATE_TOKENS_PER_QUESTION", default=80)
+    ),
+    # Prices in dollars per 1000 tokens
+    "PROMPT_PRICE": float(env("ESTIMATE_PROMPT_PRICE", default=0.0015)),
+    "COMPLETION_PRICE": float(
+        env("ESTIMATE_COMPLETION_PRICE", default=0.002)
+    ),
+    "PROMPT_TOKENS_PER_SECOND": float(
+        env("ESTIMATE_PROMPT_TOKENS_PER_SECOND", default=2000)
+    ),
+    "COMPLETION_TOKENS_PER_SECOND": float(
+        env("ESTIMATE_COMPLETION_TOKENS_PER_SECOND", default=40)
+    ),
+}
+
+# Backend generating quizzes and descriptions
+QUIZ_GENERATOR = {
+    "BACKEND": env(
+        "QUIZ_GENERATOR_BACKEND",
+        default="quiz.backends.QuizGeneratorModelBackend",
+    ),
+    "OPTIONS": {},
+}
+if QUIZ_GENERATOR["BACKEND"] == "quiz.backends.SyntheticBackend":
+    QUIZ_GENERATOR["OPTIONS"] = {
+        "seed": int(env("SYNTHETIC_SEED", default=0)),
+        "chunk_size": int(env("SYNTHETIC_CHUNK_SIZE", default=4000)),
+        "questions_per_chunk": int(
+            env("SYNTHETIC_QUESTIONS_PER_CHUNK", default=3)
+        ),
+        # "constant", "uniform" or "lognormal"
+        "latency_distribution": env(
+            "SYNTHETIC_LATENCY_DISTRIBUTION", default="lognormal"
+        ),
+        "chunk_latency": float(env("SYNTHETIC_CHUNK_LATENCY", default=2.0)),
+        "description_latency": float(
+            env("SYNTHETIC_DESCRIPTION_LATENCY", default=1.0)
+        ),
+        "latency_spread": float(env("SYNTHETIC_LATENCY_SPREAD", default=0.5)),
+    }
+
+# Generator and describer instances reused by worker processes are
+# recreated after serving MAX_TASKS tasks or when the process memory
+# grows above MAX_MEMORY megabytes
+GENERATOR_INSTANCES = {
+    "MAX_TASKS": int(env("GENERATOR_MAX_TASKS", default=100)),
+    "MAX_MEMORY": int(env("GENERATOR_MAX_MEMORY", default=1024)),
+}
+
+# Name of the model used by QuizGeneratorModel, it is a part of
+# the response cache keys
+LLM_MODEL = env("LLM_MODEL", default="default")
+
+# Cluster-wide limits of calls of the generation model, 0 disables
+# the limit. Calls wait for capacity and calls rejected by the provider
+# with HTTP 429 are retried with jittered exponential backoff
+LLM_RATE_LIMIT = {
+    "REQUESTS_PER_MINUTE": int(env("LLM_REQUESTS_PER_MINUTE", default=500)),
+    "TOKENS_PER_MINUTE": int(env("LLM_TOKENS_PER_MINUTE", default=200_000)),
+    # Seconds of calls at full rate allowed at once
+    "BURST_SECONDS": float(env("LLM_RATE_LIMIT_BURST", default=5)),
+    "MAX_RETRIES": int(env("LLM_RATE_LIMIT_RETRIES", default=6)),
+    "BACKOFF_BASE": float(env("LLM_RATE_LIMIT_BACKOFF", default=1)),
+    "BACKOFF_MAX": float(env("LLM_RATE_LIMIT_BACKOFF_MAX", default=60)),
+}
+
+# Persistent cache for responses of the generation model
+LLM_CACHE = {
+    # "on" - use cache, "off" - disable cache,
+    # "only" - use only cached responses (for load tests)
+    "MODE": env("LLM_CACHE_MODE", default="on"),
+    "PATH": env(
+        "LLM_CACHE_PATH", default=os.path.join(BASE_DIR, "llm_cache.sqlite3")
+    ),
+    "MAX_SIZE": int(env("LLM_CACHE_MAX_SIZE", default=512 * 1024 * 1024)),
+    "MAX_AGE": int(env("LLM_CACHE_MAX_AGE", default=30 * 24 * 60 * 60)),
+}
+
+# Batching of quiz description generation
+DESCRIPTION_BATCH = {
+    # Seconds to accumulate finished quizzes, 0 disables batching. Quizzes
+    # are batched only if the describer supports batched calls
+    "WINDOW": int(env("DESCRIPTION_BATCH_WINDOW", default=0)),
+    # Maximal number of quizzes described with one call
+    "MAX_SIZE": int(env("DESCRIPTION_BATCH_MAX_SIZE", default=10)),
+    # Seconds to keep generated quizzes waiting for description
+    "TIMEOUT": int(env("DESCRIPTION_BATCH_TIMEOUT", default=60 * 60)),
+}
+
+# Budget of cold start phases in milliseconds checked by
+# `manage.py profile_startup --check`
+STARTUP_BUDGET = env.json(
+    "STARTUP_BUDGET",
+    default={
+        "settings": 300,
+        "apps": 800,
+        "urls": 500,
+        "database": 300,
+        "request": 500,
+        "total": 2000,
+    },
+)
+
+# Composing quizzes from questions of existing public quizzes
+QUIZ_COMPOSE = {
+    # Quizzes taken from the search index for a query
+    "SEARCH_RESULTS": int(env("COMPOSE_SEARCH_RESULTS", default=20)),
+    # Questions considered for sampling
+    "CANDIDATES": int(env("COMPOSE_CANDIDATES", default=500)),
+    # Weight of dissimilarity of questions against their relevance
+    "DIVERSITY": float(env("COMPOSE_DIVERSITY", default=0.5)),
+    "MAX_PER_QUIZ": int(env("COMPOSE_MAX_PER_QUIZ", default=3)),
+    "DEFAULT_QUESTIONS": int(env("COMPOSE_DEFAULT_QUESTIONS", default=10)),
+    "MAX_QUESTIONS": int(env("COMPOSE_MAX_QUESTIONS", default=50)),
+}
+
+# Maximal number of quizzes created by one batch request
+GENERATION_BATCH_MAX_QUIZZES = int(
+    env("GENERATION_BATCH_MAX_QUIZZES", default=50)
+)
+
+# Minimal and maximal processes of worker pools by queue, resized by the
+# autoscaler (see WORKER_AUTOSCALE)
+AUTOSCALE_POOLS = env.json(
+    "AUTOSCALE_POOLS",
+    default={
+        GENERATION_QUEUES["DEFAULT"]: [1, 4],
+        GENERATION_QUEUES["BULK"]: [1, 2],
+        GENERATION_QUEUES["DEFERRED"]: [0, 2],
+    },
+)
+
+# Number of generation tasks processed at once by all workers, the
+# dispatcher and the autoscaler never go above it. By default it is the
+# sum of maximal pools of generation queues. Workers not managed by the
+# autoscaler, like gevent workers with CELERY_CONCURRENCY=100, need it
+# raised to their total concurrency
+GENERATION_SLOTS = int(
+    env(
+        "GENERATION_SLOTS",
+        default=sum(
+            AUTOSCALE_POOLS.get(GENERATION_QUEUES[name], [0, 0])[1]
+            for name in ("DEFAULT", "BULK", "DEFERRED")
+        ),
+    )
+)
+
+# Deferred jobs are dispatched inside off-peak windows, or when at most
+# MAX_QUEUE_DEPTH urgent jobs wait and the rate limit backlog is below
+# MAX_RATE_USAGE of its burst allowance. They never take more than
+# MAX_SLOTS generation slots
+DEFERRED_GENERATION = {
+    # Comma-separated windows in TIME_ZONE, like "22:00-06:00,13:00-14:00"
+    "OFF_PEAK": env("DEFERRED_OFF_PEAK", default="00:00-06:00"),
+    "MAX_QUEUE_DEPTH": int(env("DEFERRED_MAX_QUEUE_DEPTH", default=0)),
+    "MAX_RATE_USAGE": float(env("DEFERRED_MAX_RATE_USAGE", default=0.5)),
+    "MAX_SLOTS": int(
+        env("DEFERRED_MAX_SLOTS", default=max(1, GENERATION_SLOTS - 1))
+    ),
+}
+
+# Autoscaling of worker pools by `manage.py autoscale_workers`. Workers
+# consuming a queue from POOLS are grown or shrunk by STEP processes per
+# check to fit tasks in flight and waiting in the queue, within
+# [minimum, maximum] processes given for the queue. Pools are grown
+# faster when the oldest job waits longer than TARGET_LATENCY seconds
+# and shrunk not earlier than COOLDOWN seconds after the last change.
+# Demand of generation pools is capped by free GENERATION_SLOTS, which
+# follow maximal pools unless set. Indexing shares the default queue,
+# add its own queue to the pools if GENERATION_INDEXING_QUEUE is changed
+WORKER_AUTOSCALE = {
+    "INTERVAL": float(env("AUTOSCALE_INTERVAL", default=15)),
+    "COOLDOWN": float(env("AUTOSCALE_COOLDOWN", default=120)),
+    "STEP": int(env("AUTOSCALE_STEP", default=1)),
+    "TARGET_LATENCY": float(env("AUTOSCALE_TARGET_LATENCY", default=30)),
+    "POOLS": AUTOSCALE_POOLS,
+}
+
+# Fair share of generation slots between users. Queued jobs are
+# dispatched by deficit round-robin, every round a user is credited with
+# QUANTUM tokens of materials multiplied by the weight of the user tier
+FAIR_SHARE = {
+    "QUANTUM": int(env("FAIR_SHARE_QUANTUM", default=20_000)),
+    # Weights by name of the user group, the largest one is used
+    "WEIGHTS": env.json("FAIR_SHARE_WEIGHTS", default={"premium": 4}),
+    "DEFAULT_WEIGHT": float(env("FAIR_SHARE_DEFAULT_WEIGHT", default=1)),
+}
+
+# Daily budget of model tokens of a user, checked before new jobs are
+# admitted. Budgets of user tiers are given by names of user groups
+GENERATION_BUDGET = {
+    "DAILY_TOKENS": int(env("BUDGET_DAILY_TOKENS", default=1_000_000)),
+    "TIERS": env.json("BUDGET_TIER_TOKENS", default={"premium": 5_000_000}),
+}
+
+# Prediction of the generation time. Stage durations in seconds are
+# used until they are learned from finished jobs
+GENERATION_ETA = {
+    # Weight of the new observation in moving averages of durations
+    "ALPHA": float(env("ETA_ALPHA", default=0.2)),
+    # Number of finished jobs to fit durations from when Redis has none
+    "HISTORY": int(env("ETA_HISTORY", default=200)),
+    "DEFAULTS": {
+        "extraction": 10.0,
+        "chunk": 5.0,
+        "description": 5.0,
+        "indexing": 1.0,
+        "job": 120.0,
+        "tokens_per_chunk": 1000.0,
+    },
+}
+
 # Application definition
 INSTALLED_APPS = [
     "django.contrib.admin",
@@ -123,7 +407,24 @@ ROOT_URLCONF = "app.urls"
 # Rest framework settings
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "authorization.authentication.CachedJWTAuthentication",
+    ),
+}
+
+# Cache of authenticated users: seconds to keep them in Redis, seconds
+# and maximal number of users to keep them in every process
+AUTH_USER_CACHE = {
+    "TTL": int(env("AUTH_USER_CACHE_TTL", default=5 * 60)),
+    "LOCAL_TTL": float(env("AUTH_USER_CACHE_LOCAL_TTL", default=5)),
+    "LOCAL_SIZE": int(env("AUTH_USER_CACHE_LOCAL_SIZE", default=10_000)),
+}
+
+# LRU of verified tokens in every process: maximal number of tokens and
+# seconds between reads of the blacklist generation
+AUTH_TOKEN_CACHE = {
+    "SIZE": int(env("AUTH_TOKEN_CACHE_SIZE", default=10_000)),
+    "GENERATION_INTERVAL": float(
+        env("AUTH_TOKEN_GENERATION_INTERVAL", default=1)
     ),
 }
 
@@ -146,8 +447,53 @@ SIMPLE_JWT = {
     if "RS" in ALGORITHM
     else "",
     "ROTATE_REFRESH_TOKENS": True,
-    "BLACKLIST_AFTER_ROTATION": False,
-    "UPDATE_LAST_LOGIN": True,
+    "BLACKLIST_AFTER_ROTATION": True,
+    # Last logins are coalesced by authorization.last_login
+    "UPDATE_LAST_LOGIN": False,
+    "TOKEN_OBTAIN_SERIALIZER": (
+        "authorization.serializers.TokenObtainPairSerializer"
+    ),
+    "TOKEN_REFRESH_SERIALIZER": (
+        "authorization.serializers.TokenRefreshSerializer"
+    ),
+    "TOKEN_BLACKLIST_SERIALIZER": (
+        "authorization.serializers.TokenBlacklistSerializer"
+    ),
+}
+
+# Blacklist of tokens: seconds between deletions of expired tokens and
+# rebuilds of the blacklist in Redis, rows deleted or cached at once
+TOKEN_BLACKLIST = {
+    "COMPACTION_INTERVAL": int(
+        env("TOKEN_COMPACTION_INTERVAL", default=60 * 60)
+    ),
+    "BATCH_SIZE": int(env("TOKEN_COMPACTION_BATCH_SIZE", default=1000)),
+}
+
+# Last login times: seconds a stored time is kept without an update,
+# seconds between flushes of buffered times and users updated at once
+LAST_LOGIN = {
+    "GRANULARITY": int(env("LAST_LOGIN_GRANULARITY", default=60)),
+    "FLUSH_INTERVAL": int(env("LAST_LOGIN_FLUSH_INTERVAL", default=30)),
+    "BATCH_SIZE": int(env("LAST_LOGIN_BATCH_SIZE", default=500)),
+}
+
+# Periodic dispatch drains deferred jobs and recovers slots of jobs lost
+# with their workers, compaction deletes expired tokens and buffered
+# last logins are flushed (run by `celery -A app beat`)
+CELERY_BEAT_SCHEDULE = {
+    "dispatch-generation-jobs": {
+        "task": "quiz.tasks.dispatch_jobs",
+        "schedule": float(env("DISPATCH_INTERVAL", default=60)),
+    },
+    "compact-tokens": {
+        "task": "authorization.tasks.compact_tokens",
+        "schedule": TOKEN_BLACKLIST["COMPACTION_INTERVAL"],
+    },
+    "flush-last-logins": {
+        "task": "authorization.tasks.flush_last_logins",
+        "schedule": LAST_LOGIN["FLUSH_INTERVAL"],
+    },
 }
 
 TEMPLATES = [
@@ -0,0 +1,281 @@
+"""
+Module for JWT authentication with cached tokens and users.
+
+`JWTAuthentication` verifies the signature of the token and loads the
+user from the database on every request. `CachedJWTAuthentication`
+keeps verified tokens in an LRU of the process by digest until they
+expire or the blacklist generation changes, so repeated requests with
+the same token skip verification.
+
+Users are resolved from a short-lived cache of the process and then
+from Redis, where users are kept under their id and version. The
+version is bumped when the user is saved, deleted or logged out of all
+sessions, so cached copies are dropped at once in Redis and after at
+most `AUTH_USER_CACHE["LOCAL_TTL"]` seconds in other processes.
+Requests get copies of users cached in the process, so changes made
+during one request are not seen by others.
+"""
+import copy
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+USER_KEY = "auth:user:{}"
+VERSION_KEY = "auth:user_version:{}"
+GENERATION_KEY = "auth:blacklist_generation"
+
+_local = OrderedDict()  # User id -> (expiry, user)
+_local_lock = threading.Lock()
+
+_tokens = OrderedDict()  # Digest -> (expiry, generation, validated token)
+_tokens_lock = threading.Lock()
+_generation = [None, 0.0]  # Blacklist generation and time it was read
+
+
+def generation():
+    """
+    Get the blacklist generation, it is read from Redis at most once in
+    `AUTH_TOKEN_CACHE["GENERATION_INTERVAL"]` seconds.
+
+    Returns:
+        int: The generation or None if Redis is unavailable.
+    """
+    now = time.monotonic()
+    if now - _generation[1] < settings.AUTH_TOKEN_CACHE["GENERATION_INTERVAL"]:
+        return _generation[0]
+    try:
+        value = int(get_redis_connection("default").get(GENERATION_KEY) or 0)
+    except RedisError as e:
+        print(f"Blacklist generation is unknown: {e}")
+        value = None  # Tokens are verified until Redis is back
+    _generation[:] = [value, now]
+    return value
+
+
+def bump_generation():
+    """
+    Bump the blacklist generation after tokens were blacklisted, verified
+    tokens cached before are verified again.
+    """
+    with _tokens_lock:
+        _tokens.clear()
+    _generation[1] = 0.0  # Read the new generation on the next request
+    try:
+        get_redis_connection("default").incr(GENERATION_KEY)
+    except RedisError as e:
+        print(f"Blacklist generation was not bumped: {e}")
+
+
+def cached_token(digest, current):
+    """
+    Get the verified token from the LRU.
+
+    Args:
+        digest: Digest of the raw token.
+        current: Current blacklist generation.
+
+    Returns:
+        The validated token or None if it is missing, expired or cached
+            in another generation.
+    """
+    with _tokens_lock:
+        entry = _tokens.get(digest)
+        if entry is None:
+            return None
+        if entry[0] <= time.time() or entry[1] != current:
+            del _tokens[digest]
+            return None
+        _tokens.move_to_end(digest)
+        return entry[2]
+
+
+def cache_token(digest, current, validated_token):
+    """
+    Put the verified token into the LRU until it expires.
+
+    Args:
+        digest: Digest of the raw token.
+        current: Current blacklist generation.
+        validated_token: The validated token.
+    """
+    expiry = validated_token.get("exp")
+    if expiry is None:
+        return
+    with _tokens_lock:
+        _tokens[digest] = (expiry, current, validated_token)
+        _tokens.move_to_end(digest)
+        while len(_tokens) > settings.AUTH_TOKEN_CACHE["SIZE"]:
+            _tokens.popitem(last=False)  # Least recently used
+
+
+def local_get(user_id):
+    """
+    Get the user from the cache of the process.
+
+    Args:
+        user_id: Id of the user.
+
+    Returns:
+        A copy of the user or None if it is missing or expired.
+    """
+    with _local_lock:
+        entry = _local.get(user_id)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del _local[user_id]
+            return None
+        _local.move_to_end(user_id)
+        user = entry[1]
+    return copy.copy(user)
+
+
+def local_set(user_id, user):
+    """
+    Put a copy of the user into the cache of the process.
+
+    Args:
+        user_id: Id of the user.
+        user: The user.
+    """
+    config = settings.AUTH_USER_CACHE
+    user = copy.copy(user)  # The request may change its own copy
+    with _local_lock:
+        _local[user_id] = (time.monotonic() + config["LOCAL_TTL"], user)
+        _local.move_to_end(user_id)
+        while len(_local) > config["LOCAL_SIZE"]:
+            _local.popitem(last=False)  # Least recently used
+
+
+def load(user_id):
+    """
+    Get the version of the user and the user cached with it from Redis
+    in one round trip.
+
+    Args:
+        user_id: Id of the user.
+
+    Returns:
+        Tuple of the version and the user, the user is None if it is not
+            cached for the current version.
+    """
+    with get_redis_connection("default").pipeline() as pipe:
+        pipe.get(VERSION_KEY.format(user_id))
+        pipe.get(USER_KEY.format(user_id))
+        version, cached = pipe.execute()
+    version = int(version or 0)
+    if cached is not None:
+        cached_version, user = pickle.loads(cached)
+        if cached_version == version:
+            return version, user
+    return version, None
+
+
+def store(user_id, version, user):
+    """
+    Cache the user with its version in Redis.
+
+    Args:
+        user_id: Id of the user.
+        version: Version of the user read before loading it.
+        user: The user.
+    """
+    get_redis_connection("default").set(
+        USER_KEY.format(user_id),
+        pickle.dumps((version, user), pickle.HIGHEST_PROTOCOL),
+        ex=settings.AUTH_USER_CACHE["TTL"],
+    )
+
+
+def invalidate(user_id):
+    """
+    Bump the version of the user and drop its cached copies.
+
+    Args:
+        user_id: Id of the user.
+    """
+    with _local_lock:
+        _local.pop(user_id, None)
+    try:
+        with get_redis_connection("default").pipeline() as pipe:
+            pipe.incr(VERSION_KEY.format(user_id))
+            pipe.delete(USER_KEY.format(user_id))
+            pipe.execute()
+    except RedisError as e:
+        print(f"Cached user {user_id} was not invalidated: {e}")
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication with cached verified tokens and users.
+    """
+
+    def get_validated_token(self, raw_token):
+        """
+        Get the validated token from the LRU of verified tokens or verify
+        its signature and claims.
+
+        Args:
+            raw_token: The encoded token.
+
+        Returns:
+            The validated token.
+
+        Raises:
+            rest_framework_simplejwt.exceptions.InvalidToken: If the token
+                is not valid.
+        """
+        current = generation()
+        if current is None:
+            return super().get_validated_token(raw_token)
+        digest = hashlib.sha256(raw_token).digest()
+        validated_token = cached_token(digest, current)
+        if validated_token is None:
+            validated_token = super().get_validated_token(raw_token)
+            cache_token(digest, current, validated_token)
+        return validated_token
+
+    def get_user(self, validated_token):
+        """
+        Get the user of the token from the cache of the process, then
+        from Redis and only then from the database.
+
+        Args:
+            validated_token: The validated token.
+
+        Returns:
+            The active user of the token.
+
+        Raises:
+            rest_framework_simplejwt.exceptions.InvalidToken: If the token
+                has no user id.
+            rest_framework.exceptions.AuthenticationFailed: If the user is
+                not found or inactive.
+        """
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return super().get_user(validated_token)
+        user = local_get(user_id)
+        if user is not None:
+            return user
+        try:
+            version, user = load(user_id)
+        except (RedisError, pickle.UnpicklingError) as e:
+            print(f"User cache is unavailable: {e}")
+            return super().get_user(validated_token)
+        if user is None:
+            user = super().get_user(validated_token)  # Checks is_active
+            try:
+                store(user_id, version, user)
+            except RedisError as e:
+                print(f"User {user_id} was not cached: {e}")
+        local_set(user_id, user)
+        return user
@@ -0,0 +1,86 @@
+"""
+Module for coalesced updates of last login times.
+
+Logins do not update the users table. A login is written to a hash in
+Redis unless the stored time is more recent than
+`LAST_LOGIN["GRANULARITY"]` seconds, and `flush_logins` writes the
+buffered times with bulk updates every `LAST_LOGIN["FLUSH_INTERVAL"]`
+seconds. Times in the database stay accurate within the sum of both.
+"""
+import datetime
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError
+from django.utils import timezone
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+LAST_LOGIN_KEY = "auth:last_login"
+
+
+def record_login(user):
+    """
+    Buffer the login time of the user.
+
+    Args:
+        user: The user who logged in.
+    """
+    now = timezone.now()
+    granularity = datetime.timedelta(
+        seconds=settings.LAST_LOGIN["GRANULARITY"]
+    )
+    if user.last_login and now - user.last_login < granularity:
+        return
+    user.last_login = now
+    try:
+        get_redis_connection("default").hset(
+            LAST_LOGIN_KEY, user.pk, now.timestamp()
+        )
+    except RedisError as e:
+        print(f"Login of user {user.pk} was not buffered: {e}")
+        get_user_model().objects.filter(pk=user.pk).update(last_login=now)
+
+
+def flush_logins():
+    """
+    Write buffered login times to the users table.
+
+    Returns:
+        int: Number of updated users.
+
+    Raises:
+        django.db.DatabaseError: If the update failed, the times are
+            buffered again then.
+    """
+    connection = get_redis_connection("default")
+    with connection.pipeline() as pipe:  # Read and clear atomically
+        pipe.hgetall(LAST_LOGIN_KEY)
+        pipe.delete(LAST_LOGIN_KEY)
+        logins, _ = pipe.execute()
+    if not logins:
+        return 0
+    user_model = get_user_model()
+    users = [
+        user_model(
+            pk=int(pk),
+            last_login=datetime.datetime.fromtimestamp(
+                float(timestamp), tz=datetime.timezone.utc
+            ),
+        )
+        for pk, timestamp in logins.items()
+    ]
+    try:
+        # Signals are not sent, cached users stay valid
+        user_model.objects.bulk_update(
+            users,
+            ["last_login"],
+            batch_size=settings.LAST_LOGIN["BATCH_SIZE"],
+        )
+    except DatabaseError:
+        with connection.pipeline() as pipe:
+            for pk, timestamp in logins.items():
+                pipe.hsetnx(LAST_LOGIN_KEY, pk, timestamp)  # Keep newer
+            pipe.execute()
+        raise
+    return len(users)
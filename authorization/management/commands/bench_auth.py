@@ -0,0 +1,102 @@
+"""
+Management command for benchmarking overhead of authentication.
+"""
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from authorization import authentication
+from authorization.authentication import CachedJWTAuthentication
+
+
+def make_tokens(count, user_id):
+    """
+    Make signed access tokens.
+
+    Args:
+        count: Number of tokens.
+        user_id: Id of the user of the tokens.
+
+    Returns:
+        list: Authorization headers with the tokens.
+    """
+    headers = []
+    for _ in range(count):
+        token = AccessToken()
+        token[api_settings.USER_ID_CLAIM] = user_id
+        headers.append(f"Bearer {token}".encode())
+    return headers
+
+
+def measure(authenticator, headers, requests):
+    """
+    Validate tokens of the requests like authentication of the request
+    does before the user is resolved.
+
+    Args:
+        authenticator: The authentication class instance.
+        headers: Authorization headers used in turn.
+        requests: Number of requests.
+
+    Returns:
+        list: Microseconds per request.
+    """
+    timings = []
+    for i in range(requests):
+        started = time.perf_counter()
+        raw_token = authenticator.get_raw_token(headers[i % len(headers)])
+        authenticator.get_validated_token(raw_token)
+        timings.append((time.perf_counter() - started) * 1_000_000)
+    return timings
+
+
+class Command(BaseCommand):
+    """
+    Compare token validation with and without the LRU of verified tokens.
+    """
+
+    help = (
+        "Measure authentication overhead per request with and without "
+        "the LRU of verified tokens."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument(
+            "--tokens",
+            type=int,
+            default=10,
+            help="Number of distinct tokens used by the requests.",
+        )
+        parser.add_argument("--user", type=int, default=1)
+
+    def handle(self, *args, **options):
+        if authentication.generation() is None:
+            raise CommandError("Redis is required for the token cache")
+        headers = make_tokens(options["tokens"], options["user"])
+        self.stdout.write(
+            f"{api_settings.ALGORITHM}, {options['requests']} requests, "
+            f"{len(headers)} tokens"
+        )
+        results = {}
+        for name, authenticator in (
+            ("verify", JWTAuthentication()),
+            ("cached", CachedJWTAuthentication()),
+        ):
+            authentication._tokens.clear()
+            timings = sorted(
+                measure(authenticator, headers, options["requests"])
+            )
+            results[name] = statistics.mean(timings)
+            self.stdout.write(
+                f"{name:>7}: mean {results[name]:8.1f}us "
+                f"p50 {timings[len(timings) // 2]:8.1f}us "
+                f"p99 {timings[int(len(timings) * 0.99)]:8.1f}us"
+            )
+        self.stdout.write(
+            f"speedup: {results['verify'] / results['cached']:.1f}x"
+        )
@@ -15,9 +15,19 @@ Serializers:
     for registering new users.
     UserSerializer: This serializer is used to serialize the data
     for retrieving and updating user information.
+    TokenObtainPairSerializer: This serializer is used to log in users
+    with coalesced updates of their last login times.
+    TokenRefreshSerializer: This serializer is used to rotate refresh
+    tokens checked against the blacklist in Redis.
+    TokenBlacklistSerializer: This serializer is used to blacklist
+    refresh tokens on logout.
 """
 
 from rest_framework import serializers
+from rest_framework_simplejwt import serializers as jwt_serializers
+
+from authorization.last_login import record_login
+from authorization.tokens import RefreshToken, rotate
 
 from .models import User
 
@@ -74,3 +84,35 @@ class UserSerializer(serializers.ModelSerializer):
         exclude = [
             "password",
         ]
+
+
+class TokenObtainPairSerializer(jwt_serializers.TokenObtainPairSerializer):
+    """
+    Serializer for logging in users with coalesced updates of their last
+    login times.
+    """
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        record_login(self.user)
+        return data
+
+
+class TokenRefreshSerializer(jwt_serializers.TokenRefreshSerializer):
+    """
+    Serializer for rotating refresh tokens checked against the blacklist
+    in Redis.
+    """
+
+    token_class = RefreshToken
+
+    def validate(self, attrs):
+        return rotate(self.token_class(attrs["refresh"]))
+
+
+class TokenBlacklistSerializer(jwt_serializers.TokenBlacklistSerializer):
+    """
+    Serializer for blacklisting refresh tokens on logout.
+    """
+
+    token_class = RefreshToken
@@ -0,0 +1,39 @@
+"""
+Module for receivers invalidating cached users and caching blacklisted
+tokens.
+"""
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from authorization.authentication import invalidate
+from authorization.tokens import remember
+
+
+@receiver(post_save, sender=get_user_model())
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    """
+    Invalidate the cached user after it was updated or deactivated.
+    """
+    if update_fields and set(update_fields) == {"last_login"}:
+        return  # Saved on every login, the cached user is still valid
+    invalidate(instance.pk)
+
+
+@receiver(post_delete, sender=get_user_model())
+def user_deleted(sender, instance, **kwargs):
+    """
+    Invalidate the cached user after it was deleted.
+    """
+    invalidate(instance.pk)
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def token_blacklisted(sender, instance, created, **kwargs):
+    """
+    Add the token blacklisted one by one, by logout or in the admin, to
+    the blacklist in Redis.
+    """
+    if created:
+        remember([(instance.token.jti, instance.token.expires_at)])
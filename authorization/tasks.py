@@ -0,0 +1,48 @@
+"""
+Module for periodic tasks of authorization.
+"""
+from django.conf import settings
+from django.utils import timezone
+from redis.exceptions import RedisError
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+
+from app.celery import app
+from authorization.last_login import flush_logins
+from authorization.tokens import rebuild
+
+
+@app.task
+def compact_tokens():
+    """
+    Delete expired outstanding tokens with their blacklist entries in
+    batches and rebuild the token blacklist in Redis.
+
+    Returns:
+        int: Number of deleted outstanding tokens.
+    """
+    batch_size = settings.TOKEN_BLACKLIST["BATCH_SIZE"]
+    expired = OutstandingToken.objects.filter(expires_at__lt=timezone.now())
+    deleted = 0
+    while True:
+        ids = list(expired.values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            break
+        # Blacklist entries are deleted by the cascade
+        OutstandingToken.objects.filter(pk__in=ids).delete()
+        deleted += len(ids)
+    try:
+        rebuild()
+    except RedisError as e:
+        print(f"Token blacklist was not rebuilt: {e}")
+    return deleted
+
+
+@app.task
+def flush_last_logins():
+    """
+    Write login times buffered in Redis to the users table.
+
+    Returns:
+        int: Number of updated users.
+    """
+    return flush_logins()
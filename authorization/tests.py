@@ -1 +1,245 @@
-# Create your tests here.
+"""
+Module with unit tests of the authorization app.
+"""
+import datetime
+from unittest import mock
+
+import fakeredis
+from django.db import DatabaseError
+from django.test import SimpleTestCase
+from django.utils import timezone
+from redis.exceptions import RedisError
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import TokenError
+
+from authorization import authentication, tokens
+from authorization.authentication import (
+    GENERATION_KEY,
+    CachedJWTAuthentication,
+)
+from authorization.last_login import (
+    LAST_LOGIN_KEY,
+    flush_logins,
+    record_login,
+)
+from authorization.models import User
+
+
+class RedisTestCase(SimpleTestCase):
+    """
+    Test case with Redis of the tested modules replaced by fakeredis.
+
+    Attributes:
+        redis_modules: Modules getting their Redis connection.
+    """
+
+    redis_modules = ()
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        for module in self.redis_modules:
+            patcher = mock.patch(
+                f"{module}.get_redis_connection", return_value=self.redis
+            )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class TokenBlacklistTest(RedisTestCase):
+    """
+    Tests of the token blacklist in Redis and rotation of refresh tokens.
+    """
+
+    redis_modules = ("authorization.tokens", "authorization.authentication")
+
+    def setUp(self):
+        super().setUp()
+        self.expires_at = timezone.now() + datetime.timedelta(days=1)
+        patcher = mock.patch.object(tokens, "BlacklistedToken")
+        self.blacklisted = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.in_db = self.blacklisted.objects.filter.return_value.exists
+        self.in_db.return_value = False
+
+    def refresh_token(self, jti=None):
+        token = tokens.RefreshToken()
+        token["user_id"] = 1
+        if jti:
+            token["jti"] = jti
+        return token
+
+    def test_token_in_set_is_blacklisted(self):
+        tokens.remember([("old", self.expires_at)])
+        self.assertTrue(tokens.is_blacklisted("old"))
+        self.in_db.assert_not_called()
+
+    def test_complete_set_skips_database(self):
+        self.redis.set(tokens.BLACKLIST_COMPLETE_KEY, 1)
+        self.assertFalse(tokens.is_blacklisted("new"))
+        self.in_db.assert_not_called()
+
+    def test_incomplete_set_falls_back_to_database(self):
+        self.in_db.return_value = True
+        self.assertTrue(tokens.is_blacklisted("new"))
+        self.in_db.assert_called_once()
+
+    def test_failed_write_clears_complete_mark(self):
+        self.redis.set(tokens.BLACKLIST_COMPLETE_KEY, 1)
+        with mock.patch.object(
+            self.redis, "zadd", side_effect=RedisError("down")
+        ), mock.patch("builtins.print"):
+            tokens.remember([("old", self.expires_at)])
+        self.assertFalse(self.redis.exists(tokens.BLACKLIST_COMPLETE_KEY))
+
+    @mock.patch.object(tokens, "OutstandingToken")
+    def test_blacklisted_user_tokens_are_rejected(self, outstanding):
+        outstanding.objects.filter.return_value.values_list.return_value = [
+            (1, "first", self.expires_at),
+            (2, "second", self.expires_at),
+        ]
+        self.assertEqual(tokens.blacklist_user(1), 2)
+        self.blacklisted.objects.bulk_create.assert_called_once()
+        self.assertEqual(int(self.redis.get(GENERATION_KEY)), 1)
+        self.redis.set(tokens.BLACKLIST_COMPLETE_KEY, 1)
+        for jti in ("first", "second"):
+            with self.assertRaises(TokenError):
+                self.refresh_token(jti).check_blacklist()
+        self.refresh_token("third").check_blacklist()
+
+    @mock.patch.object(tokens.transaction, "atomic")
+    @mock.patch.object(tokens, "OutstandingToken")
+    @mock.patch.object(tokens, "blacklist_outstanding", return_value=True)
+    def test_rotate_blacklists_old_token(self, blacklist, outstanding, _):
+        refresh = self.refresh_token("old")
+        data = tokens.rotate(refresh)
+        blacklist.assert_called_once_with("old")
+        self.assertNotEqual(refresh["jti"], "old")
+        self.assertEqual(data["refresh"], str(refresh))
+        recorded = outstanding.objects.create.call_args.kwargs
+        self.assertEqual(recorded["jti"], refresh["jti"])
+        self.assertTrue(tokens.is_blacklisted("old"))
+
+    @mock.patch.object(tokens.transaction, "atomic")
+    @mock.patch.object(tokens, "OutstandingToken")
+    @mock.patch.object(tokens, "blacklist_outstanding", return_value=False)
+    def test_rotate_rejects_blacklisted_token(self, _, outstanding, __):
+        outstanding.objects.filter.return_value.exists.return_value = True
+        with self.assertRaises(TokenError):
+            tokens.rotate(self.refresh_token("old"))
+        outstanding.objects.create.assert_not_called()
+        self.assertIsNone(self.redis.zscore(tokens.BLACKLIST_KEY, "old"))
+
+    @mock.patch.object(tokens, "connection")
+    def test_blacklist_outstanding_inserts_once(self, connection):
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.rowcount = 1
+        self.assertTrue(tokens.blacklist_outstanding("old"))
+        sql, params = cursor.execute.call_args.args
+        self.assertIn("ON CONFLICT (token_id) DO NOTHING", sql)
+        self.assertEqual(params[1], "old")
+        cursor.rowcount = 0  # Blacklisted before or not outstanding
+        self.assertFalse(tokens.blacklist_outstanding("old"))
+
+
+class LastLoginTest(RedisTestCase):
+    """
+    Tests of coalesced last login times and their flush.
+    """
+
+    redis_modules = ("authorization.last_login",)
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(User, "objects")
+        self.objects = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def buffered(self):
+        return {
+            int(pk): float(timestamp)
+            for pk, timestamp in self.redis.hgetall(LAST_LOGIN_KEY).items()
+        }
+
+    def test_logins_are_coalesced(self):
+        user = User(pk=1)
+        record_login(user)
+        first = self.buffered()
+        record_login(user)  # Within the granularity
+        self.assertEqual(self.buffered(), first)
+        self.assertEqual(first[1], user.last_login.timestamp())
+        self.objects.filter.assert_not_called()
+
+    def test_old_login_is_updated(self):
+        user = User(pk=1, last_login=timezone.now() - datetime.timedelta(1))
+        record_login(user)
+        self.assertEqual(self.buffered(), {1: user.last_login.timestamp()})
+
+    def test_login_is_saved_without_redis(self):
+        with mock.patch.object(
+            self.redis, "hset", side_effect=RedisError("down")
+        ), mock.patch("builtins.print"):
+            record_login(User(pk=1))
+        self.objects.filter.assert_called_once_with(pk=1)
+
+    def test_flush_updates_users_at_once(self):
+        self.redis.hset(LAST_LOGIN_KEY, mapping={1: 100.0, 2: 200.0})
+        self.assertEqual(flush_logins(), 2)
+        users = self.objects.bulk_update.call_args.args[0]
+        self.assertEqual(
+            {user.pk: user.last_login.timestamp() for user in users},
+            {1: 100.0, 2: 200.0},
+        )
+        self.assertEqual(self.buffered(), {})
+
+    def test_failed_flush_keeps_newer_logins(self):
+        self.redis.hset(LAST_LOGIN_KEY, mapping={1: 100.0, 2: 200.0})
+
+        def fail(*args, **kwargs):
+            self.redis.hset(LAST_LOGIN_KEY, 2, 300.0)  # Login during flush
+            raise DatabaseError("down")
+
+        self.objects.bulk_update.side_effect = fail
+        with self.assertRaises(DatabaseError):
+            flush_logins()
+        self.assertEqual(self.buffered(), {1: 100.0, 2: 300.0})
+
+
+class UserCacheTest(RedisTestCase):
+    """
+    Tests of cached users invalidated by their version.
+    """
+
+    redis_modules = ("authorization.authentication",)
+
+    def setUp(self):
+        super().setUp()
+        authentication._local.clear()
+        self.addCleanup(authentication._local.clear)
+        patcher = mock.patch.object(
+            JWTAuthentication, "get_user", return_value=User(pk=1)
+        )
+        self.from_db = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_user(self):
+        return CachedJWTAuthentication().get_user({"user_id": 1})
+
+    def test_user_is_loaded_once(self):
+        self.get_user()
+        authentication._local.clear()  # Like another process
+        self.assertEqual(self.get_user().pk, 1)
+        self.from_db.assert_called_once()
+
+    def test_invalidated_user_is_loaded_again(self):
+        self.get_user()
+        authentication.invalidate(1)
+        self.assertIsNone(authentication.local_get(1))
+        self.assertEqual(authentication.load(1), (1, None))
+        self.get_user()
+        self.assertEqual(self.from_db.call_count, 2)
+
+    def test_user_loaded_before_invalidation_is_not_cached(self):
+        version, _ = authentication.load(1)
+        authentication.invalidate(1)  # Saved while loading from the DB
+        authentication.store(1, version, User(pk=1))
+        self.assertEqual(authentication.load(1), (1, None))
@@ -0,0 +1,217 @@
+"""
+Module for the token blacklist backed by Redis.
+
+JTIs of blacklisted tokens are kept in a sorted set scored by expiry
+time of the tokens. The set is rebuilt from the database by
+`authorization.tasks.compact_tokens`, which marks it complete for two
+compaction intervals. While the set is complete a token missing in it is
+not blacklisted, otherwise the database is consulted. Tokens are always
+blacklisted in the database first, and a failed write to the set clears
+the mark, so the blacklist fails closed.
+
+Rotation of a refresh token blacklists the old token with one
+`INSERT ... SELECT` and records the new one with one insert in the same
+transaction.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from rest_framework_simplejwt import tokens
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from authorization.authentication import bump_generation
+
+BLACKLIST_KEY = "auth:blacklist"
+BLACKLIST_COMPLETE_KEY = "auth:blacklist:complete"
+
+
+def remember(entries):
+    """
+    Add blacklisted tokens to the set in Redis.
+
+    Args:
+        entries: Pairs of JTIs and expiry datetimes of the tokens.
+    """
+    mapping = {jti: expires_at.timestamp() for jti, expires_at in entries}
+    if not mapping:
+        return
+    connection = get_redis_connection("default")
+    try:
+        connection.zadd(BLACKLIST_KEY, mapping)
+    except RedisError as e:
+        print(f"Blacklisted tokens were not cached: {e}")
+        try:
+            connection.delete(BLACKLIST_COMPLETE_KEY)  # Checks use the DB
+        except RedisError as e:
+            print(f"Token blacklist in Redis may be incomplete: {e}")
+
+
+def is_blacklisted(jti):
+    """
+    Check if the token is blacklisted, the database is queried only if
+    the set in Redis is not complete.
+
+    Args:
+        jti: JTI of the token.
+
+    Returns:
+        bool: True if the token is blacklisted.
+    """
+    try:
+        with get_redis_connection("default").pipeline() as pipe:
+            pipe.zscore(BLACKLIST_KEY, jti)
+            pipe.exists(BLACKLIST_COMPLETE_KEY)
+            score, complete = pipe.execute()
+    except RedisError as e:
+        print(f"Token blacklist is unavailable: {e}")
+        score, complete = None, False
+    if score is not None:
+        return True
+    if complete:
+        return False
+    return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+
+def blacklist_user(user_id):
+    """
+    Blacklist all unexpired tokens of the user with one insert.
+
+    Args:
+        user_id: Id of the user.
+
+    Returns:
+        int: Number of tokens of the user.
+    """
+    outstanding = list(
+        OutstandingToken.objects.filter(
+            user_id=user_id, expires_at__gt=timezone.now()
+        ).values_list("pk", "jti", "expires_at")
+    )
+    BlacklistedToken.objects.bulk_create(
+        [BlacklistedToken(token_id=pk) for pk, _, _ in outstanding],
+        ignore_conflicts=True,  # Tokens blacklisted before
+    )
+    remember((jti, expires_at) for _, jti, expires_at in outstanding)
+    bump_generation()
+    return len(outstanding)
+
+
+def blacklist_outstanding(jti):
+    """
+    Blacklist the outstanding token by its JTI with one statement.
+
+    Args:
+        jti: JTI of the token.
+
+    Returns:
+        bool: False if the token is not outstanding or already blacklisted.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {BlacklistedToken._meta.db_table} "
+            "(token_id, blacklisted_at) "
+            f"SELECT id, %s FROM {OutstandingToken._meta.db_table} "
+            "WHERE jti = %s ON CONFLICT (token_id) DO NOTHING",
+            [timezone.now(), jti],
+        )
+        return cursor.rowcount == 1
+
+
+def rotate(refresh):
+    """
+    Blacklist the refresh token and record the new one with the real JTI
+    in one transaction.
+
+    Args:
+        refresh: The validated refresh token, it becomes the new token.
+
+    Returns:
+        dict: The new access and refresh tokens.
+
+    Raises:
+        rest_framework_simplejwt.exceptions.TokenError: If the token was
+            blacklisted by a concurrent refresh.
+    """
+    old_token = str(refresh)
+    old_jti = refresh[api_settings.JTI_CLAIM]
+    old_expires_at = datetime_from_epoch(refresh["exp"])
+    user_id = refresh.get(api_settings.USER_ID_CLAIM)
+    data = {"access": str(refresh.access_token)}
+    refresh.set_jti()
+    refresh.set_exp()
+    refresh.set_iat()
+    data["refresh"] = str(refresh)
+    with transaction.atomic():
+        if not blacklist_outstanding(old_jti):
+            if OutstandingToken.objects.filter(jti=old_jti).exists():
+                raise TokenError("Token is blacklisted")
+            BlacklistedToken.objects.create(  # Issued before it was recorded
+                token=OutstandingToken.objects.create(
+                    user_id=user_id,
+                    jti=old_jti,
+                    token=old_token,
+                    expires_at=old_expires_at,
+                )
+            )
+        OutstandingToken.objects.create(
+            user_id=user_id,
+            jti=refresh[api_settings.JTI_CLAIM],
+            token=data["refresh"],
+            created_at=refresh.current_time,
+            expires_at=datetime_from_epoch(refresh["exp"]),
+        )
+    remember([(old_jti, old_expires_at)])
+    return data
+
+
+def rebuild():
+    """
+    Remove expired tokens from the set in Redis, add all blacklisted
+    tokens from the database and mark the set complete.
+
+    Raises:
+        redis.exceptions.RedisError: If Redis is unavailable, the set is
+            not marked complete then.
+    """
+    config = settings.TOKEN_BLACKLIST
+    now = timezone.now()
+    connection = get_redis_connection("default")
+    connection.zremrangebyscore(BLACKLIST_KEY, "-inf", now.timestamp())
+    entries = BlacklistedToken.objects.filter(
+        token__expires_at__gt=now
+    ).values_list("token__jti", "token__expires_at")
+    batch = {}
+    for jti, expires_at in entries.iterator(chunk_size=config["BATCH_SIZE"]):
+        batch[jti] = expires_at.timestamp()
+        if len(batch) >= config["BATCH_SIZE"]:
+            connection.zadd(BLACKLIST_KEY, batch)
+            batch = {}
+    if batch:
+        connection.zadd(BLACKLIST_KEY, batch)
+    connection.set(
+        BLACKLIST_COMPLETE_KEY, 1, ex=2 * config["COMPACTION_INTERVAL"]
+    )
+
+
+class RefreshToken(tokens.RefreshToken):
+    """
+    Refresh token checked against the blacklist in Redis.
+    """
+
+    def check_blacklist(self):
+        """
+        Check if the token is blacklisted.
+
+        Raises:
+            rest_framework_simplejwt.exceptions.TokenError: If it is.
+        """
+        if is_blacklisted(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError("Token is blacklisted")
@@ -1,19 +1,17 @@
 from django.urls import path
-from rest_framework_simplejwt.views import (
-    TokenObtainPairView,
-    TokenRefreshView,
-)
+from rest_framework_simplejwt.views import TokenObtainPairView
 
 from authorization.views import (
     LogoutAllView,
     LogoutView,
+    RefreshView,
     RegisterView,
     UserInfoView,
 )
 
 urlpatterns = [
     path("login/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
-    path("refresh/", TokenRefreshView.as_view(), name="token_refresh"),
+    path("refresh/", RefreshView.as_view(), name="token_refresh"),
     path("register/", RegisterView.as_view(), name="sign_up"),
     path("user-me/", UserInfoView.as_view(), name="user_info"),
     path("logout/", LogoutView.as_view(), name="auth_logout"),
@@ -9,24 +9,16 @@ Classes:
     RegisterView: This view class is used to register new users.
     UserInfoView: This view class is used to get the information
     of the authenticated user.
-    RefreshView: This view class is used to refresh the user's
-    token and save it in the database.
+    RefreshView: This view class is used to rotate the user's
+    refresh token and save it in the database.
     LogoutView: This view class is used to log out the user.
     LogoutAllView: This view class is used to log out all the user's tokens.
 
 Imports:
 
-    datetime: This module provides the timedelta class, which is used to
-    calculate the expiration date of the token.
-    django.utils: This module provides the timezone and crypto modules,
-    which are used to get the current time and
-        generate a random string.
     rest_framework.permissions: This module provides the IsAuthenticated
     permission, which is used to ensure that the user is authenticated
     before they can access the views.
-    rest_framework_simplejwt.token_blacklist.models: This module provides
-    the OutstandingToken and BlacklistedToken models, which are used to
-    store the user's tokens.
     rest_framework.response: This module provides the Response class,
     which is used to return a JSON response.
     rest_framework.views: This module provides the APIView class, which
@@ -35,12 +27,13 @@ Imports:
     rest_framework.status: This module provides the status constants,
     which are used to set the status code of the
         response.
-    rest_framework_simplejwt.serializers: This module provides the
-    TokenBlacklistSerializer serializer, which is used
-        to serialize the token blacklist data.
     rest_framework_simplejwt.views: This module provides the
     TokenRefreshView class, which is used to refresh
         the user's token.
+    authorization.authentication: This module provides invalidation of
+    cached users and verified tokens.
+    authorization.tokens: This module provides bulk blacklisting of the
+    user's tokens.
 
 Serializers:
 
@@ -48,24 +41,23 @@ Serializers:
     user registration data.
     UserSerializer: This serializer is used to serialize the user information
     data.
+    TokenBlacklistSerializer: This serializer is used to blacklist the
+    refresh token on logout.
 """
 
-from datetime import timedelta
-
-from django.utils import timezone
-from django.utils.crypto import get_random_string
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.serializers import TokenBlacklistSerializer
-from rest_framework_simplejwt.token_blacklist.models import (
-    BlacklistedToken,
-    OutstandingToken,
-)
 from rest_framework_simplejwt.views import TokenRefreshView
 
-from authorization.serializers import UserRegisterSerializer, UserSerializer
+from authorization.authentication import invalidate
+from authorization.serializers import (
+    TokenBlacklistSerializer,
+    UserRegisterSerializer,
+    UserSerializer,
+)
+from authorization.tokens import blacklist_user
 
 
 # View class for registration
@@ -121,35 +113,12 @@ class UserInfoView(APIView):
 
 class RefreshView(TokenRefreshView):
     """
-    This view class is used to refresh the user's token and save it
-    in database. This class is recommended to be
-    used when Blacklist After Rotation is required.
+    This view class is used to rotate the user's refresh token. The old
+    token is blacklisted and the new one is saved in the database in one
+    transaction.
     """
 
-    def post(self, request, *args, **kwargs):
-        """
-        Refreshes the user's token and saves it in the database.
-
-        Args:
-            request: The HTTP request object.
-
-        Returns:
-            A JSON response containing the new token.
-
-        Todo:
-            fix doubling of tokens in outstanding_tokens database table
-        """
-        response = super().post(request, *args, **kwargs)
-        refresh_token = response.data["refresh"]
-        tokens = OutstandingToken.objects.filter(token=request.data["refresh"])
-        token = OutstandingToken.objects.create(
-            user=tokens[0].user,
-            token=refresh_token,
-            expires_at=timezone.now() + timedelta(days=14),
-            jti=get_random_string(length=32),
-        )
-        token.save()
-        return response
+    _serializer_class = "authorization.serializers.TokenRefreshSerializer"
 
 
 class LogoutView(APIView):
@@ -203,8 +172,7 @@ class LogoutAllView(APIView):
         Raises:
             PermissionDenied: If the user is not authenticated.
         """
-        tokens = OutstandingToken.objects.filter(user_id=request.user.id)
-        for token in tokens:
-            t, _ = BlacklistedToken.objects.get_or_create(token=token)
+        blacklist_user(request.user.id)
+        invalidate(request.user.id)
 
         return Response(status=status.HTTP_205_RESET_CONTENT)
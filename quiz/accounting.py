@@ -0,0 +1,370 @@
+"""
+Module for accounting of tokens and cost of quiz generation.
+
+Generator and describer are wrapped to record prompt and completion
+tokens, number of calls and latency of every upstream call. Tokens are
+taken from the `usage` the model reports for its last call, if the
+backend provides it. Otherwise prompt tokens of generation are the
+pre-flight estimate of the materials stored in the job, and other
+tokens are estimated from the length of texts sent to and received
+from the model the same way as the pre-flight estimate does, so the
+charges are estimates of characters. Usage is added to the
+generation job record and to the daily usage of the user kept in Redis,
+which is checked against the daily budget before new jobs are admitted.
+"""
+import datetime
+import math
+import time
+
+from django.conf import settings
+from django.db.models import F
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from quiz.execution import run_db
+from quiz.fair_share import active_jobs
+from quiz.llm_cache import model_name
+from quiz.models import GenerationJob
+
+USAGE_KEY = "quiz:usage:{}:{}"  # Daily usage by user id and date
+USAGE_TIMEOUT = 7 * 24 * 60 * 60
+
+
+def count_tokens(characters):
+    """
+    Estimate number of tokens in the text.
+
+    Args:
+        characters: Length of the text.
+
+    Returns:
+        int: Number of tokens.
+    """
+    return math.ceil(
+        characters / settings.GENERATION_ESTIMATE["CHARS_PER_TOKEN"]
+    )
+
+
+class Usage:
+    """
+    Usage of the upstream model.
+
+    Attributes:
+        prompt_tokens: Tokens sent to the model.
+        completion_tokens: Tokens generated by the model.
+        calls: Number of calls.
+        latency: Total duration of calls in seconds.
+    """
+
+    FIELDS = ("prompt_tokens", "completion_tokens", "calls", "latency")
+
+    def __init__(
+        self, prompt_tokens=0, completion_tokens=0, calls=0, latency=0.0
+    ):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.calls = calls
+        self.latency = latency
+
+    @property
+    def tokens(self):
+        """
+        Total number of tokens.
+        """
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def cost(self):
+        """
+        Cost of the usage in dollars.
+        """
+        estimate = settings.GENERATION_ESTIMATE
+        return (
+            self.prompt_tokens / 1000 * estimate["PROMPT_PRICE"]
+            + self.completion_tokens / 1000 * estimate["COMPLETION_PRICE"]
+        )
+
+    def split(self, parts):
+        """
+        Split the usage of a shared call between several jobs.
+
+        Args:
+            parts: Number of jobs.
+
+        Returns:
+            Usage: Share of one job.
+        """
+        return Usage(
+            math.ceil(self.prompt_tokens / parts),
+            math.ceil(self.completion_tokens / parts),
+            1,
+            self.latency / parts,
+        )
+
+
+def quiz_text_length(ml_quiz, start=0):
+    """
+    Count characters of questions and options of the quiz.
+
+    Args:
+        ml_quiz: Quiz generated by the model.
+        start: Index of the first question to count.
+
+    Returns:
+        int: Number of characters.
+    """
+    length = 0
+    for i in range(start, len(ml_quiz)):
+        question = ml_quiz.get_question(i)
+        length += len(question.question_text)
+        length += sum(len(option) for option in question.options)
+    return length
+
+
+def reported_usage(model, stale=None):
+    """
+    Get tokens of the last call reported by the model, like `usage` of
+    OpenAI responses.
+
+    Args:
+        model: Wrapped generator or describer.
+        stale: Usage reported before the call.
+
+    Returns:
+        Union[tuple, None]: Prompt and completion tokens or None if the
+            model did not report usage of the call.
+    """
+    usage = getattr(model, "usage", None)
+    if usage is None or usage is stale:
+        return None
+    return usage.prompt_tokens, usage.completion_tokens
+
+
+class AccountingGenerator:
+    """
+    Wrapper of quiz stream generator that records usage of every
+    processed chunk. Unless the model reports usage, prompt tokens of
+    the chunk are the estimated tokens of the materials divided by the
+    number of chunks.
+    """
+
+    def __init__(self, generator, charge, tokens):
+        self.generator = generator
+        self.charge = charge
+        self.tokens = tokens
+        self.model_name = model_name(generator)
+
+    @property
+    def supports_resume(self):
+        """
+        Whether the wrapped generator can resume from a checkpoint.
+        """
+        return getattr(self.generator, "supports_resume", False)
+
+    def create_quiz_from_files(self, file_names, **parameters):
+        """
+        Create quiz from files and record usage of every chunk.
+
+        Args:
+            file_names: List of file names.
+            **parameters: Parameters of the generator.
+
+        Yields:
+            Tuple of generated quiz, current chunk and total chunks.
+        """
+        resume_from = parameters.get("resume_from")
+        previous = resume_from[1] if resume_from else 0
+        questions = len(resume_from[0]) if resume_from else 0
+        stale = getattr(self.generator, "usage", None)
+        started = time.perf_counter()
+        for ml_quiz, i, total in self.generator.create_quiz_from_files(
+            file_names, **parameters
+        ):
+            tokens = reported_usage(self.generator, stale) or (
+                math.ceil(self.tokens * (i - previous) / total),
+                count_tokens(quiz_text_length(ml_quiz, questions)),
+            )
+            self.charge(
+                Usage(*tokens, i - previous, time.perf_counter() - started)
+            )
+            previous, questions = i, len(ml_quiz)
+            stale = getattr(self.generator, "usage", None)
+            yield ml_quiz, i, total
+            started = time.perf_counter()  # Not counting the consumer
+
+
+class AccountingDescriber:
+    """
+    Wrapper of quiz describer that records usage of every call.
+    """
+
+    def __init__(self, describer, charge):
+        self.describer = describer
+        self.charge = charge
+        self.model_name = model_name(describer)
+        if callable(getattr(describer, "complete", None)):
+            self.complete = self._complete  # Batched calls are supported
+
+    def generate_description(self, ml_quiz):
+        """
+        Generate description for the quiz and record usage of the call.
+
+        Args:
+            ml_quiz: Quiz generated by the model.
+
+        Returns:
+            Quiz with description.
+        """
+        stale = getattr(self.describer, "usage", None)
+        started = time.perf_counter()
+        ml_quiz = self.describer.generate_description(ml_quiz)
+        tokens = reported_usage(self.describer, stale) or (
+            count_tokens(quiz_text_length(ml_quiz)),
+            count_tokens(len(ml_quiz.description or "")),
+        )
+        self.charge(Usage(*tokens, 1, time.perf_counter() - started))
+        return ml_quiz
+
+    def _complete(self, prompt):
+        stale = getattr(self.describer, "usage", None)
+        started = time.perf_counter()
+        response = self.describer.complete(prompt)
+        tokens = reported_usage(self.describer, stale) or (
+            count_tokens(len(prompt)),
+            count_tokens(len(response or "")),
+        )
+        self.charge(Usage(*tokens, 1, time.perf_counter() - started))
+        return response
+
+
+def charge(pk, user_id, usage):
+    """
+    Add usage to the generation job and to the daily usage of the user.
+
+    Args:
+        pk: Quiz id of the job.
+        user_id: Id of the creator of the quiz.
+        usage: Usage of the upstream model.
+    """
+    run_db(
+        GenerationJob.objects.filter(pk=pk).update,
+        **{field: F(field) + getattr(usage, field) for field in Usage.FIELDS},
+        cost=F("cost") + usage.cost,
+    )
+    key = USAGE_KEY.format(user_id, datetime.date.today().isoformat())
+    try:
+        with get_redis_connection("default").pipeline() as pipe:
+            pipe.hincrby(key, "prompt_tokens", usage.prompt_tokens)
+            pipe.hincrby(key, "completion_tokens", usage.completion_tokens)
+            pipe.hincrby(key, "calls", usage.calls)
+            pipe.hincrbyfloat(key, "latency", usage.latency)
+            pipe.hincrbyfloat(key, "cost", usage.cost)
+            pipe.expire(key, USAGE_TIMEOUT)
+            pipe.execute()
+    except RedisError as e:
+        print(f"Usage of user {user_id} was not recorded: {e}")
+
+
+def charge_shared(owners, usage):
+    """
+    Split usage of a call shared by several jobs, like the batched
+    description, equally between the jobs.
+
+    Args:
+        owners: List of quiz ids of the jobs and ids of their creators.
+        usage: Usage of the upstream model.
+    """
+    share = usage.split(len(owners))
+    for pk, user_id in owners:
+        charge(pk, user_id, share)
+
+
+def daily_usage(user_id):
+    """
+    Get usage of the user for today.
+
+    Args:
+        user_id: Id of the user.
+
+    Returns:
+        dict: Tokens, calls, latency and cost.
+    """
+    key = USAGE_KEY.format(user_id, datetime.date.today().isoformat())
+    try:
+        values = get_redis_connection("default").hgetall(key)
+    except RedisError as e:
+        print(f"Usage of user {user_id} is unknown: {e}")
+        values = {}  # Jobs are admitted while Redis is unavailable
+    usage = Usage(
+        int(values.get(b"prompt_tokens", 0)),
+        int(values.get(b"completion_tokens", 0)),
+        int(values.get(b"calls", 0)),
+        float(values.get(b"latency", 0)),
+    )
+    return {
+        **{field: getattr(usage, field) for field in Usage.FIELDS},
+        "tokens": usage.tokens,
+        "cost": round(float(values.get(b"cost", 0)), 4),
+    }
+
+
+def daily_budget(user):
+    """
+    Get daily budget of tokens of the user by the groups they belong to.
+
+    Args:
+        user: The user.
+
+    Returns:
+        int: Number of tokens.
+    """
+    tiers = settings.GENERATION_BUDGET["TIERS"]
+    names = user.groups.filter(name__in=tiers).values_list("name", flat=True)
+    return max(
+        [settings.GENERATION_BUDGET["DAILY_TOKENS"]]
+        + [tiers[name] for name in names]
+    )
+
+
+def reserved_tokens(user_id):
+    """
+    Count tokens that queued and running jobs of the user are expected
+    to spend in addition to the usage recorded so far.
+
+    Args:
+        user_id: Id of the user.
+
+    Returns:
+        int: Number of tokens.
+    """
+    jobs = active_jobs().filter(quiz__creator_id=user_id)
+    return sum(
+        max(0, estimated - prompt - completion)
+        for estimated, prompt, completion in jobs.values_list(
+            "estimated_tokens", "prompt_tokens", "completion_tokens"
+        )
+    )
+
+
+def check_budget(user, tokens):
+    """
+    Check that new jobs fit into the daily budget of the user.
+
+    Args:
+        user: The user.
+        tokens: Estimated tokens of new jobs.
+
+    Returns:
+        Union[dict, None]: Usage and budget if the budget is exceeded.
+    """
+    usage = daily_usage(user.id)
+    budget = daily_budget(user)
+    reserved = reserved_tokens(user.id)
+    if usage["tokens"] + reserved + tokens <= budget:
+        return None
+    return {
+        "usage": usage,
+        "reserved_tokens": reserved,
+        "requested_tokens": tokens,
+        "budget_tokens": budget,
+    }
@@ -0,0 +1,307 @@
+"""
+This module contains asynchronous versions of the read-heavy quiz views.
+
+Under ASGI one worker serves many requests waiting for the database,
+Redis or the search database at once. The views use the async ORM,
+the async cache API and the async search client, only serializers and
+Celery results run in threads. Authentication, serializers and other
+methods of the same URLs, served by `QuizViewSet`, run in the thread
+pool of the worker instead of the single thread Django runs sync views
+in, so they do not queue behind each other.
+"""
+import functools
+import random
+
+from asgiref.sync import sync_to_async
+from celery.result import AsyncResult
+from django.contrib.auth.models import AnonymousUser
+from django.db.models import Q
+from django.http import JsonResponse
+from rest_framework import exceptions, status
+from rest_framework.settings import api_settings
+
+from app.SearchDB import SearchUnavailable, get_search_db
+from app.settings import env
+from quiz.eta import predict
+from quiz.models import GenerationJob, Quiz, QuizView
+from quiz.serializers import (
+    QuizAnswersSerializer,
+    QuizMeSerializer,
+    QuizSerializer,
+)
+from quiz.views import (
+    SORTS,
+    QuizViewSet,
+    filter_by_dates,
+    progress_response,
+    search_fallback,
+)
+
+SAFE_METHODS = ("GET", "HEAD")
+
+
+async def authenticate(request):
+    """
+    Authenticate the request with authentication classes of the API.
+
+    Args:
+        request (django.http.HttpRequest): The HTTP request from the user.
+
+    Returns:
+        The user or an anonymous user.
+
+    Raises:
+        rest_framework.exceptions.AuthenticationFailed: If the
+            credentials are invalid.
+    """
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        result = await sync_to_async(
+            authentication_class().authenticate, thread_sensitive=False
+        )(request)
+        if result is not None:
+            return result[0]
+    return AnonymousUser()
+
+
+def read_only(actions):
+    """
+    Make the async view serve safe methods of the URL and pass other
+    methods to the quiz view set.
+
+    Args:
+        actions (dict): Actions of `QuizViewSet` by method for the URL.
+
+    Returns:
+        Decorator of the async view.
+    """
+    fallback = sync_to_async(
+        QuizViewSet.as_view(actions), thread_sensitive=False
+    )
+
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in SAFE_METHODS:
+                return await fallback(request, *args, **kwargs)
+            try:
+                request.user = await authenticate(request)
+            except exceptions.APIException as e:
+                detail = e.detail
+                return JsonResponse(
+                    detail if isinstance(detail, dict) else {"detail": detail},
+                    status=e.status_code,
+                )
+            return await view(request, *args, **kwargs)
+
+        wrapper.csrf_exempt = True  # Like API views of the view set
+        return wrapper
+
+    return decorator
+
+
+def serialize(serializer_class, instance, **kwargs):
+    """
+    Serialize the instance in a thread, serializers query the database
+    synchronously.
+
+    Args:
+        serializer_class: Class of the serializer.
+        instance: The instance or a list of instances.
+        **kwargs: Arguments of the serializer.
+
+    Returns:
+        Awaitable serialized data.
+    """
+    return sync_to_async(
+        lambda: serializer_class(instance, **kwargs).data,
+        thread_sensitive=False,
+    )()
+
+
+@read_only({"get": "list", "post": "create"})
+async def quiz_list(request):
+    """
+    Get list of quizzes for given query parameters.
+    """
+    queryset, start_date, end_date = filter_by_dates(
+        Quiz.objects.filter(
+            Q(private__exact=False) | Q(creator__exact=request.user.id)
+        ),
+        request.GET,
+    )
+    sort_algorithm = request.GET.get("sort")
+    if sort_algorithm in SORTS:
+        queryset = await sync_to_async(SORTS[sort_algorithm])(
+            queryset, start_date, end_date
+        )
+    elif sort_algorithm == "generations":
+        queryset = queryset.filter(ready__exact=True).order_by("-created_at")
+    offset = int(request.GET.get("offset", 0))
+    limit = int(request.GET.get("limit", 10))
+    page = queryset[offset: offset + limit]
+    if not isinstance(page, list):
+        page = [quiz async for quiz in page]
+    data = await serialize(QuizMeSerializer, page, many=True)
+    return JsonResponse(data, safe=False)
+
+
+@read_only({"get": "retrieve"})
+async def retrieve(request, pk):
+    """
+    This function retrieves a quiz.
+
+    Args:
+        request (django.http.HttpRequest): The HTTP request from the user.
+        pk (int): The ID of the quiz to retrieve.
+
+    Returns:
+        django.http.JsonResponse: A JSON response with the quiz.
+    """
+    quiz = await Quiz.objects.filter(pk=pk).afirst()
+    if quiz is None:
+        return JsonResponse(
+            {"quiz_id": ["Invalid quiz ID."]},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    user_id = request.user.id
+    if quiz.private and (user_id is None or quiz.creator_id != user_id):
+        return JsonResponse(
+            {"detail": "This quiz is private and cannot be accessed by you."},
+            status=status.HTTP_403_FORBIDDEN,
+        )
+    if not quiz.ready:
+        return JsonResponse(
+            {"detail": "This quiz is not ready yet."},
+            status=status.HTTP_425_TOO_EARLY,
+        )
+    if request.GET.get("answer"):
+        data = await serialize(QuizAnswersSerializer, quiz)
+    else:
+        data = await serialize(QuizSerializer, quiz)
+    if user_id:
+        await QuizView.objects.acreate(quiz_id=quiz.id, viewer_id=user_id)
+    return JsonResponse(data)
+
+
+@read_only({"get": "random"})
+async def random_quiz(request):
+    """
+    This function gets a random quiz for the user.
+
+    Args:
+        request (django.http.HttpRequest): The HTTP request from the user.
+
+    Returns:
+        django.http.JsonResponse: A JSON response with the random quiz.
+    """
+    queryset = Quiz.objects.filter(
+        Q(private__exact=False) | Q(creator__exact=request.user.id),
+        ready__exact=True,
+    ).order_by("pk")
+    count = await queryset.acount()
+    if not count:
+        return JsonResponse(
+            {"detail": "No available quizzes for you."},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+    quiz = await queryset[random.randrange(count):].afirst()
+    return JsonResponse(await serialize(QuizSerializer, quiz))
+
+
+@read_only({"get": "search"})
+async def search(request):
+    """
+    This function searches for quizzes in the database.
+
+    Args:
+        request (django.http.HttpRequest): The HTTP request from the user.
+
+    Returns:
+        django.http.JsonResponse: A JSON response with the list of
+            quizzes that match the search criteria.
+    """
+    search_data = request.GET.get("data")
+    if not search_data:
+        return JsonResponse(
+            {"detail": "You have no text to search with."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    number_of_results = int(env("NUMBER_OF_SEARCH_RESULTS", default=10))
+    try:
+        results = await get_search_db().asearch_quiz(
+            search_data, number_of_results=number_of_results
+        )
+    except SearchUnavailable as e:
+        print(f"Search is degraded: {e}")
+        quizzes = search_fallback(
+            request.user.id, search_data, number_of_results
+        )
+        data = await serialize(
+            QuizMeSerializer, [quiz async for quiz in quizzes], many=True
+        )
+        return JsonResponse(
+            data, safe=False, headers={"X-Search-Degraded": "true"}
+        )
+    except Exception as e:
+        print(e.__str__())
+        return JsonResponse(
+            {"detail": "Database is empty."},
+            status=status.HTTP_409_CONFLICT,
+        )
+    ids = [int(result[1]) for result in results]
+    found = await Quiz.objects.filter(
+        Q(private__exact=False) | Q(creator__exact=request.user.id)
+    ).ain_bulk(ids)
+    quizzes = [found[pk] for pk in ids if found.get(pk)]
+    data = await serialize(QuizMeSerializer, quizzes, many=True)
+    return JsonResponse(data, safe=False)
+
+
+def task_meta(task_id):
+    """
+    Get state and metadata of the Celery task.
+
+    Args:
+        task_id (str): The ID of the task.
+
+    Returns:
+        Tuple of the state and the metadata.
+    """
+    task = AsyncResult(task_id)
+    return task.state, task.info
+
+
+@read_only({"get": "check_progress"})
+async def check_progress(request, pk):
+    """
+    This function checks the progress of a quiz generation.
+
+    Args:
+        request (django.http.HttpRequest): The HTTP request from the user.
+        pk (int): The ID of the quiz.
+
+    Returns:
+        django.http.JsonResponse: A JSON response with the progress
+            of the quiz generation.
+    """
+    quiz = await Quiz.objects.filter(pk=pk).afirst()
+    if not quiz:
+        return JsonResponse(
+            {"detail": "Quiz does not exist!"},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+    user_id = request.user.id
+    if user_id is None or quiz.creator_id != user_id:
+        return JsonResponse(
+            {"detail": "Access to this quiz is not allowed for you!"},
+            status=status.HTTP_403_FORBIDDEN,
+        )
+    job = await GenerationJob.objects.filter(quiz=quiz).afirst()
+    if not job or not job.task_id:
+        return JsonResponse(
+            {"detail": "No tasks are associated with given quiz id!"},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+    eta = await sync_to_async(predict)(job)  # Time left
+    state, info = await sync_to_async(task_meta)(job.task_id)
+    return progress_response(str(pk), state, info, eta)
@@ -0,0 +1,327 @@
+"""
+Module for autoscaling of Celery worker pools by queue depth.
+
+Every check the supervisor collects tasks in flight on every worker,
+tasks waiting in the broker, generation jobs waiting for dispatch up to
+the number of free generation slots, and the age of the oldest waiting
+job. Pools of workers consuming
+queues from `WORKER_AUTOSCALE["POOLS"]` are resized with the
+`pool_grow` and `pool_shrink` remote control commands to fit the work
+within the bounds of their queues. Every decision is printed and kept
+in Redis for tuning of the bounds.
+"""
+import json
+import math
+import time
+
+from django.conf import settings
+from django.db.models import Count, Min
+from django.utils import timezone
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from quiz.deferred import can_drain
+from quiz.fair_share import free_slots
+from quiz.models import GenerationJob
+
+DECISIONS_KEY = "quiz:autoscale:decisions"
+MAX_DECISIONS = 1000
+
+
+def broker_depth(app, queue):
+    """
+    Count messages waiting in the broker queue.
+
+    Args:
+        app: Celery application.
+        queue: Name of the queue.
+
+    Returns:
+        int: Number of messages not taken by workers.
+    """
+    with app.connection_for_read() as connection:
+        try:
+            declared = connection.default_channel.queue_declare(
+                queue=queue, passive=True
+            )
+        except connection.channel_errors:
+            return 0  # The queue is not declared yet
+        return declared.message_count
+
+
+def queued_jobs():
+    """
+    Count generation jobs waiting for dispatch in every queue.
+
+    Returns:
+        dict: Number of jobs and creation time of the oldest one by name
+            of the queue.
+    """
+    jobs = (
+        GenerationJob.objects.filter(state=GenerationJob.QUEUED)
+        .values("queue", "deferred")
+        .annotate(count=Count("pk"), oldest=Min("created_at"))
+    )
+    drain = None
+    waiting = {}
+    for row in jobs:
+        if row["deferred"]:
+            if drain is None:
+                drain = can_drain()
+            if not drain:
+                continue  # Deferred jobs wait for off-peak hours anyway
+        queue = row["queue"] or settings.GENERATION_QUEUES["DEFAULT"]
+        count, oldest = waiting.get(queue, (0, row["oldest"]))
+        waiting[queue] = (count + row["count"], min(oldest, row["oldest"]))
+    return waiting
+
+
+def worker_pools(app, timeout=1.0):
+    """
+    Get queues, pool size and tasks in flight of running workers.
+
+    Args:
+        app: Celery application.
+        timeout: Seconds to wait for replies of workers.
+
+    Returns:
+        dict: Queues, processes and tasks in flight by name of worker.
+    """
+    inspect = app.control.inspect(timeout=timeout)
+    queues = inspect.active_queues() or {}
+    active = inspect.active() or {}
+    stats = inspect.stats() or {}
+    workers = {}
+    for worker, consumed in queues.items():
+        pool = stats.get(worker, {}).get("pool", {})
+        processes = pool.get("processes")
+        workers[worker] = {
+            "queues": [queue["name"] for queue in consumed],
+            "processes": (
+                len(processes)
+                if isinstance(processes, list)
+                else pool.get("max-concurrency", 0)
+            ),
+            "in_flight": len(active.get(worker, [])),
+        }
+    return workers
+
+
+class Autoscaler:
+    """
+    Supervisor resizing pools of workers.
+
+    Attributes:
+        app: Celery application.
+        pools: Minimal and maximal processes by name of the queue.
+        step: Processes added or removed per check.
+        cooldown: Seconds between the last change and shrinking.
+        target_latency: Seconds the oldest job may wait in the queue.
+        dry_run: Whether to only log decisions.
+        changed: Time of the last change by name of worker.
+    """
+
+    def __init__(
+        self, app, pools, step, cooldown, target_latency, dry_run=False
+    ):
+        self.app = app
+        self.pools = pools
+        self.step = step
+        self.cooldown = cooldown
+        self.target_latency = target_latency
+        self.dry_run = dry_run
+        self.changed = {}
+
+    def bounds(self, queues):
+        """
+        Get bounds of the pool of a worker consuming the queues.
+
+        Args:
+            queues: Names of the queues.
+
+        Returns:
+            Tuple of minimal and maximal number of processes.
+        """
+        limits = [self.pools[queue] for queue in queues]
+        return max(low for low, _ in limits), max(high for _, high in limits)
+
+    def target_size(self, worker, current, demand, latency, bounds):
+        """
+        Choose the pool size of the worker.
+
+        Args:
+            worker: Name of the worker.
+            current: Current number of processes.
+            demand: Tasks in flight and the share of waiting tasks.
+            latency: Seconds the oldest job waits.
+            bounds: Minimal and maximal number of processes.
+
+        Returns:
+            int: Number of processes.
+        """
+        step = self.step
+        if latency > self.target_latency > 0:
+            step *= math.ceil(latency / self.target_latency)
+        target = min(math.ceil(demand), current + step)
+        if target < current:
+            recent = time.monotonic() - self.changed.get(worker, -math.inf)
+            if recent < self.cooldown:
+                target = current  # Waiting for the load to settle
+            target = max(target, current - self.step)
+        return max(bounds[0], min(bounds[1], target))
+
+    def waiting(self, queues):
+        """
+        Count waiting tasks and the age of the oldest job of the queues.
+        Queued jobs are counted only up to the free generation slots,
+        queues with older jobs first, as more are not dispatched anyway.
+
+        Args:
+            queues: Names of the queues.
+
+        Returns:
+            dict: Tasks and seconds the oldest job waits by name of
+                the queue.
+        """
+        jobs = queued_jobs()
+        now = timezone.now()
+        free = free_slots()
+        waiting = {}
+        for queue in sorted(queues, key=lambda q: jobs.get(q, (0, now))[1]):
+            count, oldest = jobs.get(queue, (0, None))
+            count = min(count, free)
+            free -= count
+            latency = (now - oldest).total_seconds() if oldest else 0.0
+            waiting[queue] = (
+                broker_depth(self.app, queue) + count,
+                latency,
+            )
+        return waiting
+
+    def resize(self, worker, current, target):
+        """
+        Grow or shrink the pool of the worker.
+
+        Args:
+            worker: Name of the worker.
+            current: Current number of processes.
+            target: Number of processes.
+        """
+        self.changed[worker] = time.monotonic()
+        if self.dry_run:
+            return
+        if target > current:
+            command = self.app.control.pool_grow
+        else:
+            command = self.app.control.pool_shrink
+        replies = command(
+            abs(target - current), destination=[worker], reply=True
+        )
+        for reply in replies:
+            for name, result in reply.items():
+                if "error" in result:
+                    print(f"Pool of {name} was not resized: {result['error']}")
+
+    def check(self):
+        """
+        Check the load and resize pools of all workers.
+
+        Returns:
+            list[dict]: Decisions made for every worker.
+        """
+        workers = worker_pools(self.app)
+        consumers = {}
+        for worker, pool in workers.items():
+            for queue in pool["queues"]:
+                if queue in self.pools:
+                    consumers.setdefault(queue, []).append(worker)
+        waiting = self.waiting(consumers)
+        decisions = []
+        for worker, pool in workers.items():
+            queues = [q for q in pool["queues"] if q in consumers]
+            if not queues:
+                continue  # Pools of other queues are not managed
+            backlog = sum(
+                waiting[q][0] / len(consumers[q]) for q in queues
+            )  # Waiting tasks are shared by consumers of the queue
+            latency = max(waiting[q][1] for q in queues)
+            current = pool["processes"]
+            target = self.target_size(
+                worker,
+                current,
+                pool["in_flight"] + backlog,
+                latency,
+                self.bounds(queues),
+            )
+            if target != current:
+                self.resize(worker, current, target)
+            decisions.append(
+                {
+                    "time": timezone.now().isoformat(),
+                    "worker": worker,
+                    "queues": queues,
+                    "processes": current,
+                    "in_flight": pool["in_flight"],
+                    "backlog": round(backlog, 1),
+                    "latency": round(latency, 1),
+                    "target": target,
+                }
+            )
+        record(decisions)
+        return decisions
+
+
+def record(decisions):
+    """
+    Keep decisions in Redis for tuning.
+
+    Args:
+        decisions: Decisions made by the supervisor.
+    """
+    if not decisions:
+        return
+    try:
+        with get_redis_connection("default").pipeline() as pipe:
+            pipe.lpush(DECISIONS_KEY, *map(json.dumps, decisions))
+            pipe.ltrim(DECISIONS_KEY, 0, MAX_DECISIONS - 1)
+            pipe.execute()
+    except RedisError as e:
+        print(f"Autoscaling decisions were not recorded: {e}")
+
+
+def history(count):
+    """
+    Get the latest decisions of the supervisor.
+
+    Args:
+        count: Number of decisions.
+
+    Returns:
+        list[dict]: Decisions, the latest first.
+    """
+    decisions = get_redis_connection("default").lrange(
+        DECISIONS_KEY, 0, count - 1
+    )
+    return [json.loads(decision) for decision in decisions]
+
+
+def get_autoscaler(app, dry_run=False):
+    """
+    Get supervisor configured in settings.
+
+    Args:
+        app: Celery application.
+        dry_run: Whether to only log decisions.
+
+    Returns:
+        Autoscaler: The supervisor.
+    """
+    config = settings.WORKER_AUTOSCALE
+    return Autoscaler(
+        app,
+        {queue: tuple(bounds) for queue, bounds in config["POOLS"].items()},
+        config["STEP"],
+        config["COOLDOWN"],
+        config["TARGET_LATENCY"],
+        dry_run=dry_run,
+    )
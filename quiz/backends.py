@@ -0,0 +1,341 @@
+"""
+Module with backends that generate quizzes and their descriptions.
+
+The backend used by the tasks is chosen by `QUIZ_GENERATOR["BACKEND"]`
+setting. Generators of all backends follow the `QuizStreamGenerator`
+interface and describers follow the `QuizDescriber` interface.
+"""
+import math
+import os
+import random
+import re
+import time
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from quiz.llm_cache import files_digest
+
+
+class GeneratorBackend(ABC):
+    """
+    Base class for quiz generator backends.
+    """
+
+    @abstractmethod
+    def get_generator(self):
+        """
+        Get quiz stream generator.
+
+        Returns:
+            Object with `create_quiz_from_files` method.
+        """
+
+    @abstractmethod
+    def get_describer(self):
+        """
+        Get quiz describer.
+
+        Returns:
+            Object with `generate_description` method.
+        """
+
+
+class QuizGeneratorModelBackend(GeneratorBackend):
+    """
+    Backend using the large language model from QuizGeneratorModel
+    submodule.
+    """
+
+    def get_generator(self):
+        from QuizGeneratorModel.quiz_craft_package import (
+            quiz_stream_generator,
+        )
+
+        return quiz_stream_generator.QuizStreamGenerator(debug=False)
+
+    def get_describer(self):
+        from QuizGeneratorModel.quiz_craft_package import quiz_describer
+
+        return quiz_describer.QuizDescriber()
+
+
+class SyntheticQuestion:
+    """
+    Multiple choice question made by the synthetic backend.
+
+    Attributes:
+        question_text: Text of the question.
+        options: List of option texts.
+        right_answers: List of correct option texts.
+    """
+
+    def __init__(self, question_text, options, right_answers):
+        self.question_text = question_text
+        self.options = options
+        self.right_answers = right_answers
+
+
+class SyntheticQuiz:
+    """
+    Quiz made by the synthetic backend, mirrors the interface
+    of `NagimQuiz`.
+    """
+
+    def __init__(self):
+        self.questions = []
+        self.description = ""
+
+    def __len__(self):
+        return len(self.questions)
+
+    def get_question(self, i):
+        """
+        Get question by index.
+
+        Args:
+            i: Index of the question.
+
+        Returns:
+            SyntheticQuestion: The question.
+        """
+        return self.questions[i]
+
+    def set_description(self, description):
+        """
+        Set description of the quiz.
+
+        Args:
+            description: Text of the description.
+        """
+        self.description = description
+
+
+class Latency:
+    """
+    Distribution of the upstream call latency.
+
+    Attributes:
+        distribution: "constant", "uniform" or "lognormal".
+        median: Median latency in seconds.
+        spread: Half-width for uniform or sigma for lognormal
+            distribution.
+    """
+
+    def __init__(self, distribution, median, spread):
+        self.distribution = distribution
+        self.median = median
+        self.spread = spread
+
+    def sample(self, rng):
+        """
+        Sample latency.
+
+        Args:
+            rng: Random number generator.
+
+        Returns:
+            float: Latency in seconds.
+        """
+        if self.distribution == "uniform":
+            return max(0.0, rng.uniform(-1, 1) * self.spread + self.median)
+        if self.distribution == "lognormal" and self.median > 0:
+            return rng.lognormvariate(math.log(self.median), self.spread)
+        return self.median
+
+
+WORDS = (
+    "algorithm analysis atom cell climate data energy equation evolution "
+    "force function graph history language law market matrix memory model "
+    "network organism planet pressure process protein reaction signal "
+    "society structure system theory value velocity voltage"
+).split()
+
+
+class SyntheticGenerator:
+    """
+    Deterministic quiz stream generator without upstream calls.
+
+    Materials are split into chunks of `chunk_size` bytes like the
+    text chunks of the model generator, every chunk gives
+    `questions_per_chunk` questions after a sampled latency.
+    The output depends only on the seed and the content of the files.
+    """
+
+    supports_resume = True
+
+    def __init__(self, seed, chunk_size, questions_per_chunk, latency):
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.questions_per_chunk = questions_per_chunk
+        self.latency = latency
+
+    def create_quiz_from_files(
+        self, file_names, max_questions=None, resume_from=None
+    ):
+        """
+        Create quiz from files.
+
+        Args:
+            file_names: List of file names.
+            max_questions: Max questions.
+            resume_from: Quiz and number of processed chunks to resume
+                generation from.
+
+        Yields:
+            Tuple of generated quiz, current chunk and total chunks.
+        """
+        rng = random.Random(f"{self.seed}:{files_digest(file_names)}")
+        size = sum(os.path.getsize(file_name) for file_name in file_names)
+        total = max(1, math.ceil(size / self.chunk_size))
+        quiz, processed = resume_from or (SyntheticQuiz(), 0)
+        for i in range(1, total + 1):
+            latency = self.latency.sample(rng)
+            questions = [
+                make_question(rng) for _ in range(self.questions_per_chunk)
+            ]
+            if i <= processed:
+                continue  # Chunk is in the checkpoint, only replaying rng
+            time.sleep(latency)
+            if max_questions:
+                questions = questions[: max(0, max_questions - len(quiz))]
+            quiz.questions.extend(questions)
+            yield quiz, i, total
+
+
+def make_sentence(rng, low, high):
+    """
+    Make random sentence.
+
+    Args:
+        rng: Random number generator.
+        low: Minimal number of words.
+        high: Maximal number of words.
+
+    Returns:
+        str: The sentence.
+    """
+    words = rng.choices(WORDS, k=rng.randint(low, high))
+    return " ".join(words).capitalize()
+
+
+def make_question(rng):
+    """
+    Make random multiple choice question of realistic size.
+
+    Args:
+        rng: Random number generator.
+
+    Returns:
+        SyntheticQuestion: The question.
+    """
+    options = [make_sentence(rng, 1, 6) for _ in range(4)]
+    right_answers = rng.sample(options, k=rng.choice((1, 1, 1, 2)))
+    return SyntheticQuestion(
+        make_sentence(rng, 8, 25) + "?", options, right_answers
+    )
+
+
+class SyntheticDescriber:
+    """
+    Deterministic quiz describer without upstream calls.
+    """
+
+    def __init__(self, seed, latency):
+        self.seed = seed
+        self.latency = latency
+
+    def _describe(self, rng):
+        return make_sentence(rng, 15, 40) + "."
+
+    def generate_description(self, ml_quiz):
+        """
+        Generate description for the quiz.
+
+        Args:
+            ml_quiz: Quiz generated by the synthetic generator.
+
+        Returns:
+            Quiz with description.
+        """
+        texts = [
+            ml_quiz.get_question(i).question_text
+            for i in range(len(ml_quiz))
+        ]
+        rng = random.Random(f"{self.seed}:{texts}")
+        time.sleep(self.latency.sample(rng))
+        ml_quiz.set_description(self._describe(rng))
+        return ml_quiz
+
+    def complete(self, prompt):
+        """
+        Answer the batched description prompt.
+
+        Args:
+            prompt: Prompt with numbered quizzes.
+
+        Returns:
+            str: One "<number>: <description>" line per quiz.
+        """
+        rng = random.Random(f"{self.seed}:{prompt}")
+        time.sleep(self.latency.sample(rng))
+        numbers = re.findall(r"^Quiz (\d+):$", prompt, flags=re.MULTILINE)
+        return "\n".join(
+            f"{number}: {self._describe(rng)}" for number in numbers
+        )
+
+
+class SyntheticBackend(GeneratorBackend):
+    """
+    Backend producing deterministic synthetic quizzes with configurable
+    latency, used for load testing without the language model.
+    """
+
+    def __init__(
+        self,
+        seed=0,
+        chunk_size=4000,
+        questions_per_chunk=3,
+        latency_distribution="lognormal",
+        chunk_latency=2.0,
+        description_latency=1.0,
+        latency_spread=0.5,
+    ):
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.questions_per_chunk = questions_per_chunk
+        self.chunk_latency = Latency(
+            latency_distribution, chunk_latency, latency_spread
+        )
+        self.description_latency = Latency(
+            latency_distribution, description_latency, latency_spread
+        )
+
+    def get_generator(self):
+        return SyntheticGenerator(
+            self.seed,
+            self.chunk_size,
+            self.questions_per_chunk,
+            self.chunk_latency,
+        )
+
+    def get_describer(self):
+        return SyntheticDescriber(self.seed, self.description_latency)
+
+
+_backend = None
+
+
+def get_generator_backend():
+    """
+    Get generator backend configured in settings.
+
+    Returns:
+        GeneratorBackend: Backend instance shared inside the process.
+    """
+    global _backend
+    if _backend is None:
+        backend_class = import_string(settings.QUIZ_GENERATOR["BACKEND"])
+        _backend = backend_class(**settings.QUIZ_GENERATOR["OPTIONS"])
+    return _backend
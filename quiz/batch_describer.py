@@ -0,0 +1,136 @@
+"""
+Module for generating descriptions of several quizzes with one model call.
+"""
+import re
+
+from quiz.llm_cache import model_name
+
+BATCH_PROMPT = (
+    "Write a short description for each of the following quizzes. "
+    "Answer with exactly one line per quiz in the format "
+    '"<quiz number>: <description>".'
+)
+ANSWER_LINE = re.compile(r"^\s*(\d+)\s*[:.)]\s*(.+?)\s*$")
+
+
+def build_batch_prompt(ml_quizzes):
+    """
+    Build one prompt asking for descriptions of all given quizzes.
+
+    Args:
+        ml_quizzes: List of quizzes generated by the model.
+
+    Returns:
+        str: Prompt for the model.
+    """
+    parts = [BATCH_PROMPT]
+    for number, ml_quiz in enumerate(ml_quizzes, start=1):
+        parts.append(f"\nQuiz {number}:")
+        parts.extend(
+            f"- {ml_quiz.get_question(i).question_text}"
+            for i in range(len(ml_quiz))
+        )
+    return "\n".join(parts)
+
+
+def parse_batch_response(response, count):
+    """
+    Parse descriptions from the answer on the batch prompt.
+
+    Args:
+        response: Text of the model answer.
+        count: Number of quizzes in the prompt.
+
+    Returns:
+        list[Union[str, None]]: Description for each quiz, None for
+            quizzes without parsable description.
+    """
+    descriptions = [None] * count
+    for line in (response or "").splitlines():
+        match = ANSWER_LINE.match(line)
+        if not match:
+            continue
+        number = int(match.group(1))
+        if 1 <= number <= count and descriptions[number - 1] is None:
+            descriptions[number - 1] = match.group(2)
+    return descriptions
+
+
+class BatchQuizDescriber:
+    """
+    Wrapper of quiz describer that describes several quizzes at once.
+
+    One batched call is used when the describer exposes raw
+    completions via `complete(prompt)`. Quizzes whose description could
+    not be parsed from the batched answer are described one by one, and
+    quizzes failing that as well are returned as None.
+    """
+
+    def __init__(self, describer):
+        self.describer = describer
+        self.model_name = model_name(describer)
+
+    @property
+    def supports_batch(self):
+        """
+        Whether the wrapped describer can run a batched call.
+        """
+        return callable(getattr(self.describer, "complete", None))
+
+    def generate_description(self, ml_quiz):
+        """
+        Generate description for one quiz.
+
+        Args:
+            ml_quiz: Quiz generated by the model.
+
+        Returns:
+            Quiz with description.
+        """
+        return self.describer.generate_description(ml_quiz)
+
+    def describe_one(self, ml_quiz):
+        """
+        Describe the quiz with a single call.
+
+        Args:
+            ml_quiz: Quiz generated by the model.
+
+        Returns:
+            Quiz with description or None if the call failed.
+        """
+        try:
+            return self.describer.generate_description(ml_quiz)
+        except Exception as e:
+            print(f"Description of a quiz failed: {e}")
+            return None
+
+    def generate_descriptions(self, ml_quizzes):
+        """
+        Generate descriptions for several quizzes.
+
+        Args:
+            ml_quizzes: List of quizzes generated by the model.
+
+        Returns:
+            list: Quizzes with descriptions in the same order, None for
+                quizzes that could not be described.
+        """
+        descriptions = [None] * len(ml_quizzes)
+        if self.supports_batch and len(ml_quizzes) > 1:
+            try:
+                response = self.describer.complete(
+                    build_batch_prompt(ml_quizzes)
+                )
+                descriptions = parse_batch_response(response, len(ml_quizzes))
+            except Exception as e:
+                # Falling back to single calls for all quizzes
+                print(f"Batched description failed: {e}")
+        described = []
+        for ml_quiz, description in zip(ml_quizzes, descriptions):
+            if description:
+                ml_quiz.set_description(description)
+            else:
+                ml_quiz = self.describe_one(ml_quiz)
+            described.append(ml_quiz)
+        return described
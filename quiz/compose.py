@@ -0,0 +1,288 @@
+"""
+Module for composing quizzes from the existing question bank.
+
+Questions of public ready quizzes found by the search index, by topic
+or by key word are sampled with maximal marginal relevance: every next
+question is the most relevant one that is least similar to the already
+chosen questions, and a source quiz gives at most
+`QUIZ_COMPOSE["MAX_PER_QUIZ"]` questions. Chosen questions are copied
+to a new quiz that is ready at once, no model calls are made.
+"""
+import operator
+import random
+import re
+from functools import reduce
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+
+from app.SearchDB import get_search_db
+from quiz.models import (
+    MCQOption,
+    MCQQuestion,
+    OpenEndedQuestion,
+    Question,
+    Quiz,
+    TrueFalseQuestion,
+)
+
+COPIED_TYPES = (Question.MCQ, Question.TRUE_FALSE, Question.OPEN_ENDED)
+
+
+def words(text):
+    """
+    Get set of meaningful words of the text.
+
+    Args:
+        text: Text of a question or a query.
+
+    Returns:
+        set[str]: Lowercase words longer than two characters.
+    """
+    return {word for word in re.findall(r"\w+", text.lower()) if len(word) > 2}
+
+
+def similarity(first, second):
+    """
+    Measure Jaccard similarity of two sets of words.
+
+    Args:
+        first: Set of words.
+        second: Set of words.
+
+    Returns:
+        float: Similarity from 0 to 1.
+    """
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def search_ranks(query):
+    """
+    Rank quizzes similar to the query by the search index.
+
+    Args:
+        query: Search query.
+
+    Returns:
+        dict: Relevance from 0 to 1 by quiz id, empty if the index
+            is unavailable.
+    """
+    try:
+        results = get_search_db().search_quiz(
+            query, number_of_results=settings.QUIZ_COMPOSE["SEARCH_RESULTS"]
+        )
+    except Exception as e:
+        print(f"Search index is unavailable for composing: {e}")
+        return {}
+    return {int(result[1]): 1 / (1 + i) for i, result in enumerate(results)}
+
+
+def sample_window(questions, size):
+    """
+    Take questions from a random position of the primary key index
+    instead of shuffling all matching questions.
+
+    Args:
+        questions: QuerySet of questions.
+        size: Maximal number of questions.
+
+    Returns:
+        list[Question]: Questions ordered by primary key.
+    """
+    bounds = Question.objects.aggregate(low=Min("pk"), high=Max("pk"))
+    if bounds["low"] is None:
+        return []
+    start = random.randint(bounds["low"], bounds["high"])
+    window = list(questions.filter(pk__gte=start).order_by("pk")[:size])
+    if len(window) < size:  # Wrapping around to the first questions
+        window += questions.filter(pk__lt=start).order_by("pk")[
+            : size - len(window)
+        ]
+    return window
+
+
+def candidate_questions(query="", topic=None, key_word=None):
+    """
+    Find questions that can be copied to the composed quiz.
+
+    Args:
+        query: Search query.
+        topic: Id of the topic.
+        key_word: Key word of the topic.
+
+    Returns:
+        list: Pairs of questions and their relevance.
+    """
+    quizzes = Quiz.objects.filter(private=False, ready=True)
+    if topic is not None:
+        quizzes = quizzes.filter(topic_id=topic)
+    if key_word:
+        quizzes = quizzes.filter(topic__key_words__name__iexact=key_word)
+    questions = (
+        Question.objects.filter(type_id__in=COPIED_TYPES)
+        .select_related(
+            "mcq_question", "true_false_question", "open_ended_question"
+        )
+        .prefetch_related("mcq_question__options")
+    )
+    limit = settings.QUIZ_COMPOSE["CANDIDATES"]
+    query_words = words(query)
+    ranks = search_ranks(query) if query else {}
+    if ranks:
+        ranked = quizzes.filter(pk__in=ranks)
+        questions = questions.filter(quiz__in=ranked)[:limit]
+    else:
+        if query_words:  # Matching words of the query without the index
+            questions = questions.filter(
+                reduce(
+                    operator.or_,
+                    (Q(text__icontains=word) for word in query_words),
+                )
+            )
+        questions = sample_window(questions.filter(quiz__in=quizzes), limit)
+    candidates = []
+    for question in questions:
+        overlap = len(query_words & words(question.text))
+        relevance = ranks.get(question.quiz_id, 0.0)
+        if query_words:
+            relevance += overlap / len(query_words)
+        candidates.append((question, relevance))
+    return candidates
+
+
+def unique_questions(candidates):
+    """
+    Drop copies of the same question from the candidates.
+
+    Args:
+        candidates: Pairs of questions and their relevance.
+
+    Returns:
+        list[list]: Question, relevance, set of words and redundancy
+            for every unique question.
+    """
+    pool = []
+    seen = set()
+    for question, relevance in candidates:
+        text = " ".join(question.text.lower().split())
+        if text not in seen:  # Copies of the same question
+            seen.add(text)
+            pool.append([question, relevance, words(question.text), 0.0])
+    return pool
+
+
+def diverse_sample(candidates, count, diversity, max_per_quiz):
+    """
+    Choose relevant questions that are not similar to each other.
+    Redundancy of every question, its maximal similarity to the chosen
+    ones, is updated only against the last chosen question.
+
+    Args:
+        candidates: Pairs of questions and their relevance.
+        count: Number of questions to choose.
+        diversity: Weight of dissimilarity from 0 to 1 against relevance.
+        max_per_quiz: Maximal number of questions from one quiz.
+
+    Returns:
+        list[Question]: Chosen questions.
+    """
+    pool = unique_questions(candidates)
+    chosen, per_quiz = [], {}
+    while pool and len(chosen) < count:
+        best = max(
+            range(len(pool)),
+            key=lambda i: (1 - diversity) * pool[i][1]
+            - diversity * pool[i][3],
+        )
+        question, _, question_words, _ = pool.pop(best)
+        chosen.append(question)
+        per_quiz[question.quiz_id] = per_quiz.get(question.quiz_id, 0) + 1
+        pool = [
+            entry
+            for entry in pool
+            if per_quiz.get(entry[0].quiz_id, 0) < max_per_quiz
+        ]  # Quizzes that have given their share are dropped
+        for entry in pool:
+            entry[3] = max(entry[3], similarity(entry[2], question_words))
+    return chosen
+
+
+def copy_questions(quiz, questions):
+    """
+    Copy questions with their answers to the quiz.
+
+    Args:
+        quiz: Quiz from the database.
+        questions: Questions to copy.
+    """
+    copies = Question.objects.bulk_create(
+        [
+            Question(text=question.text, type_id=question.type_id, quiz=quiz)
+            for question in questions
+        ]
+    )
+    mcq, options, true_false, open_ended = [], [], [], []
+    for question, copy in zip(questions, copies):
+        if question.type_id == Question.MCQ:
+            mcq.append(MCQQuestion(question=copy))
+            options += [
+                MCQOption(
+                    text=option.text,
+                    correct=option.correct,
+                    question_id=copy.pk,
+                )
+                for option in question.mcq_question.options.all()
+            ]
+        elif question.type_id == Question.TRUE_FALSE:
+            answer = question.true_false_question.answer
+            true_false.append(TrueFalseQuestion(question=copy, answer=answer))
+        else:
+            answer = question.open_ended_question.answer
+            open_ended.append(OpenEndedQuestion(question=copy, answer=answer))
+    MCQQuestion.objects.bulk_create(mcq)
+    MCQOption.objects.bulk_create(options)
+    TrueFalseQuestion.objects.bulk_create(true_false)
+    OpenEndedQuestion.objects.bulk_create(open_ended)
+
+
+def compose_quiz(creator, name, count, query="", topic=None, **optional):
+    """
+    Compose a ready quiz from questions of existing quizzes.
+
+    Args:
+        creator: Creator of the quiz.
+        name: Name of the quiz.
+        count: Number of questions.
+        query: Search query.
+        topic: Id of the topic.
+        **optional: Key word of the topic, description and privacy of
+            the quiz.
+
+    Returns:
+        Tuple of the quiz and ids of source quizzes, the quiz is None
+            if no questions are found.
+    """
+    config = settings.QUIZ_COMPOSE
+    questions = diverse_sample(
+        candidate_questions(query, topic, optional.pop("key_word", None)),
+        count,
+        config["DIVERSITY"],
+        config["MAX_PER_QUIZ"],
+    )
+    if not questions:
+        return None, []
+    with transaction.atomic():
+        quiz = Quiz.objects.create(
+            name=name,
+            creator=creator,
+            topic_id=topic,
+            ready=True,
+            created_at=timezone.now(),
+            **optional,
+        )
+        copy_questions(quiz, questions)
+    return quiz, sorted({question.quiz_id for question in questions})
@@ -0,0 +1,132 @@
+"""
+Module for the policy of deferred generation.
+
+Deferred jobs are dispatched only inside off-peak windows or when few
+urgent jobs are waiting and the rate limit of the upstream model is
+mostly unused, so they fill the capacity left between daily peaks.
+"""
+import datetime
+
+from django.conf import settings
+from django.utils import timezone
+
+from quiz.fair_share import active_jobs
+from quiz.models import GenerationJob
+from quiz.rate_limit import get_rate_limiter
+
+
+def parse_windows(windows):
+    """
+    Parse off-peak windows.
+
+    Args:
+        windows: Comma-separated windows like "22:00-06:00".
+
+    Returns:
+        list: Pairs of start and end times, the end can be before
+            the start for windows crossing midnight.
+    """
+    parsed = []
+    for window in filter(None, windows.replace(" ", "").split(",")):
+        start, end = window.split("-")
+        parsed.append(
+            (
+                datetime.time.fromisoformat(start),
+                datetime.time.fromisoformat(end),
+            )
+        )
+    return parsed
+
+
+def in_window(moment, start, end):
+    """
+    Check if the time is inside the window.
+
+    Args:
+        moment: Time of day.
+        start: Start of the window.
+        end: End of the window.
+
+    Returns:
+        bool: True if the time is inside the window.
+    """
+    if start <= end:
+        return start <= moment < end
+    return moment >= start or moment < end  # Window crosses midnight
+
+
+def is_off_peak(now=None):
+    """
+    Check if now is inside one of the off-peak windows.
+
+    Args:
+        now: Aware date and time, defaults to now.
+
+    Returns:
+        bool: True inside an off-peak window.
+    """
+    moment = timezone.localtime(now).time()
+    windows = parse_windows(settings.DEFERRED_GENERATION["OFF_PEAK"])
+    return any(in_window(moment, start, end) for start, end in windows)
+
+
+def seconds_until_off_peak(now=None):
+    """
+    Count seconds until the next off-peak window starts.
+
+    Args:
+        now: Aware date and time, defaults to now.
+
+    Returns:
+        Union[float, None]: Seconds, 0 inside a window, None if there
+            are no windows.
+    """
+    now = timezone.localtime(now)
+    if is_off_peak(now):
+        return 0.0
+    starts = []
+    for start, _ in parse_windows(settings.DEFERRED_GENERATION["OFF_PEAK"]):
+        moment = now.replace(
+            hour=start.hour, minute=start.minute, second=0, microsecond=0
+        )
+        if moment <= now:
+            moment += datetime.timedelta(days=1)
+        starts.append((moment - now).total_seconds())
+    return min(starts, default=None)
+
+
+def can_drain():
+    """
+    Check if deferred jobs can be dispatched now.
+
+    Returns:
+        bool: True inside off-peak windows or when the urgent queue and
+            the rate limit usage are below thresholds.
+    """
+    if is_off_peak():
+        return True
+    policy = settings.DEFERRED_GENERATION
+    waiting = GenerationJob.objects.filter(
+        state=GenerationJob.QUEUED, deferred=False
+    ).count()
+    return (
+        waiting <= policy["MAX_QUEUE_DEPTH"]
+        and get_rate_limiter().usage() <= policy["MAX_RATE_USAGE"]
+    )
+
+
+def deferred_capacity(capacity):
+    """
+    Limit free slots available to deferred jobs.
+
+    Args:
+        capacity: Number of free slots.
+
+    Returns:
+        int: Number of slots for deferred jobs.
+    """
+    running = active_jobs().filter(
+        state=GenerationJob.RUNNING, deferred=True
+    )
+    slots = settings.DEFERRED_GENERATION["MAX_SLOTS"] - running.count()
+    return max(0, min(capacity, slots))
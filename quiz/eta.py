@@ -0,0 +1,262 @@
+"""
+Module for predicting the time left until the quiz is generated.
+
+Durations of generation stages (text extraction with the first chunk,
+every next chunk, description and indexing) and of whole jobs are kept
+in Redis as exponentially weighted moving averages. Averages are updated
+as jobs complete and fitted from timings of finished jobs when Redis has
+none. Time in the queue is predicted from the number of jobs waiting
+and running before the job.
+"""
+import datetime
+import math
+import time
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from quiz.deferred import can_drain, seconds_until_off_peak
+from quiz.fair_share import running_jobs
+from quiz.models import GenerationJob
+
+MODEL_KEY = "quiz:eta:model"
+EXTRACTION = "extraction"
+CHUNK = "chunk"
+DESCRIPTION = "description"
+INDEXING = "indexing"
+JOB = "job"
+TOKENS_PER_CHUNK = "tokens_per_chunk"
+
+# Moving average updated atomically, the first value is taken as is
+EWMA_SCRIPT = """
+local old = redis.call('HGET', KEYS[1], ARGV[1])
+local value = tonumber(ARGV[2])
+if old then
+    value = tonumber(old) + tonumber(ARGV[3]) * (value - tonumber(old))
+end
+redis.call('HSET', KEYS[1], ARGV[1], value)
+return tostring(value)
+"""
+
+
+def observe(name, value):
+    """
+    Recalibrate the model with observed duration of the stage.
+
+    Args:
+        name: Name of the stage.
+        value: Observed duration in seconds or tokens per chunk.
+    """
+    try:
+        get_redis_connection("default").eval(
+            EWMA_SCRIPT,
+            1,
+            MODEL_KEY,
+            name,
+            value,
+            settings.GENERATION_ETA["ALPHA"],
+        )
+    except RedisError as e:
+        print(f"Timing of {name} was not recorded: {e}")
+
+
+def fit_from_history():
+    """
+    Fit the model as mean timings of recently finished jobs and store
+    it in Redis.
+
+    Returns:
+        dict: Fitted values by name, without names missing in history.
+    """
+    jobs = GenerationJob.objects.filter(finished_at__isnull=False).order_by(
+        "-finished_at"
+    )[: settings.GENERATION_ETA["HISTORY"]]
+    values = {}
+    for timings in jobs.values_list("timings", flat=True):
+        for name, value in timings.items():
+            values.setdefault(name, []).append(value)
+    model = {name: sum(items) / len(items) for name, items in values.items()}
+    if model:
+        try:
+            get_redis_connection("default").hset(MODEL_KEY, mapping=model)
+        except RedisError as e:
+            print(f"Fitted timings were not stored: {e}")
+    return model
+
+
+def get_model():
+    """
+    Get current timings of the model.
+
+    Returns:
+        dict: Duration of every stage in seconds and tokens per chunk.
+    """
+    try:
+        stored = get_redis_connection("default").hgetall(MODEL_KEY)
+    except RedisError:
+        stored = {}
+    model = {name.decode(): float(value) for name, value in stored.items()}
+    if not model:
+        model = fit_from_history()
+    return {**settings.GENERATION_ETA["DEFAULTS"], **model}
+
+
+class StageTimer:
+    """
+    Timer of the generation stages of one job. Every measured stage
+    recalibrates the model.
+
+    Attributes:
+        timings: Duration of stages of the job, the chunk duration is
+            the mean of all chunks.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self._chunks = 0
+        self._current = None
+        self._last = time.perf_counter()
+
+    def lap(self):
+        """
+        Restart the timer.
+
+        Returns:
+            float: Seconds since the previous lap.
+        """
+        now = time.perf_counter()
+        elapsed, self._last = now - self._last, now
+        return elapsed
+
+    def chunk(self, current):
+        """
+        Measure the stage finished by the processed chunk.
+
+        Args:
+            current: Number of processed chunks.
+        """
+        elapsed = self.lap()
+        if self._current is None:
+            self.timings[EXTRACTION] = elapsed
+            if current == 1:  # Not resumed and not served by the cache
+                observe(EXTRACTION, elapsed)
+        elif current > self._current:
+            chunks = current - self._current
+            mean = self.timings.get(CHUNK, 0.0)
+            self.timings[CHUNK] = (mean * self._chunks + elapsed) / (
+                self._chunks + chunks
+            )
+            self._chunks += chunks
+            observe(CHUNK, elapsed / chunks)
+        self._current = current
+
+    def stage(self, name):
+        """
+        Measure the stage finished now.
+
+        Args:
+            name: Name of the stage.
+        """
+        self.timings[name] = self.lap()
+        observe(name, self.timings[name])
+
+
+def finish_job(job, timings):
+    """
+    Save timings of the finished job and recalibrate the duration of
+    jobs and the number of tokens per chunk.
+
+    Args:
+        job: Generation job of the ready quiz.
+        timings: Timings measured by the task.
+    """
+    job.finished_at = timezone.now()
+    job.timings = {**job.timings, **timings}
+    if job.started_at:
+        job.timings[JOB] = (job.finished_at - job.started_at).total_seconds()
+        observe(JOB, job.timings[JOB])
+    if job.estimated_tokens and job.total:
+        job.timings[TOKENS_PER_CHUNK] = job.estimated_tokens / job.total
+        observe(TOKENS_PER_CHUNK, job.timings[TOKENS_PER_CHUNK])
+
+
+def queue_wait(job, model):
+    """
+    Predict time until the job is taken by a worker. Deferred jobs
+    wait for all urgent jobs and for the next off-peak window when they
+    cannot be dispatched now.
+
+    Args:
+        job: Generation job waiting in the queue.
+        model: Timings of the model.
+
+    Returns:
+        float: Seconds in the queue.
+    """
+    ahead = Q(created_at__lt=job.created_at, deferred=job.deferred)
+    if job.deferred:
+        ahead |= Q(deferred=False)
+    waiting = GenerationJob.objects.filter(
+        ahead, state=GenerationJob.QUEUED
+    ).count()
+    running = running_jobs()
+    workers = settings.GENERATION_SLOTS
+    # Running jobs are half done on average
+    backlog = waiting + running / 2 - (workers - min(running, workers))
+    delay = 0.0
+    if job.deferred and not can_drain():
+        delay = seconds_until_off_peak() or 0.0
+    return delay + max(0.0, backlog) * model[JOB] / workers
+
+
+def generation_time(job, model):
+    """
+    Predict time until all chunks of the job are processed.
+
+    Args:
+        job: Generation job.
+        model: Timings of the model.
+
+    Returns:
+        float: Seconds of the generation.
+    """
+    if job.total:
+        return max(0, job.total - job.current) * model[CHUNK]
+    chunks = max(1, math.ceil(job.estimated_tokens / model[TOKENS_PER_CHUNK]))
+    seconds = model[EXTRACTION] + (chunks - 1) * model[CHUNK]
+    if job.started_at:
+        seconds -= (timezone.now() - job.started_at).total_seconds()
+    return max(0.0, seconds)
+
+
+def predict(job):
+    """
+    Predict time left until the quiz of the job is ready.
+
+    Args:
+        job: Generation job.
+
+    Returns:
+        dict: Seconds in the queue, seconds left in total and predicted
+            finish time.
+    """
+    if job.finished_at:
+        queue, remaining = 0.0, 0.0
+    else:
+        model = get_model()
+        queue = 0.0 if job.started_at else queue_wait(job, model)
+        remaining = (
+            queue
+            + generation_time(job, model)
+            + model[DESCRIPTION]
+            + settings.DESCRIPTION_BATCH["WINDOW"]
+            + model[INDEXING]
+        )
+    return {
+        "queue": round(queue, 1),
+        "remaining": round(remaining, 1),
+        "finish_at": timezone.now() + datetime.timedelta(seconds=remaining),
+    }
@@ -0,0 +1,86 @@
+"""
+Module for running database calls of tasks in the green-thread
+execution mode.
+
+With `CELERY_POOL=gevent` one worker process drives many generation
+tasks as greenlets, because most of their time is spent waiting on the
+upstream model. Database drivers block the event loop and Django opens a
+connection per greenlet, so database calls of the tasks are sent to a
+small pool of OS threads, each keeping its own connection between calls.
+
+The gevent pool of Celery neither sends soft time limits nor terminates
+revoked tasks, so generation tasks check their soft deadline and
+cancellation cooperatively after every chunk. The hard time limit is
+raised in the task as `gevent.Timeout`, which is not an `Exception`,
+so tasks catch `TASK_ERRORS` to clean up after it.
+"""
+from django.conf import settings
+from django.db import connections
+
+
+def is_green():
+    """
+    Check if the process runs in the green-thread execution mode.
+
+    Returns:
+        bool: True if gevent has patched the standard library.
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("socket")
+
+
+def _task_errors():
+    try:
+        from gevent import Timeout
+    except ImportError:
+        return (Exception,)
+    return (Exception, Timeout)  # Hard time limit of the gevent pool
+
+
+TASK_ERRORS = _task_errors()
+
+
+def drop_broken_connections():
+    """
+    Close connections of the current thread broken by an error, healthy
+    connections are kept for the next call.
+    """
+    for connection in connections.all(initialized_only=True):
+        if connection.connection is None or not connection.errors_occurred:
+            continue
+        if connection.is_usable():
+            connection.errors_occurred = False
+        else:
+            connection.close()
+
+
+def _call(func, args, kwargs):
+    drop_broken_connections()
+    return func(*args, **kwargs)
+
+
+def run_db(func, *args, **kwargs):
+    """
+    Run function making database calls. In the green-thread execution
+    mode it runs in the database thread pool, otherwise it is called
+    directly.
+
+    Args:
+        func: Function to call.
+        *args: Positional arguments of the function.
+        **kwargs: Keyword arguments of the function.
+
+    Returns:
+        Result of the function.
+    """
+    if not is_green():
+        return func(*args, **kwargs)
+    from gevent import get_hub
+
+    threadpool = get_hub().threadpool
+    if threadpool.maxsize != settings.GREEN_POOL_DB_THREADS:
+        threadpool.maxsize = settings.GREEN_POOL_DB_THREADS
+    return threadpool.apply(_call, (func, args, kwargs))
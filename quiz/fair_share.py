@@ -0,0 +1,218 @@
+"""
+Module for fair sharing of generation slots between users.
+
+Generation jobs wait in the database until the dispatcher sends them to
+Celery. Free slots are given to users by deficit round-robin: every
+round each user with queued jobs is credited with `FAIR_SHARE["QUANTUM"]`
+tokens multiplied by the weight of the user tier, and the oldest jobs
+of the user are dispatched while their estimated tokens fit into the
+credit. Light users get their small jobs dispatched in the first round
+while a user with a backlog of large documents waits for the credit to
+accumulate.
+"""
+import datetime
+from collections import deque
+
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.db.models import Q
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from quiz.models import GenerationJob
+
+DEFICIT_KEY = "quiz:fair_share:deficit{}"  # Credit of users in tokens
+NEXT_KEY = "quiz:fair_share:next{}"  # User to start the next round from
+
+
+def job_cost(job):
+    """
+    Get the cost of the job in tokens.
+
+    Args:
+        job: Generation job.
+
+    Returns:
+        int: Estimated tokens of the materials, at least 1.
+    """
+    return max(1, job.estimated_tokens)
+
+
+def user_weights(user_ids):
+    """
+    Get dispatch weights of users by the groups they belong to.
+
+    Args:
+        user_ids: Ids of users.
+
+    Returns:
+        dict: Weight by user id.
+    """
+    default = settings.FAIR_SHARE["DEFAULT_WEIGHT"]
+    tiers = settings.FAIR_SHARE["WEIGHTS"]
+    weights = dict.fromkeys(user_ids, default)
+    groups = Group.objects.filter(
+        user__in=user_ids, name__in=tiers
+    ).values_list("user", "name")
+    for user_id, name in groups:
+        weights[user_id] = max(weights[user_id], tiers[name])
+    return weights
+
+
+class DeficitRoundRobin:
+    """
+    Deficit round-robin selection of jobs from queues of users.
+
+    Attributes:
+        queues: Queued jobs of every user, oldest first.
+        weights: Weight by user id.
+        deficits: Credit of every user in tokens.
+        quantum: Credit of a user with weight 1 per round.
+        order: Ids of users in the order of the round.
+    """
+
+    def __init__(self, queues, weights, deficits, quantum, start=None):
+        self.queues = queues
+        self.weights = weights
+        self.deficits = {user: deficits.get(user, 0.0) for user in queues}
+        self.quantum = quantum
+        self.order = sorted(queues)
+        if start in self.order:  # Continuing the interrupted round
+            i = self.order.index(start)
+            self.order = self.order[i:] + self.order[:i]
+
+    def visit(self, user, capacity):
+        """
+        Credit the user and take jobs fitting into the credit.
+
+        Args:
+            user: Id of the user.
+            capacity: Maximal number of jobs to take.
+
+        Returns:
+            list: Taken jobs.
+        """
+        queue = self.queues[user]
+        self.deficits[user] += self.quantum * self.weights[user]
+        taken = []
+        while queue and len(taken) < capacity:
+            if job_cost(queue[0]) > self.deficits[user]:
+                break
+            job = queue.popleft()
+            self.deficits[user] -= job_cost(job)
+            taken.append(job)
+        if not queue:
+            del self.queues[user]
+            self.deficits[user] = 0.0  # Idle users do not save credit
+        return taken
+
+    def select(self, capacity):
+        """
+        Select jobs for free slots.
+
+        Args:
+            capacity: Number of free slots.
+
+        Returns:
+            Tuple of selected jobs and id of the user to start the next
+                round from.
+        """
+        selected = []
+        while self.queues:
+            for i, user in enumerate(self.order):
+                if user not in self.queues:
+                    continue
+                selected += self.visit(user, capacity - len(selected))
+                if len(selected) >= capacity:
+                    return selected, self.order[(i + 1) % len(self.order)]
+        return selected, None
+
+
+def active_jobs():
+    """
+    Get queued and running jobs.
+
+    Returns:
+        QuerySet: Generation jobs.
+    """
+    alive = timezone.now() - datetime.timedelta(
+        seconds=settings.GENERATION_TIME_LIMITS["HARD"]
+    )  # Jobs of dead workers are not running anymore
+    return GenerationJob.objects.filter(
+        Q(state=GenerationJob.QUEUED)
+        | Q(state=GenerationJob.RUNNING, updated_at__gte=alive)
+    )
+
+
+def running_jobs():
+    """
+    Count jobs occupying generation slots.
+
+    Returns:
+        int: Number of running jobs.
+    """
+    return active_jobs().filter(state=GenerationJob.RUNNING).count()
+
+
+def free_slots():
+    """
+    Count free generation slots.
+
+    Returns:
+        int: Number of slots.
+    """
+    return max(0, settings.GENERATION_SLOTS - running_jobs())
+
+
+def select_jobs(capacity, deferred=False):
+    """
+    Select queued jobs for free generation slots and save credits of
+    users for the next dispatch. Urgent and deferred jobs are selected
+    separately with separate credits.
+
+    Args:
+        capacity: Number of free slots.
+        deferred: Whether to select deferred jobs.
+
+    Returns:
+        list[GenerationJob]: Jobs to dispatch.
+    """
+    if capacity <= 0:
+        return []
+    queues = {}
+    jobs = GenerationJob.objects.filter(
+        state=GenerationJob.QUEUED, deferred=deferred
+    )
+    for job in jobs.select_related("quiz").order_by("created_at"):
+        user = job.quiz.creator_id or 0  # Quizzes without creator share
+        queues.setdefault(user, deque()).append(job)
+    if not queues:
+        return []
+    suffix = ":deferred" if deferred else ""
+    deficit_key = DEFICIT_KEY.format(suffix)
+    next_key = NEXT_KEY.format(suffix)
+    redis = get_redis_connection("default")
+    deficits = {
+        int(user): float(value)
+        for user, value in redis.hgetall(deficit_key).items()
+    }
+    start = redis.get(next_key)
+    drr = DeficitRoundRobin(
+        queues,
+        user_weights(list(queues)),
+        deficits,
+        settings.FAIR_SHARE["QUANTUM"],
+        start=int(start) if start else None,
+    )
+    selected, start = drr.select(capacity)
+    with redis.pipeline() as pipe:
+        pipe.delete(deficit_key, next_key)
+        credits = {
+            user: credit for user, credit in drr.deficits.items() if credit
+        }
+        if credits:
+            pipe.hset(deficit_key, mapping=credits)
+        if start is not None:
+            pipe.set(next_key, start)
+        pipe.execute()
+    return selected
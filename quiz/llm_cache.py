@@ -0,0 +1,393 @@
+"""
+Module with persistent cache for responses of the quiz generation model.
+
+Responses are stored in a local SQLite database keyed by a hash of
+(model, prompt, parameters), so retries of `create_quiz` and repeated
+description requests do not reach the upstream model again.
+"""
+import hashlib
+import json
+import pickle
+import sqlite3
+import time
+from contextlib import closing
+
+from django.conf import settings
+
+MODE_ON = "on"  # Read cached responses and store new ones
+MODE_OFF = "off"  # Always call the upstream model
+MODE_ONLY = "only"  # Never call the upstream model, fail on cache miss
+
+
+class ResponseCacheMiss(Exception):
+    """
+    Raised in cache-only mode when there is no cached response.
+    """
+
+
+class ResponseCache:
+    """
+    Disk-backed cache for model responses with size- and
+    age-based eviction.
+
+    Attributes:
+        path: Path to the SQLite database file.
+        max_size: Maximal total size of stored responses in bytes.
+        max_age: Maximal age of stored responses in seconds.
+        mode: One of `MODE_ON`, `MODE_OFF` or `MODE_ONLY`.
+    """
+
+    def __init__(self, path, max_size, max_age, mode=MODE_ON):
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.mode = mode
+        if self.enabled:
+            with closing(self._connect()) as connection, connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                    "size INTEGER NOT NULL, created_at REAL NOT NULL, "
+                    "accessed_at REAL NOT NULL)"
+                )
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS stats ("
+                    "name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+                )
+
+    @property
+    def enabled(self):
+        """
+        Whether the cache is used at all.
+        """
+        return self.mode != MODE_OFF
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        # WAL lets several worker processes read while one of them writes
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    @staticmethod
+    def make_key(model, prompt, parameters=None):
+        """
+        Make cache key for the model call.
+
+        Args:
+            model: Name of the model.
+            prompt: Prompt sent to the model.
+            parameters: Parameters of the call.
+
+        Returns:
+            str: Hex digest of the call.
+        """
+        payload = json.dumps(
+            [model, prompt, parameters or {}], sort_keys=True, default=str
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key):
+        """
+        Get cached response.
+
+        Args:
+            key: Cache key made by `make_key`.
+
+        Returns:
+            Cached response or None if there is no fresh response.
+        """
+        if not self.enabled:
+            return None
+        now = time.time()
+        with closing(self._connect()) as connection, connection:
+            row = connection.execute(
+                "SELECT value FROM responses "
+                "WHERE key = ? AND created_at >= ?",
+                (key, now - self.max_age),
+            ).fetchone()
+            if row:
+                connection.execute(
+                    "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                    (now, key),
+                )
+            self._count(connection, "hits" if row else "misses")
+        return pickle.loads(row[0]) if row else None
+
+    def set(self, key, value):
+        """
+        Store response in the cache and evict old responses.
+
+        Args:
+            key: Cache key made by `make_key`.
+            value: Response to store.
+        """
+        if not self.enabled:
+            return
+        data = pickle.dumps(value)
+        now = time.time()
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now, now),
+            )
+            self._evict(connection, now)
+
+    def _evict(self, connection, now):
+        connection.execute(
+            "DELETE FROM responses WHERE created_at < ?",
+            (now - self.max_age,),
+        )
+        # Removing least recently used responses until the size fits
+        connection.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM (SELECT key, SUM(size) OVER "
+            "(ORDER BY accessed_at DESC) AS total FROM responses) "
+            "WHERE total > ?)",
+            (self.max_size,),
+        )
+
+    @staticmethod
+    def _count(connection, name):
+        connection.execute(
+            "INSERT INTO stats (name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,),
+        )
+
+    def stats(self):
+        """
+        Get statistics of the cache usage.
+
+        Returns:
+            dict: Hits, misses, number of entries and total size in bytes.
+        """
+        if not self.enabled:
+            return {"hits": 0, "misses": 0, "entries": 0, "size": 0}
+        with closing(self._connect()) as connection:
+            counters = dict(connection.execute("SELECT * FROM stats"))
+            entries, size = connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+            "entries": entries,
+            "size": size,
+        }
+
+    def clear(self):
+        """
+        Remove all responses and statistics from the cache.
+        """
+        if not self.enabled:
+            return
+        with closing(self._connect()) as connection, connection:
+            connection.execute("DELETE FROM responses")
+            connection.execute("DELETE FROM stats")
+
+
+def files_digest(file_names):
+    """
+    Get digest of the files content, so the same material uploaded
+    again maps to the same cache key.
+
+    Args:
+        file_names: List of file names.
+
+    Returns:
+        list[str]: Hex digests of the files.
+    """
+    digests = []
+    for file_name in file_names:
+        digest = hashlib.sha256()
+        with open(file_name, "rb") as file:
+            for block in iter(lambda: file.read(1 << 16), b""):
+                digest.update(block)
+        digests.append(digest.hexdigest())
+    return digests
+
+
+def model_name(instance):
+    """
+    Get name of the generator or describer for cache keys. Wrappers
+    that do not change responses expose the name of the wrapped object
+    as `model_name`.
+
+    Args:
+        instance: Generator or describer.
+
+    Returns:
+        str: Name of the model.
+    """
+    return getattr(instance, "model_name", type(instance).__qualname__)
+
+
+class CachedQuizGenerator:
+    """
+    Wrapper of quiz stream generator that caches generated quizzes.
+    """
+
+    def __init__(self, generator, cache):
+        self.generator = generator
+        self.cache = cache
+        self.model = f"{model_name(generator)}:{settings.LLM_MODEL}"
+
+    @property
+    def supports_resume(self):
+        """
+        Whether the wrapped generator can resume from a checkpoint.
+        """
+        return getattr(self.generator, "supports_resume", False)
+
+    def create_quiz_from_files(
+        self, file_names, resume_from=None, **parameters
+    ):
+        """
+        Create quiz from files using cached result if it exists.
+
+        Args:
+            file_names: List of file names.
+            resume_from: Quiz and number of processed chunks to resume
+                generation from, only for generators supporting resume.
+            **parameters: Parameters of the generator.
+
+        Yields:
+            Tuple of generated quiz, current step and total steps.
+
+        Raises:
+            ResponseCacheMiss: If cache-only mode is on and
+                there is no cached quiz.
+        """
+        if resume_from is not None:
+            parameters_with_resume = {**parameters, "resume_from": resume_from}
+        else:
+            parameters_with_resume = parameters
+        if not self.cache.enabled:
+            yield from self.generator.create_quiz_from_files(
+                file_names, **parameters_with_resume
+            )
+            return
+        key = self.cache.make_key(
+            self.model, files_digest(file_names), parameters
+        )
+        cached = self.cache.get(key)
+        if cached is not None:
+            ml_quiz, total = cached
+            yield ml_quiz, total, total
+            return
+        if self.cache.mode == MODE_ONLY:
+            raise ResponseCacheMiss(f"No cached quiz for {file_names}")
+        ml_quiz, total = None, 0
+        for ml_quiz, i, total in self.generator.create_quiz_from_files(
+            file_names, **parameters_with_resume
+        ):
+            yield ml_quiz, i, total
+        if ml_quiz is not None:
+            self.cache.set(key, (ml_quiz, total))
+
+
+class CachedQuizDescriber:
+    """
+    Wrapper of quiz describer that caches generated descriptions.
+    """
+
+    def __init__(self, describer, cache):
+        self.describer = describer
+        self.cache = cache
+        self.model = f"{model_name(describer)}:{settings.LLM_MODEL}"
+
+    def generate_description(self, ml_quiz):
+        """
+        Generate description for the quiz using cached description
+        if it exists.
+
+        Args:
+            ml_quiz: Quiz generated by the model.
+
+        Returns:
+            Quiz with description.
+
+        Raises:
+            ResponseCacheMiss: If cache-only mode is on and
+                there is no cached description.
+        """
+        if not self.cache.enabled:
+            return self.describer.generate_description(ml_quiz)
+        key = self._key(ml_quiz)
+        description = self.cache.get(key)
+        if description is not None:
+            ml_quiz.set_description(description)
+            return ml_quiz
+        if self.cache.mode == MODE_ONLY:
+            raise ResponseCacheMiss("No cached description for the quiz")
+        ml_quiz = self.describer.generate_description(ml_quiz)
+        self.cache.set(key, ml_quiz.description)
+        return ml_quiz
+
+    def generate_descriptions(self, ml_quizzes):
+        """
+        Generate descriptions for several quizzes, only quizzes without
+        cached description are passed to the wrapped describer.
+
+        Args:
+            ml_quizzes: List of quizzes generated by the model.
+
+        Returns:
+            list: Quizzes with descriptions in the same order, None for
+                quizzes that could not be described.
+
+        Raises:
+            ResponseCacheMiss: If cache-only mode is on and
+                some description is not cached.
+        """
+        if not self.cache.enabled:
+            return self.describer.generate_descriptions(ml_quizzes)
+        described = list(ml_quizzes)
+        missed = []  # Positions and keys of quizzes without cached value
+        for position, ml_quiz in enumerate(ml_quizzes):
+            key = self._key(ml_quiz)
+            description = self.cache.get(key)
+            if description is None:
+                missed.append((position, key))
+            else:
+                ml_quiz.set_description(description)
+        if missed and self.cache.mode == MODE_ONLY:
+            raise ResponseCacheMiss("No cached descriptions for the quizzes")
+        if missed:
+            generated = self.describer.generate_descriptions(
+                [ml_quizzes[position] for position, _ in missed]
+            )
+            for (position, key), ml_quiz in zip(missed, generated):
+                described[position] = ml_quiz
+                if ml_quiz is not None:  # Not described
+                    self.cache.set(key, ml_quiz.description)
+        return described
+
+    def _key(self, ml_quiz):
+        prompt = [
+            ml_quiz.get_question(i).question_text for i in range(len(ml_quiz))
+        ]
+        return self.cache.make_key(self.model, prompt)
+
+
+_response_cache = None
+
+
+def get_response_cache():
+    """
+    Get response cache configured in settings.
+
+    Returns:
+        ResponseCache: Cache instance shared inside the process.
+    """
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache(
+            path=settings.LLM_CACHE["PATH"],
+            max_size=settings.LLM_CACHE["MAX_SIZE"],
+            max_age=settings.LLM_CACHE["MAX_AGE"],
+            mode=settings.LLM_CACHE["MODE"],
+        )
+    return _response_cache
@@ -0,0 +1,62 @@
+"""
+Management command for autoscaling of Celery worker pools.
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app.celery import app
+from quiz.autoscale import get_autoscaler, history
+
+
+class Command(BaseCommand):
+    """
+    Resize pools of generation and indexing workers by the load of
+    their queues.
+    """
+
+    help = "Grow or shrink worker pools by queue depth and latency."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Check the load once and exit.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only log decisions without resizing pools.",
+        )
+        parser.add_argument(
+            "--history",
+            type=int,
+            metavar="COUNT",
+            help="Show the latest decisions and exit.",
+        )
+
+    def handle(self, *args, **options):
+        if options["history"]:
+            for decision in reversed(history(options["history"])):
+                self.stdout.write(self.format(decision))
+            return
+        autoscaler = get_autoscaler(app, dry_run=options["dry_run"])
+        while True:
+            for decision in autoscaler.check():
+                changed = decision["target"] != decision["processes"]
+                if changed or options["verbosity"] > 1:
+                    self.stdout.write(self.format(decision))
+            if options["once"]:
+                return
+            time.sleep(settings.WORKER_AUTOSCALE["INTERVAL"])
+
+    def format(self, decision):
+        return (
+            f"{decision['time']} {decision['worker']} "
+            f"queues={','.join(decision['queues'])} "
+            f"processes={decision['processes']} "
+            f"in_flight={decision['in_flight']} "
+            f"backlog={decision['backlog']} "
+            f"latency={decision['latency']}s -> {decision['target']}"
+        )
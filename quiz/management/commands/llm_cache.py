@@ -0,0 +1,35 @@
+"""
+Management command for inspecting the cache of model responses.
+"""
+from django.core.management.base import BaseCommand
+
+from quiz.llm_cache import get_response_cache
+
+
+class Command(BaseCommand):
+    """
+    Print hit/miss statistics of the response cache or clear it.
+    """
+
+    help = "Show statistics of the model response cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--clear",
+            action="store_true",
+            help="Remove all cached responses and statistics.",
+        )
+
+    def handle(self, *args, **options):
+        response_cache = get_response_cache()
+        if options["clear"]:
+            response_cache.clear()
+            self.stdout.write("Response cache cleared.")
+            return
+        stats = response_cache.stats()
+        requests = stats["hits"] + stats["misses"]
+        hit_rate = stats["hits"] / requests * 100 if requests else 0
+        self.stdout.write(f"Mode: {response_cache.mode}")
+        for name, value in stats.items():
+            self.stdout.write(f"{name}: {value}")
+        self.stdout.write(f"hit rate: {hit_rate:.1f}%")
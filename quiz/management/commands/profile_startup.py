@@ -0,0 +1,197 @@
+"""
+Management command for profiling cold start of the Django process.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+PHASES = ("settings", "apps", "urls", "database", "request")
+
+# Runs in a fresh interpreter, the last line of the output is the result
+CHILD = """
+import json
+import sys
+import time
+
+timings = {}
+errors = {}
+last = time.perf_counter()
+
+
+def phase(name, func):
+    global last
+    try:
+        func()
+    except Exception as e:
+        errors[name] = f"{type(e).__name__}: {e}"
+    now = time.perf_counter()
+    timings[name] = (now - last) * 1000
+    last = now
+
+
+def load_settings():
+    from django.conf import settings
+
+    settings.INSTALLED_APPS
+
+
+def populate_apps():
+    import django
+
+    django.setup()
+
+
+def load_urls():
+    from django.urls import get_resolver
+
+    get_resolver().url_patterns
+
+
+def connect():
+    from django.db import connection
+
+    connection.ensure_connection()
+
+
+def first_request():
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()  # Allows the test host
+    Client(raise_request_exception=False).get(sys.argv[1])
+
+
+phase("settings", load_settings)
+phase("apps", populate_apps)
+phase("urls", load_urls)
+phase("database", connect)
+phase("request", first_request)
+print(json.dumps({"timings": timings, "errors": errors}))
+"""
+
+
+def run_child(path, import_time=False):
+    """
+    Start Django in a fresh interpreter and measure its phases.
+
+    Args:
+        path: Path of the first request.
+        import_time: Whether to trace imports with `-X importtime`.
+
+    Returns:
+        Tuple of the result of the child and its standard error.
+    """
+    options = ["-X", "importtime"] if import_time else []
+    env = {**os.environ, "DJANGO_SETTINGS_MODULE": settings.SETTINGS_MODULE}
+    process = subprocess.run(
+        [sys.executable, *options, "-c", CHILD, path],
+        cwd=settings.BASE_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode:
+        raise CommandError(f"Profiled process failed:\n{process.stderr}")
+    return json.loads(process.stdout.strip().splitlines()[-1]), process.stderr
+
+
+def import_tree(stderr, min_ms):
+    """
+    Parse the import time trace into a tree of slow imports.
+
+    Args:
+        stderr: Output of `-X importtime`.
+        min_ms: Minimal cumulative milliseconds of printed imports.
+
+    Returns:
+        list: Depth, cumulative and self milliseconds and name of every
+            slow import in the order of the tree.
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        own, cumulative, name = line[12:].split("|")  # After "import time:"
+        if not own.strip().isdigit():
+            continue  # The header
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append(
+            (depth, int(cumulative) / 1000, int(own) / 1000, name.strip())
+        )
+    # Children are printed before their parents, reversing gives a tree
+    return [entry for entry in reversed(entries) if entry[1] >= min_ms]
+
+
+class Command(BaseCommand):
+    """
+    Profile cold start per phase and check it against the budget.
+    """
+
+    help = (
+        "Measure cold start of Django per phase: settings, app registry, "
+        "URL resolver, first database connection and first request."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=3)
+        parser.add_argument(
+            "--path",
+            default="/admin/login/",
+            help="Path of the first request.",
+        )
+        parser.add_argument(
+            "--tree",
+            action="store_true",
+            help="Print the tree of imports taking at least --min-ms.",
+        )
+        parser.add_argument("--min-ms", type=float, default=10.0)
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Fail if a phase fails or exceeds STARTUP_BUDGET.",
+        )
+
+    def handle(self, *args, **options):
+        results = [
+            run_child(options["path"])[0] for _ in range(options["runs"])
+        ]
+        timings = {
+            name: statistics.median(r["timings"][name] for r in results)
+            for name in PHASES
+        }
+        timings["total"] = sum(timings.values())
+        errors = {}  # A failed phase is fast but measures nothing
+        for result in results:
+            errors.update(result["errors"])
+        budget = settings.STARTUP_BUDGET
+        for name, value in timings.items():
+            limit = budget.get(name)
+            line = f"{name:>10}: {value:8.1f}ms"
+            if limit is not None:
+                line += f" / {limit}ms"
+            error = errors.get(name)
+            self.stdout.write(line + (f"  ({error})" if error else ""))
+        if options["tree"]:
+            self.print_tree(options["path"], options["min_ms"])
+        over = [
+            name
+            for name, value in timings.items()
+            if name in budget and value > budget[name]
+        ]
+        if options["check"] and errors:
+            raise CommandError(f"Startup phases failed: {', '.join(errors)}")
+        if options["check"] and over:
+            raise CommandError(f"Startup budget exceeded: {', '.join(over)}")
+
+    def print_tree(self, path, min_ms):
+        _, stderr = run_child(path, import_time=True)
+        self.stdout.write(f"\nImports taking at least {min_ms}ms:")
+        for depth, cumulative, own, name in import_tree(stderr, min_ms):
+            self.stdout.write(
+                f"{cumulative:8.1f}ms {own:7.1f}ms  {'  ' * depth}{name}"
+            )
@@ -0,0 +1,23 @@
+"""
+Management command for printing metrics reported by Celery workers.
+"""
+from django.core.management.base import BaseCommand
+
+from quiz import metrics
+from quiz.workers import INIT_MEMORY_METRIC, INIT_METRIC
+
+
+class Command(BaseCommand):
+    """
+    Print summary of worker metrics.
+    """
+
+    help = "Show metrics reported by generation workers."
+
+    def handle(self, *args, **options):
+        for name in (INIT_METRIC, INIT_MEMORY_METRIC):
+            summary = metrics.summary(name)
+            self.stdout.write(
+                f"{name}: count={summary['count']} "
+                f"mean={summary['mean']:.3f} last={summary['last']:.3f}"
+            )
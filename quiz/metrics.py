@@ -0,0 +1,47 @@
+"""
+Module for simple counters of worker metrics stored in Redis.
+"""
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+METRIC_KEY = "quiz:metrics:{}"
+
+
+def observe(name, value):
+    """
+    Record observed value of the metric.
+
+    Args:
+        name: Name of the metric.
+        value: Observed value.
+    """
+    key = METRIC_KEY.format(name)
+    try:
+        with get_redis_connection("default").pipeline() as pipe:
+            pipe.hincrby(key, "count", 1)
+            pipe.hincrbyfloat(key, "sum", value)
+            pipe.hset(key, "last", value)
+            pipe.execute()
+    except RedisError as e:
+        print(f"Metric {name} was not recorded: {e}")
+
+
+def summary(name):
+    """
+    Get summary of the metric.
+
+    Args:
+        name: Name of the metric.
+
+    Returns:
+        dict: Count, sum, mean and last observed value.
+    """
+    values = get_redis_connection("default").hgetall(METRIC_KEY.format(name))
+    count = int(values.get(b"count", 0))
+    total = float(values.get(b"sum", 0))
+    return {
+        "count": count,
+        "sum": total,
+        "mean": total / count if count else 0.0,
+        "last": float(values.get(b"last", 0)),
+    }
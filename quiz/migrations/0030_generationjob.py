@@ -0,0 +1,40 @@
+# Generated by Django 4.2.2 on 2026-10-19 12:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("quiz", "0029_alter_mcqoption_text"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GenerationJob",
+            fields=[
+                (
+                    "quiz",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="generation_job",
+                        serialize=False,
+                        to="quiz.quiz",
+                    ),
+                ),
+                ("task_id", models.CharField(blank=True, max_length=255)),
+                ("current", models.PositiveIntegerField(default=0)),
+                ("total", models.PositiveIntegerField(default=0)),
+                ("checkpoint", models.BinaryField(null=True)),
+                ("attempts", models.PositiveSmallIntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "generation job",
+                "verbose_name_plural": "generation jobs",
+            },
+        ),
+    ]
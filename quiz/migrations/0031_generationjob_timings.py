@@ -0,0 +1,33 @@
+# Generated by Django 4.2.2 on 2026-10-19 19:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("quiz", "0030_generationjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="generationjob",
+            name="estimated_tokens",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="generationjob",
+            name="finished_at",
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name="generationjob",
+            name="started_at",
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name="generationjob",
+            name="timings",
+            field=models.JSONField(default=dict),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.2 on 2026-10-19 19:04
+
+from django.db import migrations, models
+
+
+def finish_existing_jobs(apps, schema_editor):
+    # Jobs created before the dispatcher are not waiting for it
+    GenerationJob = apps.get_model("quiz", "GenerationJob")
+    GenerationJob.objects.update(state="done")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("quiz", "0031_generationjob_timings"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="generationjob",
+            name="arguments",
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddField(
+            model_name="generationjob",
+            name="queue",
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name="generationjob",
+            name="state",
+            field=models.CharField(
+                choices=[
+                    ("queued", "Queued"),
+                    ("running", "Running"),
+                    ("done", "Done"),
+                ],
+                default="running",
+                max_length=16,
+            ),
+        ),
+        migrations.RunPython(finish_existing_jobs, migrations.RunPython.noop),
+    ]
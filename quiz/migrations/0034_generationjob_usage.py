@@ -0,0 +1,38 @@
+# Generated by Django 4.2.2 on 2026-10-19 19:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("quiz", "0033_generationbatch"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="generationjob",
+            name="calls",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="generationjob",
+            name="completion_tokens",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="generationjob",
+            name="cost",
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name="generationjob",
+            name="latency",
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name="generationjob",
+            name="prompt_tokens",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.2 on 2026-10-19 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("quiz", "0034_generationjob_usage"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="generationjob",
+            name="deferred",
+            field=models.BooleanField(default=False),
+        ),
+    ]
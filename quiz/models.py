@@ -2,9 +2,11 @@
 Module for quiz app database models
 """
 
+import pickle
 from abc import abstractmethod
 
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from authorization.models import User
@@ -124,6 +126,18 @@ class Quiz(models.Model):
                 mcq.options.add(mcq_option)
             mcq.save()
 
+    def discard(self):
+        """
+        Delete the quiz together with its materials and their files.
+        Used for quizzes whose generation failed or was cancelled.
+        """
+        materials = list(self.sources.all())
+        self.delete()
+        for material in materials:
+            if not material.quiz_set.exists():
+                material.file.delete(save=False)
+                material.delete()
+
     def view(self, user_id):
         """
         Record that the user has viewed the quiz.
@@ -138,6 +152,160 @@ class Quiz(models.Model):
         verbose_name_plural = _("quizzes")
 
 
+class GenerationBatch(models.Model):
+    """
+    Model that groups generation jobs created by one batch request.
+
+    Attributes:
+        creator: The user who created the batch.
+        size: Number of quizzes in the batch.
+        created_at: The date and time when the batch was created.
+    """
+
+    creator = models.ForeignKey(
+        to=User,
+        on_delete=models.CASCADE,
+        related_name="generation_batches",
+    )
+    size = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _("generation batch")
+        verbose_name_plural = _("generation batches")
+
+
+class GenerationJob(models.Model):
+    """
+    Model that stores state of the quiz generation job.
+    Progress is saved after every processed chunk and generated quiz is
+    checkpointed every `GENERATION_CHECKPOINT_EVERY` chunks, so the
+    generation can be resumed after a crash of the worker.
+    Queued jobs are dispatched to the workers by the fair-share
+    dispatcher.
+
+    Attributes:
+        quiz: The quiz being generated.
+        task_id: The ID of the generation task.
+        state: Whether the job is queued, running or done.
+        queue: Celery queue of the generation task.
+        arguments: Arguments of the generation task.
+        batch: The batch the job was created in.
+        deferred: Whether the job waits for off-peak capacity.
+        prompt_tokens: Tokens sent to the model.
+        completion_tokens: Tokens generated by the model.
+        calls: Number of calls of the model.
+        latency: Total duration of calls of the model in seconds.
+        cost: Cost of calls of the model in dollars.
+        current: Number of processed chunks.
+        total: Total number of chunks.
+        checkpoint: Pickled number of chunks and quiz generated by
+            the model so far.
+        attempts: Number of started generation attempts.
+        estimated_tokens: Tokens of the materials estimated before
+            the job was enqueued.
+        timings: Durations of generation stages in seconds.
+        created_at: The date and time when the job was enqueued.
+        started_at: The date and time when the first attempt started.
+        finished_at: The date and time when the quiz became ready.
+        updated_at: The date and time of the last saved progress.
+    """
+
+    quiz = models.OneToOneField(
+        Quiz,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="generation_job",
+    )
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+
+    STATE = (
+        (QUEUED, _("Queued")),
+        (RUNNING, _("Running")),
+        (DONE, _("Done")),
+    )
+
+    task_id = models.CharField(max_length=255, blank=True)
+    state = models.CharField(max_length=16, default=RUNNING, choices=STATE)
+    queue = models.CharField(max_length=255, blank=True)
+    arguments = models.JSONField(default=dict)
+    batch = models.ForeignKey(
+        GenerationBatch,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name="jobs",
+    )
+    deferred = models.BooleanField(default=False)
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
+    calls = models.PositiveIntegerField(default=0)
+    latency = models.FloatField(default=0)
+    cost = models.FloatField(default=0)
+    current = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    checkpoint = models.BinaryField(null=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    estimated_tokens = models.PositiveIntegerField(default=0)
+    timings = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def is_complete(self):
+        """
+        Whether all chunks were processed.
+        """
+        return self.total > 0 and self.current >= self.total
+
+    def save_checkpoint(self, ml_quiz, current, total):
+        """
+        Save the position of the generator and quiz generated so far.
+
+        Args:
+            ml_quiz: Quiz generated by the model so far, None to save
+                only the position.
+            current: Number of processed chunks.
+            total: Total number of chunks.
+
+        Returns:
+            bool: False if the job was removed together with its quiz.
+        """
+        self.current, self.total = current, total
+        fields = {"current": current, "total": total}
+        if ml_quiz is not None:
+            fields["checkpoint"] = pickle.dumps((current, ml_quiz))
+        return (
+            GenerationJob.objects.filter(pk=self.pk).update(
+                updated_at=timezone.now(), **fields
+            )
+            > 0
+        )
+
+    def restore(self):
+        """
+        Get quiz from the last checkpoint.
+
+        Returns:
+            Tuple of the number of chunks and quiz generated by the model
+                so far, (0, None) if there is no checkpoint.
+        """
+        if not self.checkpoint:
+            return 0, None
+        checkpoint = pickle.loads(self.checkpoint)
+        if not isinstance(checkpoint, tuple):
+            return self.current, checkpoint  # Saved after every chunk
+        return checkpoint
+
+    class Meta:
+        verbose_name = _("generation job")
+        verbose_name_plural = _("generation jobs")
+
+
 class QuizView(models.Model):
     """
     Model that stores information about users who have viewed a quiz.
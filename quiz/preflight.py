@@ -0,0 +1,165 @@
+"""
+Module for estimating size and cost of quiz generation before the
+generation task is enqueued.
+
+Uploaded files are streamed once to count pages, characters and
+tokens. The estimate is used to reject too large uploads and to route
+large ones to the bulk queue.
+"""
+import codecs
+import math
+import os
+import re
+
+from django.conf import settings
+
+PDF_PAGE = re.compile(rb"/Type\s*/Page(?![a-zA-Z])")
+TEXT_EXTENSIONS = {".txt", ".md", ".csv", ".html", ".htm", ".rtf", ".tex"}
+
+
+def _scan_pdf_pages(file):
+    pages = 0
+    tail = b""
+    for chunk in file.chunks():
+        data = tail + chunk
+        matches = list(PDF_PAGE.finditer(data))
+        pages += len(matches)
+        # Keeping the end of the chunk for markers split between chunks
+        start = max(len(data) - 32, matches[-1].end() if matches else 0)
+        tail = data[start:]
+    return pages
+
+
+def _count_pdf_pages(file):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        return _scan_pdf_pages(file)
+    try:
+        return len(PdfReader(file, strict=False).pages)
+    except Exception as e:
+        print(f"Pages of {file.name} were not parsed: {e}")
+        return _scan_pdf_pages(file)  # Page objects outside object streams
+
+
+def _count_text_characters(file):
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    characters = 0
+    for chunk in file.chunks():
+        characters += len(decoder.decode(chunk))
+    return characters + len(decoder.decode(b"", final=True))
+
+
+def inspect_file(file):
+    """
+    Count pages, characters and tokens of the uploaded file.
+
+    Text of PDF files is not extracted, their characters are estimated
+    from the number of pages. Pages are counted by pypdf, or estimated by
+    the file size if they cannot be counted. Characters of other binary
+    formats are estimated by the file size.
+
+    Args:
+        file: Uploaded file.
+
+    Returns:
+        dict: Name, pages, characters and tokens of the file.
+    """
+    estimate = settings.GENERATION_ESTIMATE
+    extension = os.path.splitext(file.name)[1].lower()
+    if extension == ".pdf":
+        pages = _count_pdf_pages(file) or math.ceil(
+            file.size / estimate["BYTES_PER_PDF_PAGE"]
+        )
+        characters = pages * estimate["CHARS_PER_PAGE"]
+    else:
+        if extension in TEXT_EXTENSIONS:
+            characters = _count_text_characters(file)
+        else:
+            characters = file.size
+        pages = math.ceil(characters / estimate["CHARS_PER_PAGE"])
+    file.seek(0)  # File is read again when it is saved
+    return {
+        "name": file.name,
+        "pages": pages,
+        "characters": characters,
+        "tokens": math.ceil(characters / estimate["CHARS_PER_TOKEN"]),
+    }
+
+
+def estimate_generation(files, max_questions=None):
+    """
+    Estimate tokens, cost and duration of the quiz generation.
+
+    Args:
+        files: Uploaded files.
+        max_questions: Max questions.
+
+    Returns:
+        dict: Estimate of the generation.
+    """
+    estimate = settings.GENERATION_ESTIMATE
+    materials = [inspect_file(file) for file in files]
+    prompt_tokens = sum(material["tokens"] for material in materials)
+    completion_tokens = math.ceil(
+        prompt_tokens * estimate["COMPLETION_RATIO"]
+    )
+    if max_questions:
+        completion_tokens = min(
+            completion_tokens, max_questions * estimate["TOKENS_PER_QUESTION"]
+        )
+    tokens = prompt_tokens + completion_tokens
+    return {
+        "files": materials,
+        "pages": sum(material["pages"] for material in materials),
+        "characters": sum(material["characters"] for material in materials),
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "tokens": tokens,
+        "cost": round(
+            prompt_tokens / 1000 * estimate["PROMPT_PRICE"]
+            + completion_tokens / 1000 * estimate["COMPLETION_PRICE"],
+            4,
+        ),
+        "duration": round(
+            completion_tokens / estimate["COMPLETION_TOKENS_PER_SECOND"]
+            + prompt_tokens / estimate["PROMPT_TOKENS_PER_SECOND"],
+            1,
+        ),
+    }
+
+
+def check_limits(estimate):
+    """
+    Check the estimate against configured upload limits.
+
+    Args:
+        estimate: Estimate made by `estimate_generation`.
+
+    Returns:
+        Union[str, None]: Reason of rejection or None.
+    """
+    limits = settings.GENERATION_LIMITS
+    if estimate["pages"] > limits["MAX_PAGES"]:
+        return f"Materials exceed {limits['MAX_PAGES']} pages."
+    if estimate["tokens"] > limits["MAX_TOKENS"]:
+        return f"Materials exceed {limits['MAX_TOKENS']} tokens."
+    return None
+
+
+def choose_queue(estimate, deferred=False):
+    """
+    Choose Celery queue for the generation task.
+
+    Args:
+        estimate: Estimate made by `estimate_generation`.
+        deferred: Whether the generation is deferred.
+
+    Returns:
+        str: Name of the queue.
+    """
+    if deferred:
+        return settings.GENERATION_QUEUES["DEFERRED"]
+    if estimate["tokens"] > settings.GENERATION_LIMITS["BULK_TOKENS"]:
+        return settings.GENERATION_QUEUES["BULK"]
+    return settings.GENERATION_QUEUES["DEFAULT"]
@@ -0,0 +1,325 @@
+"""
+Module for the cluster-wide rate limit of upstream model calls.
+
+All worker processes share limits on requests and tokens per minute
+kept in Redis with the generic cell rate algorithm (GCRA): every limit
+stores the theoretical arrival time of the next call, a call is allowed
+when it does not move the arrival time further than the burst allowance
+from now. Wrapped generators and describers wait for capacity instead
+of failing and retry calls rejected by the provider with exponential
+backoff with full jitter.
+"""
+import random
+import time
+
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from quiz.accounting import count_tokens, quiz_text_length
+from quiz.llm_cache import model_name
+
+REQUESTS_KEY = "quiz:rate_limit:requests"
+TOKENS_KEY = "quiz:rate_limit:tokens"
+
+# Takes both limits at once, returns seconds to wait or 0 if allowed.
+# ARGV: seconds per request, seconds per token, burst seconds, tokens
+GCRA_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local burst = tonumber(ARGV[3])
+local costs = {1, tonumber(ARGV[4])}
+local arrivals = {}
+local wait = 0
+for i = 1, 2 do
+    local interval = tonumber(ARGV[i])
+    if interval > 0 then
+        local tat = math.max(tonumber(redis.call('GET', KEYS[i]) or now), now)
+        local new_tat = tat + costs[i] * interval
+        -- Calls larger than the burst wait for the idle limit
+        local allow_at = math.min(new_tat - burst, tat)
+        wait = math.max(wait, allow_at - now)
+        arrivals[i] = new_tat
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i = 1, 2 do
+    if arrivals[i] then
+        local ttl = math.ceil((arrivals[i] - now) * 1000) + 1000
+        redis.call('SET', KEYS[i], tostring(arrivals[i]), 'PX', ttl)
+    end
+end
+return '0'
+"""
+
+
+def is_rate_limited(error):
+    """
+    Check if the upstream call was rejected by the rate limit of
+    the provider.
+
+    Args:
+        error: Exception raised by the call.
+
+    Returns:
+        bool: True for HTTP 429 errors.
+    """
+    status = getattr(error, "status_code", getattr(error, "http_status", 0))
+    return status == 429 or "RateLimit" in type(error).__name__
+
+
+class RateLimiter:
+    """
+    Limiter of requests and tokens per minute shared by all workers.
+
+    Attributes:
+        requests_per_minute: Limit of requests, 0 disables it.
+        tokens_per_minute: Limit of tokens, 0 disables it.
+        burst: Seconds of calls at full rate allowed at once.
+        max_retries: Number of retries of calls rejected by
+            the provider.
+        backoff_base: Backoff of the first retry in seconds.
+        backoff_max: Maximal backoff in seconds.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute,
+        tokens_per_minute,
+        burst,
+        max_retries,
+        backoff_base,
+        backoff_max,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def _interval(self, limit):
+        return 60 / limit if limit > 0 else 0
+
+    def try_acquire(self, tokens):
+        """
+        Take capacity for one call if it is available.
+
+        Args:
+            tokens: Estimated tokens of the call.
+
+        Returns:
+            float: Seconds to wait before the next try, 0 if the call
+                is allowed.
+        """
+        try:
+            wait = get_redis_connection("default").eval(
+                GCRA_SCRIPT,
+                2,
+                REQUESTS_KEY,
+                TOKENS_KEY,
+                self._interval(self.requests_per_minute),
+                self._interval(self.tokens_per_minute),
+                self.burst,
+                tokens,
+            )
+        except RedisError as e:
+            print(f"Rate limit is not applied: {e}")
+            return 0.0  # Provider limits are still handled by retries
+        return float(wait)
+
+    def usage(self):
+        """
+        Get current usage of the limits.
+
+        Returns:
+            float: Backlog of the most used limit as a share of
+                the burst allowance, 1 means the limit is reached.
+        """
+        if not self.burst:
+            return 0.0
+        try:
+            redis = get_redis_connection("default")
+            seconds, microseconds = redis.time()
+            arrivals = redis.mget(REQUESTS_KEY, TOKENS_KEY)
+        except RedisError:
+            return 0.0
+        now = seconds + microseconds / 1_000_000
+        backlog = max(
+            [float(arrival) - now for arrival in arrivals if arrival],
+            default=0.0,
+        )
+        return max(0.0, backlog) / self.burst
+
+    def acquire(self, tokens):
+        """
+        Wait until there is capacity for one call.
+
+        Args:
+            tokens: Estimated tokens of the call.
+        """
+        if not (self.requests_per_minute or self.tokens_per_minute):
+            return
+        wait = self.try_acquire(tokens)
+        while wait > 0:
+            # Jitter spreads workers waiting for the same capacity
+            time.sleep(wait + random.uniform(0, min(wait, 0.1)))
+            wait = self.try_acquire(tokens)
+
+    def backoff(self, attempt, error):
+        """
+        Wait before retrying the call rejected by the provider.
+
+        Args:
+            attempt: Number of the failed attempt starting from 0.
+            error: Exception raised by the call.
+
+        Raises:
+            Exception: The error if it is not a rate limit error or
+                retries are exhausted.
+        """
+        if not is_rate_limited(error) or attempt >= self.max_retries:
+            raise error
+        cap = min(self.backoff_max, self.backoff_base * 2**attempt)
+        delay = random.uniform(0, cap)
+        print(f"Model call is rate limited, retrying in {delay:.1f}s")
+        time.sleep(delay)
+
+    def call(self, func, tokens):
+        """
+        Call the model when there is capacity, retrying calls rejected
+        by the provider.
+
+        Args:
+            func: Function making the call.
+            tokens: Estimated tokens of the call.
+
+        Returns:
+            Result of the function.
+        """
+        attempt = 0
+        while True:
+            self.acquire(tokens)
+            try:
+                return func()
+            except Exception as e:
+                self.backoff(attempt, e)
+                attempt += 1
+
+
+class RateLimitedGenerator:
+    """
+    Wrapper of quiz stream generator that takes capacity of the rate
+    limit before every chunk. When a chunk is rejected by the provider
+    the stream is restarted from the last processed chunk if the
+    generator supports resume, and from scratch otherwise.
+    """
+
+    def __init__(self, generator, limiter, tokens_per_chunk):
+        self.generator = generator
+        self.limiter = limiter
+        self.tokens_per_chunk = tokens_per_chunk
+        self.model_name = model_name(generator)
+
+    @property
+    def supports_resume(self):
+        """
+        Whether the wrapped generator can resume from a checkpoint.
+        """
+        return getattr(self.generator, "supports_resume", False)
+
+    def _chunks(self, file_names, parameters):
+        stream = self.generator.create_quiz_from_files(
+            file_names, **parameters
+        )
+        while True:
+            self.limiter.acquire(self.tokens_per_chunk)
+            try:
+                yield next(stream)
+            except StopIteration:
+                return
+
+    def create_quiz_from_files(self, file_names, **parameters):
+        """
+        Create quiz from files within the rate limit.
+
+        Args:
+            file_names: List of file names.
+            **parameters: Parameters of the generator.
+
+        Yields:
+            Tuple of generated quiz, current chunk and total chunks.
+        """
+        attempt = 0
+        while True:
+            try:
+                for ml_quiz, i, total in self._chunks(file_names, parameters):
+                    attempt = 0
+                    if self.supports_resume:
+                        parameters["resume_from"] = (ml_quiz, i)
+                    yield ml_quiz, i, total
+                return
+            except Exception as e:
+                self.limiter.backoff(attempt, e)
+                attempt += 1
+
+
+class RateLimitedDescriber:
+    """
+    Wrapper of quiz describer that calls the model within the rate
+    limit.
+    """
+
+    def __init__(self, describer, limiter):
+        self.describer = describer
+        self.limiter = limiter
+        self.model_name = model_name(describer)
+        if callable(getattr(describer, "complete", None)):
+            self.complete = self._complete  # Batched calls are supported
+
+    def generate_description(self, ml_quiz):
+        """
+        Generate description for the quiz within the rate limit.
+
+        Args:
+            ml_quiz: Quiz generated by the model.
+
+        Returns:
+            Quiz with description.
+        """
+        return self.limiter.call(
+            lambda: self.describer.generate_description(ml_quiz),
+            count_tokens(quiz_text_length(ml_quiz)),
+        )
+
+    def _complete(self, prompt):
+        return self.limiter.call(
+            lambda: self.describer.complete(prompt),
+            count_tokens(len(prompt)),
+        )
+
+
+_limiter = None
+
+
+def get_rate_limiter():
+    """
+    Get rate limiter configured in settings.
+
+    Returns:
+        RateLimiter: Limiter shared inside the process.
+    """
+    global _limiter
+    if _limiter is None:
+        limits = settings.LLM_RATE_LIMIT
+        _limiter = RateLimiter(
+            limits["REQUESTS_PER_MINUTE"],
+            limits["TOKENS_PER_MINUTE"],
+            limits["BURST_SECONDS"],
+            limits["MAX_RETRIES"],
+            limits["BACKOFF_BASE"],
+            limits["BACKOFF_MAX"],
+        )
+    return _limiter
@@ -4,6 +4,7 @@ This module contains serializers for the quizzes app.
 
 import random
 
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 from rest_framework import serializers
 
@@ -28,6 +29,7 @@ class QuizCreateSerializer(serializers.Serializer):
         files: A list of files that contain the questions for the quiz.
         description: The description of the quiz.
         private: Whether the quiz is private.
+        deferred: Whether the quiz can be generated off-peak.
     """
 
     quiz_name = serializers.CharField()
@@ -36,6 +38,7 @@ class QuizCreateSerializer(serializers.Serializer):
     files = serializers.ListField(child=serializers.FileField())
     description = serializers.CharField(required=False)
     private = serializers.BooleanField(required=False)
+    deferred = serializers.BooleanField(required=False)
 
     def update(self, instance, validated_data):
         """
@@ -53,6 +56,103 @@ class QuizCreateSerializer(serializers.Serializer):
         return instance
 
 
+class QuizComposeSerializer(serializers.Serializer):
+    """
+    This serializer is used to compose a quiz from questions of existing
+    public quizzes.
+
+    Attributes:
+        quiz_name: The name of the quiz.
+        query: The search query for the questions.
+        topic: The ID of the topic of the questions.
+        key_word: The key word of the topic of the questions.
+        max_questions: The number of questions in the quiz.
+        description: The description of the quiz.
+        private: Whether the quiz is private.
+    """
+
+    quiz_name = serializers.CharField()
+    query = serializers.CharField(required=False, default="")
+    topic = serializers.IntegerField(required=False)
+    key_word = serializers.CharField(required=False)
+    max_questions = serializers.IntegerField(
+        required=False,
+        min_value=1,
+        max_value=settings.QUIZ_COMPOSE["MAX_QUESTIONS"],
+    )
+    description = serializers.CharField(required=False)
+    private = serializers.BooleanField(required=False)
+
+    def validate(self, attrs):
+        """
+        Validates that the questions can be found.
+
+        Args:
+            attrs (dict): The data of the request.
+
+        Returns:
+            dict: The validated data.
+
+        Raises:
+            ValidationError: If neither a query, a topic nor a key word
+                is given.
+        """
+        if not (attrs["query"] or "topic" in attrs or "key_word" in attrs):
+            raise serializers.ValidationError(
+                "Query, topic or key word is required."
+            )
+        return attrs
+
+
+class QuizBatchCreateSerializer(serializers.Serializer):
+    """
+    This serializer is used to create many quizzes with one request.
+    Every quiz is described by a spec with the fields of
+    `QuizCreateSerializer`, files of the spec number `i` are uploaded
+    under the `files[i]` key.
+
+    Attributes:
+        specs: JSON list of quiz specs.
+    """
+
+    specs = serializers.JSONField()
+
+    def validate_specs(self, value):
+        """
+        Validates every spec together with its files.
+
+        Args:
+            value: List of quiz specs.
+
+        Returns:
+            list: Validated data of every spec.
+
+        Raises:
+            ValidationError: If the list is empty, too long or some of
+                the specs are invalid.
+        """
+        max_size = settings.GENERATION_BATCH_MAX_QUIZZES
+        if not isinstance(value, list) or not value:
+            raise serializers.ValidationError("Expected a list of specs.")
+        if len(value) > max_size:
+            raise serializers.ValidationError(
+                f"Batch cannot contain more than {max_size} quizzes."
+            )
+        files = self.context["files"]
+        validated, errors = [], {}
+        for i, spec in enumerate(value):
+            data = dict(spec) if isinstance(spec, dict) else {}
+            data["files"] = files.getlist(f"files[{i}]")
+            serializer = QuizCreateSerializer(data=data)
+            if serializer.is_valid():
+                validated.append(serializer.validated_data)
+            else:
+                errors[i] = serializer.errors
+        if errors:
+            raise serializers.ValidationError(errors)
+        return validated
+
+
 class GetQuizSerializer(serializers.Serializer):
     """
     Serializer for getting a quiz.
@@ -0,0 +1,39 @@
+"""
+Module for sending Celery tasks by name.
+
+The web process never imports `quiz.tasks`: tasks are sent by their
+names, so generator, describer and worker code is imported only by
+Celery workers.
+"""
+from django.core.cache import cache
+
+from app.celery import app
+
+CREATE_QUIZ = "quiz.tasks.create_quiz"
+DESCRIBE_QUIZZES = "quiz.tasks.describe_quizzes"
+DISPATCH_JOBS = "quiz.tasks.dispatch_jobs"
+DISPATCH_SCHEDULED_KEY = "quiz:dispatch:scheduled"
+
+
+def send(name, *args, **options):
+    """
+    Send the task by name without importing it.
+
+    Args:
+        name: Name of the task.
+        *args: Arguments of the task.
+        **options: Options of `apply_async`.
+
+    Returns:
+        AsyncResult: Result of the task.
+    """
+    return app.send_task(name, args=args, **options)
+
+
+def schedule_dispatch():
+    """
+    Schedule dispatch of queued generation jobs if it is not scheduled
+    yet.
+    """
+    if cache.add(DISPATCH_SCHEDULED_KEY, True, 60):
+        send(DISPATCH_JOBS)
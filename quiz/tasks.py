@@ -2,18 +2,58 @@
 Module for asynchronously creating quizzes from files  .
 """
 import datetime
+import time
+from functools import partial
 from typing import Union
 
+from celery.exceptions import SoftTimeLimitExceeded
+from celery.signals import task_postrun
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django_redis import get_redis_connection
+
 from app.celery import app
-from app.settings import SEARCH_DB
-from quiz.models import Quiz
-from QuizGeneratorModel.quiz_craft_package.quiz_describer import QuizDescriber
-from QuizGeneratorModel.quiz_craft_package.quiz_stream_generator import (
-    QuizStreamGenerator,
+from app.SearchDB import get_search_db
+from quiz import eta
+from quiz.accounting import (
+    AccountingDescriber,
+    AccountingGenerator,
+    charge,
+    charge_shared,
+)
+from quiz.batch_describer import BatchQuizDescriber
+from quiz.execution import TASK_ERRORS, run_db
+from quiz.deferred import can_drain, deferred_capacity
+from quiz.fair_share import free_slots, select_jobs
+from quiz.llm_cache import (
+    CachedQuizDescriber,
+    CachedQuizGenerator,
+    get_response_cache,
 )
+from quiz.models import GenerationJob, Quiz
+from quiz.rate_limit import (
+    RateLimitedDescriber,
+    RateLimitedGenerator,
+    get_rate_limiter,
+)
+from quiz.signatures import DISPATCH_SCHEDULED_KEY, schedule_dispatch
+from quiz.workers import get_warm_instances
+
+DESCRIPTION_QUEUE_KEY = "quiz:description:queue"  # Ids of pending quizzes
+DESCRIPTION_QUIZ_KEY = "quiz:description:{}"  # Generated quiz by id
+DESCRIPTION_SCHEDULED_KEY = "quiz:description:scheduled"
+INDEX_QUIZ_KEY = "quiz:index:{}"  # Generated quiz waiting for indexing
+DISPATCH_LOCK_KEY = "quiz:dispatch:lock"
 
 
-@app.task(bind=True)
+@app.task(
+    bind=True,
+    soft_time_limit=settings.GENERATION_TIME_LIMITS["SOFT"],
+    time_limit=settings.GENERATION_TIME_LIMITS["HARD"],
+    acks_late=True,
+    reject_on_worker_lost=True,
+)
 def create_quiz(
     self,
     file_names: list[str],
@@ -23,13 +63,23 @@ def create_quiz(
 ):
     """
     Create quiz from files.
-    The function first creates a `QuizStreamGenerator` object and uses
-        it to create a `NagimQuiz` object from the files.
+    The function first takes the quiz stream generator of the worker
+        process and uses it to create a `NagimQuiz` object from the files.
     Then, it adds the questions from the `NagimQuiz` object to the quiz.
         If a description is provided, it sets the
-    description of the `NagimQuiz` object and the quiz. Finally,
-        it saves the quiz to the database and saves the
-    `NagimQuiz` object to the vector database.
+    description of the `NagimQuiz` object and the quiz. Otherwise, the
+        quiz is described together with other quizzes finished in the
+    same batch window. Finally, it saves the quiz to the database and
+        saves the `NagimQuiz` object to the vector database.
+
+    When the soft time limit is exceeded, the quiz is saved with the
+    questions generated so far. The limit is also checked after every
+    chunk, because the gevent pool does not send it. Generation stops as
+    soon as the quiz is removed by the cancel endpoint.
+
+    The generated quiz is checkpointed every few chunks. The task is
+    acknowledged only after it finishes, so if the worker dies the task
+    is redelivered and resumes from the last checkpoint.
 
     The function returns the metadata of the generation process.
 
@@ -42,26 +92,48 @@ def create_quiz(
     Returns:
         Metadata of generation process.
     """
-    quiz = Quiz.objects.get(
-        pk=pk
+    quiz = run_db(
+        Quiz.objects.filter(pk=pk).first
     )  # Getting quiz object from database for current quiz id
-    quiz_gen = QuizStreamGenerator(debug=False)  # Quiz generator model
-    meta = {"current": 0, "total": 0}  # Meta data of generation process
-    ml_quiz = None  # The reference for the generated quiz
+    if quiz is None or quiz.ready:
+        # Quiz was removed before start or the task was redelivered
+        # after the quiz had been finished
+        return f"Quiz {pk} is not waiting for generation"
+    job = run_db(start_job, quiz, self.request.id)  # Last checkpoint
+    if job.attempts > settings.GENERATION_MAX_ATTEMPTS:
+        run_db(quiz.discard)
+        self.update_state(state="FAILURE")
+        return f"Quiz generation failed {job.attempts - 1} times"
+    quiz_gen = make_generator(quiz, job)  # Generator of the worker process
+    ml_quiz, resume_from = resume_point(job, quiz_gen)
+    meta = {"current": job.current, "total": job.total}
+    timer = eta.StageTimer()  # Timings of the stages for ETA prediction
+    deadline = time.monotonic() + settings.GENERATION_TIME_LIMITS["SOFT"]
     try:
-        for temp_quiz, i, n in quiz_gen.create_quiz_from_files(
-            file_names, **{"max_questions": max_questions}
-        ):
-            meta = {
-                "current": i,
-                "total": n,
-            }  # Meta data of generation process
-            self.update_state(state="PROGRESS", meta=meta)
-            ml_quiz = temp_quiz  # The reference for the generated quiz
-    except Exception as e:
+        if not job.is_complete:
+            stream = quiz_gen.create_quiz_from_files(
+                file_names,
+                max_questions=max_questions,
+                resume_from=resume_from,
+            )
+            for temp_quiz, i, n in stream:
+                meta = {
+                    "current": i,
+                    "total": n,
+                }  # Meta data of generation process
+                self.update_state(state="PROGRESS", meta=meta)
+                timer.chunk(i)
+                ml_quiz = temp_quiz  # The reference for the generated quiz
+                if not save_chunk(job, quiz_gen, ml_quiz, i, n, deadline):
+                    return f"Quiz {pk} was cancelled"  # Job was removed
+    except SoftTimeLimitExceeded:
+        error = stop_generation(self, quiz, ml_quiz, meta)
+        if error:
+            return error
+    except TASK_ERRORS as e:
         # Removing temporary quiz from the database because of error in
-        # creation process
-        quiz.delete()
+        # creation process, including the hard time limit of gevent
+        run_db(quiz.discard)
         self.update_state(
             state="FAILURE", meta=meta
         )  # Updating state to failure
@@ -72,28 +144,546 @@ def create_quiz(
     questions = [
         ml_quiz.get_question(i) for i in range(len(ml_quiz))
     ]  # Fetching questions from ml quiz model
-    quiz.add_questions(questions)  # Adding questions to the quiz
+    run_db(save_questions, quiz, questions)  # Adding questions to the quiz
+    run_db(save_timings, quiz, timer.timings)
+    describe_quiz(quiz, ml_quiz, description, timer)
+    return meta
+
+
+def save_chunk(job, quiz_gen, ml_quiz, current, total, deadline):
+    """
+    Save progress of the generation and check the soft time limit. The
+    quiz is checkpointed every `GENERATION_CHECKPOINT_EVERY` chunks if
+    the generator can resume from it, and after the last chunk.
+
+    Args:
+        job: Generation job of the quiz.
+        quiz_gen: Quiz generator.
+        ml_quiz: Quiz generated by the model so far.
+        current: Number of generated chunks.
+        total: Total number of chunks.
+        deadline: Monotonic time of the soft time limit.
+
+    Returns:
+        bool: False if the job was removed by cancellation.
+
+    Raises:
+        SoftTimeLimitExceeded: If the deadline has passed, the gevent
+            pool does not send the soft time limit itself.
+    """
+    checkpoint = current >= total or (
+        quiz_gen.supports_resume
+        and current % settings.GENERATION_CHECKPOINT_EVERY == 0
+    )
+    if not run_db(
+        job.save_checkpoint, ml_quiz if checkpoint else None, current, total
+    ):
+        return False
+    if time.monotonic() > deadline:
+        raise SoftTimeLimitExceeded()
+    return True
+
+
+def save_questions(quiz, questions):
+    """
+    Replace questions of the quiz with generated ones.
+
+    Args:
+        quiz: Quiz from the database.
+        questions: Questions generated by the model.
+    """
+    quiz.question_set.all().delete()  # Questions of the crashed attempt
+    quiz.add_questions(questions)
+
+
+def mark_ready(quiz):
+    """
+    Mark the quiz as ready in the database.
+
+    Args:
+        quiz: Quiz from the database.
+
+    Returns:
+        bool: False if the quiz was cancelled.
+    """
+    if not Quiz.objects.filter(pk=quiz.pk).exists():
+        return False
+    quiz.created_at = (
+        datetime.datetime.now()
+    )  # Setting creation time of the quiz
+    quiz.ready = True  # Setting the quiz to ready state
+    quiz.save()  # Saving quiz to database
+    GenerationJob.objects.filter(quiz=quiz).update(
+        checkpoint=None
+    )  # Checkpoint is not needed anymore
+    return True
+
+
+def start_job(quiz, task_id):
+    """
+    Get generation job of the quiz and count the new attempt.
+
+    Args:
+        quiz: Quiz from the database.
+        task_id: The ID of the generation task.
+
+    Returns:
+        GenerationJob: The job with the last checkpoint.
+    """
+    job, _ = GenerationJob.objects.get_or_create(quiz=quiz)
+    job.task_id = task_id
+    job.attempts += 1
+    if job.started_at is None:
+        job.started_at = timezone.now()
+        waited = job.started_at - job.created_at
+        job.timings["queue"] = waited.total_seconds()
+    job.save(update_fields=["task_id", "attempts", "started_at", "timings"])
+    return job
+
+
+def save_timings(quiz, timings, finished=False):
+    """
+    Save timings of the generation stages to the job of the quiz.
+
+    Args:
+        quiz: Quiz from the database.
+        timings: Timings measured by the task.
+        finished: Whether the quiz is ready.
+    """
+    job = GenerationJob.objects.filter(quiz=quiz).first()
+    if job is None:
+        return  # Quiz was cancelled
+    if finished:
+        eta.finish_job(job, timings)
+    else:
+        job.timings = {**job.timings, **timings}
+    job.save(update_fields=["timings", "finished_at"])
+
+
+def resume_point(job, quiz_gen):
+    """
+    Get the quiz and the generator position to resume generation from.
+
+    Args:
+        job: Generation job with the last checkpoint.
+        quiz_gen: Quiz generator.
+
+    Returns:
+        Tuple of the checkpointed quiz and the resume position for
+            the generator, both None if generation starts from scratch.
+    """
+    job.current, ml_quiz = job.restore()  # Progress after it is redone
+    if ml_quiz is not None and job.is_complete:
+        return ml_quiz, None
+    if ml_quiz is not None and quiz_gen.supports_resume:
+        return ml_quiz, (ml_quiz, job.current)
+    job.current, job.total = 0, 0  # Generator can only start over
+    return None, None
+
+
+def is_cancelled(pk):
+    """
+    Check if the quiz generation was cancelled.
+
+    Args:
+        pk: Quiz id.
+
+    Returns:
+        bool: True if the quiz was removed from the database.
+    """
+    return not run_db(Quiz.objects.filter(pk=pk).exists)
+
+
+def stop_generation(task, quiz, ml_quiz, meta):
+    """
+    Stop generation interrupted by the soft time limit or cancellation.
+
+    Args:
+        task: Generation task.
+        quiz: Quiz from the database.
+        ml_quiz: Quiz generated by the model so far.
+        meta: Metadata of generation process.
+
+    Returns:
+        Union[str, None]: Message if the generation cannot be continued
+            with the questions generated so far.
+    """
+    if is_cancelled(quiz.pk):
+        return f"Quiz {quiz.pk} was cancelled"  # Stopped by cancel endpoint
+    if not ml_quiz:
+        run_db(quiz.discard)
+        task.update_state(state="FAILURE", meta=meta)
+        return "Generation time limit exceeded"
+    print(
+        f"Quiz {quiz.pk} exceeded generation time limit, "
+        f"keeping {len(ml_quiz)} generated questions"
+    )
+    return None
+
+
+def describe_quiz(quiz, ml_quiz, description, timer):
+    """
+    Set description of the quiz and mark it as ready, or put it to
+    the pending description batch.
+
+    Args:
+        quiz: Quiz from the database.
+        ml_quiz: Quiz generated by the model.
+        description: Description given by the user.
+        timer: Timer of the generation stages.
+    """
     if description:
         ml_quiz.set_description(
             description
         )  # Setting description in vector database
+        finish_quiz(quiz, ml_quiz, timer)
+    elif settings.DESCRIPTION_BATCH["WINDOW"] > 0 and supports_batch():
+        enqueue_description(quiz, ml_quiz)  # Describing in the next batch
     else:
-        describer = QuizDescriber()  # Initializing quiz description generating
+        describer = make_describer(
+            partial(charge, quiz.pk, quiz.creator_id)
+        )  # Initializing quiz description
+        timer.lap()
         ml_quiz = describer.generate_description(
             ml_quiz
         )  # Updating quiz with description
+        timer.stage(eta.DESCRIPTION)
         quiz.description = (
             ml_quiz.description
         )  # Updating description for the quiz
-    quiz.created_at = (
-        datetime.datetime.now()
-    )  # Setting creation time of the quiz
-    quiz.ready = True  # Setting the quiz to ready state
-    quiz.save()  # Saving quiz to database
-    SEARCH_DB.save_quiz(
-        quiz=ml_quiz, unique_id=str(quiz.id)
-    )  # Saving quiz to vector database
+        finish_quiz(quiz, ml_quiz, timer)
+
+
+def make_generator(quiz, job):
+    """
+    Make quiz stream generator with response caching, rate limiting
+    and usage accounting.
+
+    Args:
+        quiz: Quiz from the database.
+        job: Generation job of the quiz.
+
+    Returns:
+        CachedQuizGenerator: Quiz stream generator.
+    """
+    tokens_per_chunk = min(
+        job.estimated_tokens, eta.get_model()[eta.TOKENS_PER_CHUNK]
+    )  # Capacity of the rate limit taken before every chunk
+    return CachedQuizGenerator(
+        RateLimitedGenerator(
+            AccountingGenerator(
+                get_warm_instances().generator,
+                partial(charge, quiz.pk, quiz.creator_id),
+                job.estimated_tokens,
+            ),
+            get_rate_limiter(),
+            tokens_per_chunk,
+        ),
+        get_response_cache(),
+    )
+
+
+def make_describer(charge_usage):
+    """
+    Make quiz describer with response caching, batching support, rate
+    limiting and usage accounting.
+
+    Args:
+        charge_usage: Function recording usage of every call.
+
+    Returns:
+        CachedQuizDescriber: Quiz describer.
+    """
+    return CachedQuizDescriber(
+        BatchQuizDescriber(
+            RateLimitedDescriber(
+                AccountingDescriber(
+                    get_warm_instances().describer, charge_usage
+                ),
+                get_rate_limiter(),
+            )
+        ),
+        get_response_cache(),
+    )
+
+
+def supports_batch():
+    """
+    Check if the describer of the worker process supports batched calls.
+
+    Returns:
+        bool: True if quizzes can be described in batches.
+    """
+    describer = get_warm_instances().describer
+    return callable(getattr(describer, "complete", None))
+
+
+def finish_quiz(quiz, ml_quiz, timer):
+    """
+    Mark the quiz as ready and save it to the vector database. The quiz
+    stays ready if it cannot be indexed, indexing is retried later.
+
+    Args:
+        quiz: Quiz from the database.
+        ml_quiz: Quiz generated by the model.
+        timer: Timer of the generation stages.
+    """
+    if not run_db(mark_ready, quiz):
+        return  # Quiz was cancelled during description
+    timer.lap()
+    try:
+        get_search_db().save_quiz(
+            quiz=ml_quiz, unique_id=str(quiz.id)
+        )  # Saving quiz to vector database
+    except Exception as e:
+        print(f"Quiz {quiz.pk} was not indexed: {e}")
+        schedule_index(quiz.pk, ml_quiz)
+    timer.stage(eta.INDEXING)
+    run_db(save_timings, quiz, timer.timings, finished=True)
     print(
-        f"Quiz {pk} was created successfully"
+        f"Quiz {quiz.pk} was created successfully"
     )  # Printing message for logging
-    return meta
+
+
+def schedule_index(pk, ml_quiz):
+    """
+    Schedule indexing of the quiz that could not be indexed.
+
+    Args:
+        pk: Quiz id.
+        ml_quiz: Quiz generated by the model.
+    """
+    config = settings.SEARCH_CLIENT
+    if config["INDEX_RETRIES"] <= 0:
+        return
+    cache.set(
+        INDEX_QUIZ_KEY.format(pk),
+        ml_quiz,
+        config["INDEX_RETRY_DELAY"] * 2 ** (config["INDEX_RETRIES"] + 1),
+    )  # Kept until the last retry
+    index_quiz.apply_async(
+        (pk,),
+        countdown=config["INDEX_RETRY_DELAY"],
+        queue=settings.GENERATION_QUEUES["INDEXING"],
+    )
+
+
+@app.task(bind=True, max_retries=None)
+def index_quiz(self, pk):
+    """
+    Retry saving the ready quiz to the vector database.
+
+    Args:
+        pk: Quiz id.
+
+    Returns:
+        str: Result of indexing.
+    """
+    key = INDEX_QUIZ_KEY.format(pk)
+    ml_quiz = cache.get(key)
+    if ml_quiz is None:
+        return f"Quiz {pk} expired before indexing"
+    if not run_db(Quiz.objects.filter(pk=pk, ready=True).exists):
+        cache.delete(key)
+        return f"Quiz {pk} was removed before indexing"
+    config = settings.SEARCH_CLIENT
+    try:
+        get_search_db().save_quiz(quiz=ml_quiz, unique_id=str(pk))
+    except Exception as e:
+        if self.request.retries >= config["INDEX_RETRIES"] - 1:
+            cache.delete(key)
+            return f"Quiz {pk} was not indexed: {e}"
+        raise self.retry(
+            exc=e,
+            countdown=config["INDEX_RETRY_DELAY"]
+            * 2 ** (self.request.retries + 1),
+        )
+    cache.delete(key)
+    return f"Quiz {pk} was indexed"
+
+
+def enqueue_description(quiz, ml_quiz):
+    """
+    Put the quiz to the pending description batch. The batch is
+    described after `DESCRIPTION_BATCH["WINDOW"]` seconds since the
+    first quiz was added to it.
+
+    Args:
+        quiz: Quiz from the database.
+        ml_quiz: Quiz generated by the model.
+    """
+    cache.set(
+        DESCRIPTION_QUIZ_KEY.format(quiz.pk),
+        ml_quiz,
+        settings.DESCRIPTION_BATCH["TIMEOUT"],
+    )
+    get_redis_connection("default").rpush(DESCRIPTION_QUEUE_KEY, quiz.pk)
+    schedule_descriptions(settings.DESCRIPTION_BATCH["WINDOW"])
+
+
+def schedule_descriptions(countdown):
+    """
+    Schedule description of the pending batch if it is not scheduled yet.
+
+    Args:
+        countdown: Delay of the batch in seconds.
+    """
+    if cache.add(DESCRIPTION_SCHEDULED_KEY, True, countdown + 60):
+        describe_quizzes.apply_async(
+            countdown=countdown, queue=settings.GENERATION_QUEUES["INDEXING"]
+        )
+
+
+@app.task
+def describe_quizzes():
+    """
+    Describe quizzes accumulated in the pending batch with one call of
+    the describer and mark them as ready. Quizzes that could not be
+    described are discarded.
+
+    Returns:
+        list[int]: Ids of described quizzes.
+    """
+    cache.delete(DESCRIPTION_SCHEDULED_KEY)
+    redis = get_redis_connection("default")
+    size = settings.DESCRIPTION_BATCH["MAX_SIZE"]
+    with redis.pipeline() as pipe:
+        pipe.lrange(DESCRIPTION_QUEUE_KEY, 0, size - 1)
+        pipe.ltrim(DESCRIPTION_QUEUE_KEY, size, -1)
+        pks, _ = pipe.execute()
+    if redis.llen(DESCRIPTION_QUEUE_KEY):
+        schedule_descriptions(0)  # Describing the rest without waiting
+    keys = {int(pk): DESCRIPTION_QUIZ_KEY.format(int(pk)) for pk in pks}
+    ml_quizzes = cache.get_many(keys.values())
+    quizzes = run_db(Quiz.objects.in_bulk, keys)  # Skipping deleted
+    for pk in keys:
+        if pk in quizzes and keys[pk] not in ml_quizzes:
+            fail_description(quizzes.pop(pk), "generated quiz expired")
+    pks = list(quizzes)
+    timer = eta.StageTimer()
+    described = describe_batch(quizzes, [ml_quizzes[keys[pk]] for pk in pks])
+    timer.stage(eta.DESCRIPTION)
+    for pk, ml_quiz in zip(pks, described):
+        if ml_quiz is None:
+            fail_description(quizzes[pk], "no description")
+            continue
+        quizzes[pk].description = ml_quiz.description
+        try:
+            finish_quiz(quizzes[pk], ml_quiz, timer)
+        except Exception as e:
+            if quizzes[pk].ready:  # Only timings of the ready quiz are lost
+                print(f"Quiz {pk} was not finished: {e}")
+            else:
+                fail_description(quizzes[pk], e)
+    cache.delete_many(keys.values())
+    return [pk for pk, ml_quiz in zip(pks, described) if ml_quiz]
+
+
+def describe_batch(quizzes, ml_quizzes):
+    """
+    Describe the quizzes of the batch, charging every call to all of
+    their creators equally.
+
+    Args:
+        quizzes: Quizzes from the database by id.
+        ml_quizzes: Quizzes generated by the model in the same order.
+
+    Returns:
+        list: Quizzes with descriptions, None for quizzes that could not
+            be described.
+    """
+    if not ml_quizzes:
+        return []
+    owners = [(pk, quiz.creator_id) for pk, quiz in quizzes.items()]
+    try:
+        return make_describer(
+            partial(charge_shared, owners)
+        ).generate_descriptions(ml_quizzes)
+    except Exception as e:
+        print(f"Description of quizzes {list(quizzes)} failed: {e}")
+        return [None] * len(ml_quizzes)
+
+
+def fail_description(quiz, reason):
+    """
+    Discard the quiz that could not be described, so it does not block
+    new quizzes of its creator.
+
+    Args:
+        quiz: Quiz from the database.
+        reason: Reason of the failure.
+    """
+    print(f"Quiz {quiz.pk} was discarded: {reason}")
+    run_db(quiz.discard)
+
+
+def next_jobs():
+    """
+    Select queued jobs for free generation slots. Deferred jobs get
+    the slots left by urgent jobs when the load allows draining them.
+
+    Returns:
+        list[GenerationJob]: Jobs to dispatch.
+    """
+    drain = can_drain()  # Checked before urgent jobs leave the queue
+    capacity = free_slots()
+    jobs = select_jobs(capacity)
+    if drain and len(jobs) < capacity:
+        jobs += select_jobs(
+            deferred_capacity(capacity - len(jobs)), deferred=True
+        )
+    return jobs
+
+
+def send_job(job):
+    """
+    Send the generation task of the queued job to Celery.
+
+    Args:
+        job: Queued generation job.
+    """
+    job.state = GenerationJob.RUNNING
+    job.save(update_fields=["state", "updated_at"])
+    arguments = job.arguments
+    create_quiz.apply_async(
+        (
+            arguments["file_names"],
+            job.pk,
+            arguments["max_questions"],
+            arguments["description"],
+        ),
+        queue=job.queue or None,
+        task_id=job.task_id,
+    )
+
+
+@app.task
+def dispatch_jobs():
+    """
+    Send queued generation jobs to free generation slots, sharing the
+    slots fairly between users.
+
+    Returns:
+        list[int]: Ids of quizzes of dispatched jobs.
+    """
+    cache.delete(DISPATCH_SCHEDULED_KEY)
+    with cache.lock(DISPATCH_LOCK_KEY, timeout=60):
+        jobs = run_db(next_jobs)
+        for job in jobs:
+            run_db(send_job, job)
+    return [job.pk for job in jobs]
+
+
+@task_postrun.connect(sender=create_quiz)
+def release_slot(task_id=None, **kwargs):
+    """
+    Mark the job of the finished generation task as done and dispatch
+    the next queued job to its slot.
+    """
+    run_db(
+        GenerationJob.objects.filter(
+            task_id=task_id, state=GenerationJob.RUNNING
+        ).update,
+        state=GenerationJob.DONE,
+    )
+    schedule_dispatch()
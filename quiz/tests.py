@@ -1 +1,224 @@
-# Create your tests here.
+"""
+Module with unit tests of the quiz app.
+"""
+import json
+from collections import deque
+from types import SimpleNamespace
+from unittest import mock
+
+import fakeredis
+from django.test import SimpleTestCase
+from redis.exceptions import RedisError
+
+from quiz.compose import diverse_sample
+from quiz.fair_share import DeficitRoundRobin
+from quiz.rate_limit import REQUESTS_KEY, RateLimiter
+from quiz.views import progress_response
+
+
+def make_queues(costs):
+    """
+    Make queues of jobs of users.
+
+    Args:
+        costs: Estimated tokens of queued jobs by user id.
+
+    Returns:
+        dict: Queued jobs by user id, oldest first.
+    """
+    return {
+        user: deque(
+            SimpleNamespace(user=user, estimated_tokens=tokens)
+            for tokens in tokens_list
+        )
+        for user, tokens_list in costs.items()
+    }
+
+
+class DeficitRoundRobinTest(SimpleTestCase):
+    """
+    Tests of the order of jobs selected by deficit round-robin.
+    """
+
+    def select(self, costs, capacity, weights=None, deficits=None, start=None):
+        queues = make_queues(costs)
+        drr = DeficitRoundRobin(
+            queues,
+            weights or dict.fromkeys(queues, 1),
+            deficits or {},
+            20000,
+            start=start,
+        )
+        selected, start = drr.select(capacity)
+        return [job.user for job in selected], start, drr
+
+    def test_small_job_overtakes_backlog_of_large_jobs(self):
+        users, start, _ = self.select({1: [50000, 50000], 2: [1000]}, 1)
+        self.assertEqual(users, [2])
+        self.assertEqual(start, 1)
+
+    def test_large_jobs_wait_for_credit(self):
+        users, _, drr = self.select({1: [50000, 50000], 2: [1000]}, 3)
+        self.assertEqual(users, [2, 1, 1])
+        self.assertEqual(drr.deficits[1], 0.0)
+
+    def test_weights_share_slots(self):
+        costs = {1: [20000] * 6, 2: [20000] * 6}
+        users, _, _ = self.select(costs, 6, weights={1: 1, 2: 2})
+        self.assertEqual(users, [1, 2, 2, 1, 2, 2])
+
+    def test_round_continues_from_start(self):
+        users, start, _ = self.select({1: [1], 2: [1], 3: [1]}, 1, start=2)
+        self.assertEqual(users, [2])
+        self.assertEqual(start, 3)
+
+    def test_saved_credit_is_used(self):
+        users, _, drr = self.select(
+            {1: [30000], 2: [30000]}, 1, deficits={2: 15000}
+        )
+        self.assertEqual(users, [2])
+        self.assertEqual(drr.deficits[1], 20000)
+
+    def test_idle_users_lose_credit(self):
+        users, start, drr = self.select({1: [1000]}, 5, deficits={1: 9000})
+        self.assertEqual(users, [1])
+        self.assertIsNone(start)
+        self.assertEqual(drr.deficits[1], 0.0)
+
+
+class GCRATest(SimpleTestCase):
+    """
+    Tests of allowed and denied calls of the GCRA rate limit in Redis.
+    """
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch(
+            "quiz.rate_limit.get_redis_connection", return_value=self.redis
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def limiter(self, requests_per_minute=0, tokens_per_minute=0, burst=1):
+        return RateLimiter(
+            requests_per_minute, tokens_per_minute, burst, 0, 1, 1
+        )
+
+    def test_burst_of_requests_is_allowed(self):
+        limiter = self.limiter(requests_per_minute=60, burst=2)
+        self.assertEqual(limiter.try_acquire(1), 0)
+        self.assertEqual(limiter.try_acquire(1), 0)
+        wait = limiter.try_acquire(1)
+        self.assertGreater(wait, 0.9)
+        self.assertLessEqual(wait, 1.0)
+
+    def test_denied_call_takes_no_capacity(self):
+        limiter = self.limiter(requests_per_minute=60)
+        limiter.try_acquire(1)
+        arrival = self.redis.get(REQUESTS_KEY)
+        self.assertGreater(limiter.try_acquire(1), 0)
+        self.assertEqual(self.redis.get(REQUESTS_KEY), arrival)
+
+    def test_tokens_are_limited(self):
+        limiter = self.limiter(tokens_per_minute=600)
+        self.assertEqual(limiter.try_acquire(5), 0)
+        wait = limiter.try_acquire(10)
+        self.assertGreater(wait, 0.4)
+        self.assertLessEqual(wait, 0.5)
+
+    def test_call_larger_than_burst_waits_for_idle_limit(self):
+        limiter = self.limiter(tokens_per_minute=600)
+        self.assertEqual(limiter.try_acquire(100), 0)
+        self.assertGreater(limiter.try_acquire(1), 9)
+
+    def test_most_used_limit_denies(self):
+        limiter = self.limiter(requests_per_minute=6, tokens_per_minute=6000)
+        self.assertEqual(limiter.try_acquire(1), 0)
+        self.assertGreater(limiter.try_acquire(1), 8)
+
+    def test_usage_of_burst(self):
+        limiter = self.limiter(requests_per_minute=60, burst=2)
+        self.assertEqual(limiter.usage(), 0)
+        limiter.try_acquire(1)
+        limiter.try_acquire(1)
+        self.assertAlmostEqual(limiter.usage(), 1, places=1)
+
+    def test_calls_are_allowed_without_redis(self):
+        limiter = self.limiter(requests_per_minute=1)
+        with mock.patch.object(
+            self.redis, "eval", side_effect=RedisError("down")
+        ), mock.patch("builtins.print"):
+            self.assertEqual(limiter.try_acquire(1), 0)
+            self.assertEqual(limiter.try_acquire(1), 0)
+
+
+class DiverseSampleTest(SimpleTestCase):
+    """
+    Tests of questions chosen by maximal marginal relevance.
+    """
+
+    def sample(self, questions, count, max_per_quiz=3):
+        candidates = [
+            (SimpleNamespace(text=text, quiz_id=quiz_id), relevance)
+            for text, quiz_id, relevance in questions
+        ]
+        chosen = diverse_sample(candidates, count, 0.5, max_per_quiz)
+        return [question.text for question in chosen]
+
+    def test_similar_question_is_skipped(self):
+        chosen = self.sample(
+            [
+                ("What is the capital of France", 1, 1.0),
+                ("What is the capital city of France", 2, 0.9),
+                ("When did the Roman empire fall", 3, 0.5),
+            ],
+            2,
+        )
+        self.assertEqual(
+            chosen,
+            [
+                "What is the capital of France",
+                "When did the Roman empire fall",
+            ],
+        )
+
+    def test_copies_are_dropped(self):
+        chosen = self.sample(
+            [
+                ("Name a prime number", 1, 1.0),
+                ("name a  PRIME number", 2, 1.0),
+            ],
+            2,
+        )
+        self.assertEqual(chosen, ["Name a prime number"])
+
+    def test_quiz_gives_its_share(self):
+        chosen = self.sample(
+            [("Alpha question", 1, 1.0), ("Beta question", 1, 0.9)]
+            + [("Gamma question", 2, 0.1)],
+            3,
+            max_per_quiz=1,
+        )
+        self.assertEqual(chosen, ["Alpha question", "Gamma question"])
+
+
+class ProgressResponseTest(SimpleTestCase):
+    """
+    Tests of progress of generation tasks in every state.
+    """
+
+    def progress(self, state, info):
+        response = progress_response(1, state, info, None)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)["progress"]
+
+    def test_progress_of_running_task(self):
+        self.assertEqual(
+            self.progress("PROGRESS", {"current": 1, "total": 4}), 25
+        )
+
+    def test_revoked_task_has_no_progress(self):
+        self.assertEqual(self.progress("REVOKED", Exception("revoked")), 0)
+
+    def test_cancelled_task_has_no_progress(self):
+        self.assertEqual(self.progress("SUCCESS", "Quiz 1 was cancelled"), 0)
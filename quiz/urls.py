@@ -1,11 +1,18 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
+from quiz import async_views
 from quiz.views import QuizViewSet
 
 router = DefaultRouter()
 router.register("", QuizViewSet, basename="quiz")
 
 urlpatterns = [
+    # Async read views take their URLs before the routes of the view set
+    path("", async_views.quiz_list),
+    path("random/", async_views.random_quiz),
+    path("search/", async_views.search),
+    path("<int:pk>/", async_views.retrieve),
+    path("<int:pk>/check_progress/", async_views.check_progress),
     path("", include(router.urls)),
 ]
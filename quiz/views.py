@@ -7,7 +7,9 @@ import random
 from datetime import datetime
 
 from celery.result import AsyncResult
-from django.core.cache import cache
+from celery.utils import uuid
+from django.conf import settings
+from django.db import transaction
 from django.db.models import Count, Max, Q
 from django.http import JsonResponse
 from rest_framework import status
@@ -22,17 +24,36 @@ from rest_framework.response import Response
 # View class for registration
 from rest_framework.viewsets import ViewSet
 
-from app.settings import SEARCH_DB, env
-from quiz.models import Material, Quiz, QuizView, Take
+from app.SearchDB import SearchUnavailable, get_search_db
+from app.settings import env
+from quiz.accounting import (
+    check_budget,
+    daily_budget,
+    daily_usage,
+    reserved_tokens,
+)
+from quiz.compose import compose_quiz
+from quiz.eta import predict
+from quiz.models import (
+    GenerationBatch,
+    GenerationJob,
+    Material,
+    Quiz,
+    QuizView,
+    Take,
+)
+from quiz.preflight import check_limits, choose_queue, estimate_generation
 from quiz.serializers import (
     GetQuizSerializer,
+    QuizBatchCreateSerializer,
     QuizAnswersSerializer,
+    QuizComposeSerializer,
     QuizCreateSerializer,
     QuizMeSerializer,
     QuizSerializer,
     QuizSubmissionSerializer,
 )
-from quiz.tasks import create_quiz
+from quiz.signatures import schedule_dispatch
 
 
 def sort_by_views(queryset_init, start_date, end_date):
@@ -129,6 +150,196 @@ def sort_by_passes(queryset_init, start_date, end_date):
     return queryset
 
 
+SORTS = {
+    "views": sort_by_views,
+    "unique_views": sort_by_unique_views,
+    "passes": sort_by_passes,
+}
+
+
+def filter_by_dates(queryset, params):
+    """
+    Filters quizzes by the start and end dates of the query parameters.
+
+    Args:
+        queryset: The initial queryset of quizzes.
+        params: The query parameters of the request.
+
+    Returns:
+        Tuple of the filtered queryset, the start date and the end date.
+    """
+    start_date = params.get("start_date")
+    end_date = params.get("end_date")
+    if start_date:
+        start_date = datetime.strptime(start_date, "%Y-%m-%d")
+        queryset = queryset.filter(created_at__gte=start_date)
+    if end_date:
+        end_date = datetime.strptime(end_date, "%Y-%m-%d")
+        queryset = queryset.filter(created_at__lte=end_date)
+    return queryset, start_date, end_date
+
+
+def search_fallback(user_id, search_data, number_of_results):
+    """
+    Finds quizzes by their names and descriptions.
+
+    Args:
+        user_id (int): The ID of the user.
+        search_data (str): The text to search with.
+        number_of_results (int): The number of quizzes to return.
+
+    Returns:
+        QuerySet: The quizzes, the newest first.
+    """
+    return Quiz.objects.filter(
+        Q(private__exact=False) | Q(creator__exact=user_id),
+        Q(name__icontains=search_data)
+        | Q(description__icontains=search_data),
+    ).order_by("-created_at")[:number_of_results]
+
+
+def progress_response(pk, state, info, eta):
+    """
+    Builds the response with the progress of a quiz generation.
+
+    Args:
+        pk: The ID of the quiz.
+        state (str): The state of the generation task.
+        info: The metadata of the generation task, an exception or
+            a message for failed and revoked tasks.
+        eta (dict): The predicted time left.
+
+    Returns:
+        django.http.JsonResponse: A JSON response with the progress.
+    """
+    if state == "FAILURE" or state == "PENDING":
+        response = {"id": pk, "state": state, "progress": 0, "eta": eta}
+        return JsonResponse(response, status=200)
+    if not isinstance(info, dict):
+        info = {}  # Failed and revoked tasks have no progress
+    current = info.get("current", 0)
+    total = info.get("total") or 1
+    progress = (
+        int(current) / int(total)
+    ) * 100  # to display a percentage of progress of the task
+    response = {"id": pk, "state": state, "progress": progress, "eta": eta}
+    return JsonResponse(response, status=200)
+
+
+def degraded_search(request, search_data, number_of_results):
+    """
+    Search quizzes by their names and descriptions while the vector
+    database is unavailable.
+
+    Args:
+        request (django.http.HttpRequest): The HTTP request from the user.
+        search_data (str): The text to search with.
+        number_of_results (int): The number of quizzes to return.
+
+    Returns:
+        rest_framework.response.Response: A response with the quizzes
+            marked as degraded by the `X-Search-Degraded` header.
+    """
+    quizzes = search_fallback(
+        request.user.id, search_data, number_of_results
+    )
+    serializer = QuizMeSerializer(quizzes, many=True)
+    return Response(serializer.data, headers={"X-Search-Degraded": "true"})
+
+
+def make_job(quiz, materials, spec, estimate, batch=None):
+    """
+    Make a queued generation job of the quiz. The job waits for a free
+    slot given by the fair-share dispatcher.
+
+    Args:
+        quiz: The placeholder quiz.
+        materials: Saved materials of the quiz.
+        spec: Validated data of `QuizCreateSerializer`.
+        estimate: Estimate of the generation.
+        batch: The batch the quiz is created in.
+
+    Returns:
+        GenerationJob: Unsaved generation job.
+    """
+    return GenerationJob(
+        quiz=quiz,
+        task_id=uuid(),
+        state=GenerationJob.QUEUED,
+        queue=choose_queue(estimate, spec.get("deferred", False)),
+        estimated_tokens=estimate["tokens"],
+        arguments={
+            "file_names": [str(material.file.file) for material in materials],
+            "max_questions": spec.get("max_questions"),
+            "description": quiz.description,
+        },
+        batch=batch,
+        deferred=spec.get("deferred", False),
+    )
+
+
+def create_batch_quizzes(user, specs, estimates):
+    """
+    Create placeholder quizzes, their materials and queued generation
+    jobs of the batch with bulk inserts.
+
+    Args:
+        user: The creator of the batch.
+        specs: Validated specs of the quizzes.
+        estimates: Estimates of the generation of every quiz.
+
+    Returns:
+        Tuple of the batch and its generation jobs.
+    """
+    batch = GenerationBatch.objects.create(creator=user, size=len(specs))
+    quizzes = Quiz.objects.bulk_create(
+        Quiz(
+            name=spec["quiz_name"],
+            creator=user,
+            description=spec.get("description", ""),
+            private=spec.get("private", False),
+        )
+        for spec in specs
+    )
+    materials = [
+        [
+            Material(name=spec["source_name"], file=file)
+            for file in spec["files"]
+        ]
+        for spec in specs
+    ]
+    Material.objects.bulk_create(sum(materials, []))  # Saves the files
+    Quiz.sources.through.objects.bulk_create(
+        Quiz.sources.through(quiz_id=quiz.pk, material_id=material.pk)
+        for quiz, quiz_materials in zip(quizzes, materials)
+        for material in quiz_materials
+    )
+    jobs = GenerationJob.objects.bulk_create(
+        make_job(quiz, quiz_materials, spec, estimate, batch)
+        for quiz, quiz_materials, spec, estimate in zip(
+            quizzes, materials, specs, estimates
+        )
+    )
+    return batch, jobs
+
+
+def job_progress(job):
+    """
+    Get progress of the generation job in percents.
+
+    Args:
+        job: Generation job with its quiz.
+
+    Returns:
+        float: Progress of the job.
+    """
+    if job.quiz.ready:
+        return 100.0
+    if not job.total:
+        return 0.0
+    return job.current / job.total * 100
+
+
 class QuizViewSet(ViewSet):
     """
     View set for working with Quiz model instances in database.
@@ -213,27 +424,17 @@ class QuizViewSet(ViewSet):
         Get list of quizzes for given query parameters.
         """
 
-        queryset = Quiz.objects.filter(
-            Q(private__exact=False) | Q(creator__exact=request.user.id)
+        queryset, start_date, end_date = filter_by_dates(
+            Quiz.objects.filter(
+                Q(private__exact=False) | Q(creator__exact=request.user.id)
+            ),
+            request.query_params,
         )
-        # Filtering by start and end dates
-        start_date = request.query_params.get("start_date")
-        end_date = request.query_params.get("end_date")
-        if start_date:
-            start_date = datetime.strptime(start_date, "%Y-%m-%d")
-            queryset = queryset.filter(created_at__gte=start_date)
-        if end_date:
-            end_date = datetime.strptime(end_date, "%Y-%m-%d")
-            queryset = queryset.filter(created_at__lte=end_date)
 
         # Sorting
         sort_algorithm = request.query_params.get("sort")
-        if sort_algorithm == "views":
-            queryset = sort_by_views(queryset, start_date, end_date)
-        elif sort_algorithm == "unique_views":
-            queryset = sort_by_unique_views(queryset, start_date, end_date)
-        elif sort_algorithm == "passes":
-            queryset = sort_by_passes(queryset, start_date, end_date)
+        if sort_algorithm in SORTS:
+            queryset = SORTS[sort_algorithm](queryset, start_date, end_date)
         elif sort_algorithm == "generations":
             queryset = queryset.filter(ready__exact=True).order_by(
                 "-created_at"
@@ -250,9 +451,21 @@ class QuizViewSet(ViewSet):
     @permission_classes([IsAuthenticated])
     def create(self, request):
         """
-        Create new quiz using QuizGeneratorModel submodule.
+        Create new quiz using QuizGeneratorModel submodule, or compose it
+        from existing questions when the mode is "compose".
         """
+        if request.data.get("mode") == "compose":
+            return self.compose(request)
+        serializer = QuizCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
         processing_quizzes = request.user.quizzes.filter(ready__exact=False)
+        if not serializer.validated_data.get("deferred"):
+            # Deferred jobs waiting for off-peak hours do not block
+            # urgent quizzes
+            processing_quizzes = processing_quizzes.exclude(
+                generation_job__deferred=True,
+                generation_job__state=GenerationJob.QUEUED,
+            )
         if processing_quizzes:
             return JsonResponse(
                 {
@@ -264,10 +477,23 @@ class QuizViewSet(ViewSet):
                 },
                 status=status.HTTP_403_FORBIDDEN,
             )
-        serializer = QuizCreateSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
         materials = []
         max_questions = serializer.validated_data.get("max_questions")
+        estimate = estimate_generation(
+            serializer.validated_data["files"], max_questions
+        )  # Pre-flight estimate of the generation
+        rejection = check_limits(estimate)
+        if rejection:
+            return JsonResponse(
+                {"detail": rejection, "estimate": estimate},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+        over_budget = check_budget(request.user, estimate["tokens"])
+        if over_budget:
+            return JsonResponse(
+                {"detail": "Daily token budget is exceeded.", **over_budget},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+            )
         name = serializer.validated_data["quiz_name"]
         optional = {
             "description": serializer.validated_data["description"]
@@ -284,17 +510,183 @@ class QuizViewSet(ViewSet):
             )
             new_material.quiz_set.add(quiz)
             materials.append(new_material)
-        file_names = [str(material.file.file) for material in materials]
+        job = make_job(quiz, materials, serializer.validated_data, estimate)
+        job.save(force_insert=True)
+        schedule_dispatch()
+        return Response(
+            {
+                "detail": "Quiz on creation stage",
+                "id": quiz.id,
+                "estimate": estimate,
+                "eta": predict(job),
+            },
+            status=status.HTTP_200_OK,
+        )
+
+    def compose(self, request):
+        """
+        This function composes a ready quiz from questions of existing
+        public quizzes without generation.
+
+        Args:
+            request (django.http.HttpRequest): The HTTP request from the user.
+
+        Returns:
+            django.http.JsonResponse: A JSON response with the id of the quiz.
+        """
+        serializer = QuizComposeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        quiz, sources = compose_quiz(
+            request.user,
+            data["quiz_name"],
+            data.get(
+                "max_questions", settings.QUIZ_COMPOSE["DEFAULT_QUESTIONS"]
+            ),
+            query=data["query"],
+            topic=data.get("topic"),
+            key_word=data.get("key_word"),
+            description=data.get("description", ""),
+            private=data.get("private", False),
+        )
+        if quiz is None:
+            return JsonResponse(
+                {"detail": "No questions were found for the request."},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        return Response(
+            {
+                "detail": "Quiz was composed",
+                "id": quiz.id,
+                "questions": quiz.question_set.count(),
+                "sources": sources,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+    @action(
+        detail=False, methods=["get"], permission_classes=[IsAuthenticated]
+    )
+    def usage(self, request):
+        """
+        This function reports usage of the generation model by the user
+        for today and the daily budget.
+
+        Args:
+            request (django.http.HttpRequest): The HTTP request from the user.
 
-        task = create_quiz.delay(
-            file_names, quiz.pk, max_questions, optional["description"]
+        Returns:
+            django.http.JsonResponse: A JSON response with the usage.
+        """
+        response = {
+            "usage": daily_usage(request.user.id),
+            "reserved_tokens": reserved_tokens(request.user.id),
+            "budget_tokens": daily_budget(request.user),
+        }
+        return JsonResponse(response, status=200)
+
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="batch",
+        permission_classes=[IsAuthenticated],
+    )
+    def create_batch(self, request):
+        """
+        Create many quizzes with one request. Placeholder quizzes are
+        created in bulk and their generation is tracked as one batch.
+
+        Args:
+            request (django.http.HttpRequest): The HTTP request from the user.
+
+        Returns:
+            django.http.JsonResponse: A JSON response with ids of the batch
+                and its quizzes.
+        """
+        serializer = QuizBatchCreateSerializer(
+            data=request.data, context={"files": request.FILES}
+        )
+        serializer.is_valid(raise_exception=True)
+        specs = serializer.validated_data["specs"]
+        estimates = [
+            estimate_generation(spec["files"], spec.get("max_questions"))
+            for spec in specs
+        ]  # Pre-flight estimates of the generation
+        rejections = {
+            i: check_limits(estimate) for i, estimate in enumerate(estimates)
+        }
+        rejections = {i: reason for i, reason in rejections.items() if reason}
+        if rejections:
+            return JsonResponse(
+                {"detail": rejections, "estimates": estimates},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+        over_budget = check_budget(
+            request.user, sum(estimate["tokens"] for estimate in estimates)
         )
-        cache.set(quiz.id, task.id, 18000)
+        if over_budget:
+            return JsonResponse(
+                {"detail": "Daily token budget is exceeded.", **over_budget},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+            )
+        with transaction.atomic():
+            batch, jobs = create_batch_quizzes(request.user, specs, estimates)
+        schedule_dispatch()
         return Response(
-            {"detail": "Quiz on creation stage", "id": quiz.id},
+            {
+                "detail": "Quizzes on creation stage",
+                "batch": batch.id,
+                "ids": [job.pk for job in jobs],
+                "estimates": estimates,
+            },
             status=status.HTTP_200_OK,
         )
 
+    @action(
+        detail=False,
+        methods=["get"],
+        url_path=r"batch/(?P<batch_id>\d+)",
+        permission_classes=[IsAuthenticated],
+    )
+    def batch_progress(self, request, batch_id=None):
+        """
+        This function reports aggregate progress of the batch. Quizzes
+        whose generation failed or was cancelled are counted as failed.
+
+        Args:
+            request (django.http.HttpRequest): The HTTP request from the user.
+            batch_id (int): The ID of the batch.
+
+        Returns:
+            django.http.JsonResponse: A JSON response with the progress.
+        """
+        batch = get_object_or_404(
+            GenerationBatch, pk=batch_id, creator=request.user
+        )
+        jobs = batch.jobs.select_related("quiz").order_by("quiz_id")
+        quizzes = [
+            {
+                "id": job.pk,
+                "state": "READY" if job.quiz.ready else job.state.upper(),
+                "progress": job_progress(job),
+            }
+            for job in jobs
+        ]
+        states = [quiz["state"] for quiz in quizzes]
+        response = {
+            "id": batch.id,
+            "size": batch.size,
+            "ready": states.count("READY"),
+            "queued": states.count("QUEUED"),
+            "generating": len(states)
+            - states.count("READY")
+            - states.count("QUEUED"),
+            "failed": batch.size - len(quizzes),
+            "progress": sum(quiz["progress"] for quiz in quizzes) / batch.size,
+            "quizzes": quizzes,
+        }
+        return JsonResponse(response, status=200)
+
     @permission_classes([IsAuthenticatedOrReadOnly])
     def retrieve(self, request, pk=None, **kwargs):
         """
@@ -410,28 +802,11 @@ class QuizViewSet(ViewSet):
                     {"detail": "Access to this quiz is not allowed for you!"},
                     status=status.HTTP_403_FORBIDDEN,
                 )
-            task_id = cache.get(pk, None)
-            if task_id:
-                task = AsyncResult(task_id)
-
-                if task.state == "FAILURE" or task.state == "PENDING":
-                    response = {
-                        "id": pk,
-                        "state": task.state,
-                        "progress": 0,
-                    }
-                    return JsonResponse(response, status=200)
-                current = task.info.get("current", 0)
-                total = task.info.get("total", 1)
-                progress = (
-                    int(current) / int(total)
-                ) * 100  # to display a percentage of progress of the task
-                response = {
-                    "id": pk,
-                    "state": task.state,
-                    "progress": progress,
-                }
-                return JsonResponse(response, status=200)
+            job = GenerationJob.objects.filter(quiz=quiz).first()
+            if job and job.task_id:
+                task = AsyncResult(job.task_id)
+                eta = predict(job)  # Time left
+                return progress_response(pk, task.state, task.info, eta)
             return JsonResponse(
                 {"detail": "No tasks are associated with given quiz id!"},
                 status=status.HTTP_404_NOT_FOUND,
@@ -441,6 +816,52 @@ class QuizViewSet(ViewSet):
             status=status.HTTP_400_BAD_REQUEST,
         )
 
+    @action(
+        detail=True, methods=["post"], permission_classes=[IsAuthenticated]
+    )
+    def cancel(self, request, pk=None):
+        """
+        This function cancels generation of a quiz. The generation task
+        is revoked and the placeholder quiz is removed with its materials.
+
+        Args:
+            request (django.http.HttpRequest): The HTTP request from the user.
+            pk (int): The ID of the quiz.
+
+        Returns:
+            django.http.JsonResponse: A JSON response with the result of
+                the cancellation.
+
+        Raises:
+            django.http.Http404: If the quiz does not exist.
+            django.http.Http403: If the user does not have permission to
+                access the quiz.
+            django.http.Http409: If the quiz is already generated.
+        """
+        quiz = get_object_or_404(Quiz, pk=pk)
+        if quiz.creator != request.user:
+            return JsonResponse(
+                {"detail": "Access to this quiz is not allowed for you!"},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        if quiz.ready:
+            return JsonResponse(
+                {"detail": "This quiz is already generated."},
+                status=status.HTTP_409_CONFLICT,
+            )
+        job = GenerationJob.objects.filter(quiz=quiz).first()
+        task_id = job.task_id if job else None
+        quiz.discard()  # Removing quiz first, so the task stops on it
+        if task_id:
+            # Soft time limit signal lets the task finish cleanly. The
+            # gevent pool ignores it, the task stops after the current
+            # chunk because the quiz is removed
+            AsyncResult(task_id).revoke(terminate=True, signal="SIGUSR1")
+        return JsonResponse(
+            {"detail": "Quiz generation was cancelled.", "id": int(pk)},
+            status=status.HTTP_200_OK,
+        )
+
     @action(detail=False, methods=["get"])
     def search(self, request):
         """
@@ -460,13 +881,14 @@ class QuizViewSet(ViewSet):
                 {"detail": "You have no text to search with."},
                 status=status.HTTP_400_BAD_REQUEST,
             )
+        number_of_results = int(env("NUMBER_OF_SEARCH_RESULTS", default=10))
         try:
-            results = SEARCH_DB.search_quiz(
-                search_data,
-                number_of_results=int(
-                    env("NUMBER_OF_SEARCH_RESULTS", default=10)
-                ),
+            results = get_search_db().search_quiz(
+                search_data, number_of_results=number_of_results
             )
+        except SearchUnavailable as e:
+            print(f"Search is degraded: {e}")
+            return degraded_search(request, search_data, number_of_results)
         except Exception as e:
             print(e.__str__())
             return JsonResponse(
@@ -0,0 +1,233 @@
+"""
+Module for generator and describer instances kept warm inside
+Celery worker processes.
+
+Instances are created once at `worker_process_init`, reused by all
+generation tasks of the process and recreated after
+`GENERATOR_INSTANCES["MAX_TASKS"]` tasks, when the process grows above
+`GENERATOR_INSTANCES["MAX_MEMORY"]` megabytes or when a health check
+of an instance fails.
+
+Instances are not assumed to be safe for concurrent use. In the
+green-thread execution mode every greenlet takes its own instances from
+a pool of idle ones for the duration of the task, so the pool grows to
+the number of concurrent generation tasks of the process.
+"""
+import gc
+import os
+import resource
+import time
+
+from celery.signals import task_postrun, worker_process_init
+from django.conf import settings
+
+from quiz import metrics
+from quiz.backends import get_generator_backend
+from quiz.execution import is_green
+from quiz.signatures import CREATE_QUIZ, DESCRIBE_QUIZZES
+
+INIT_METRIC = "generator_init_seconds"
+INIT_MEMORY_METRIC = "generator_init_memory_mb"
+GENERATION_TASKS = {CREATE_QUIZ, DESCRIBE_QUIZZES}
+
+
+def memory_usage():
+    """
+    Get resident memory of the current process.
+
+    Returns:
+        float: Resident memory in megabytes.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1 << 20)
+    except (OSError, ValueError):
+        # Peak memory is the best estimate without procfs
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def is_healthy(instance):
+    """
+    Run health check of the instance if it provides one.
+
+    Args:
+        instance: Generator or describer.
+
+    Returns:
+        bool: Whether the instance can be reused.
+    """
+    health_check = getattr(instance, "health_check", None)
+    if health_check is None:
+        return True
+    try:
+        return bool(health_check())
+    except Exception as e:
+        print(f"Health check of {type(instance).__name__} failed: {e}")
+        return False
+
+
+class WarmInstances:
+    """
+    Generator and describer reused across tasks of the worker process.
+
+    Attributes:
+        backend: Generator backend.
+        max_tasks: Number of tasks after which instances are recreated.
+        max_memory: Resident memory in megabytes above which instances
+            are recreated.
+        tasks: Number of tasks served by current instances.
+    """
+
+    def __init__(self, backend, max_tasks, max_memory):
+        self.backend = backend
+        self.max_tasks = max_tasks
+        self.max_memory = max_memory
+        self.tasks = 0
+        self._generator = None
+        self._describer = None
+
+    def warm_up(self):
+        """
+        Create generator and describer and report initialization time
+        and memory.
+        """
+        memory = memory_usage()
+        started = time.perf_counter()
+        self._generator = self.backend.get_generator()
+        self._describer = self.backend.get_describer()
+        duration = time.perf_counter() - started
+        memory = memory_usage() - memory
+        self.tasks = 0
+        metrics.observe(INIT_METRIC, duration)
+        metrics.observe(INIT_MEMORY_METRIC, memory)
+        print(
+            f"Generator instances of process {os.getpid()} "
+            f"initialized in {duration:.3f}s using {memory:.1f}MB"
+        )
+
+    def recycle(self, reason):
+        """
+        Drop current instances and create new ones.
+
+        Args:
+            reason: Reason of recycling for the log.
+        """
+        print(f"Recycling generator instances of {os.getpid()}: {reason}")
+        self._generator = self._describer = None
+        gc.collect()
+        self.warm_up()
+
+    def _ensure(self):
+        if self._generator is None or self._describer is None:
+            self.warm_up()
+        elif not (is_healthy(self._generator) and is_healthy(self._describer)):
+            self.recycle("health check failed")
+
+    @property
+    def generator(self):
+        """
+        Healthy generator instance.
+        """
+        self._ensure()
+        return self._generator
+
+    @property
+    def describer(self):
+        """
+        Healthy describer instance.
+        """
+        self._ensure()
+        return self._describer
+
+    def task_done(self):
+        """
+        Count finished task and recycle instances if limits are exceeded.
+        """
+        self.tasks += 1
+        if self.tasks >= self.max_tasks:
+            self.recycle(f"served {self.tasks} tasks")
+        elif memory_usage() > self.max_memory:
+            self.recycle(f"memory usage above {self.max_memory}MB")
+
+
+_instances = None
+_idle = []  # Instances not taken by any greenlet
+_greenlet = None  # Instances taken by the current greenlet
+
+
+def new_instances():
+    """
+    Create instances configured in settings, they are warmed up on the
+    first use.
+
+    Returns:
+        WarmInstances: New instances.
+    """
+    return WarmInstances(
+        get_generator_backend(),
+        max_tasks=settings.GENERATOR_INSTANCES["MAX_TASKS"],
+        max_memory=settings.GENERATOR_INSTANCES["MAX_MEMORY"],
+    )
+
+
+def greenlet_local():
+    """
+    Get storage local to the current greenlet.
+
+    Returns:
+        gevent.local.local: The storage.
+    """
+    global _greenlet
+    if _greenlet is None:
+        from gevent.local import local
+
+        _greenlet = local()
+    return _greenlet
+
+
+def get_warm_instances():
+    """
+    Get instances of the current process, or of the current greenlet in
+    the green-thread execution mode.
+
+    Returns:
+        WarmInstances: Instances used by the current task.
+    """
+    global _instances
+    if is_green():
+        local = greenlet_local()
+        if getattr(local, "instances", None) is None:
+            local.instances = _idle.pop() if _idle else new_instances()
+        return local.instances
+    if _instances is None:
+        _instances = new_instances()
+    return _instances
+
+
+@worker_process_init.connect
+def warm_up_instances(**kwargs):
+    """
+    Create instances as soon as the worker process starts.
+    """
+    if is_green():
+        instances = new_instances()
+        instances.warm_up()
+        _idle.append(instances)
+    else:
+        get_warm_instances().warm_up()
+
+
+@task_postrun.connect
+def count_generation_task(sender=None, **kwargs):
+    """
+    Count finished generation tasks of the process and return instances
+    of the greenlet to the pool.
+    """
+    if sender is None or sender.name not in GENERATION_TASKS:
+        return
+    instances = get_warm_instances()
+    instances.task_done()
+    if is_green():
+        greenlet_local().instances = None
+        _idle.append(instances)
@@ -0,0 +1,4 @@
+#!/bin/sh
+
+# Resizes pools of Celery workers by depth and latency of their queues
+python manage.py autoscale_workers
@@ -0,0 +1,127 @@
+"""
+Benchmark of startup time and resident memory of the web process.
+
+Every profile is started in a fresh interpreter several times. The "web"
+profile loads what a gunicorn worker loads before the first request.
+The "web+tasks" profile is the baseline before tasks were sent by name:
+views imported `quiz.tasks`, which imported the generator and describer
+of the model at module level, so the profile imports them eagerly too.
+The difference is the saving. Modules of the baseline that can not be
+imported, like the model without its submodule, are reported and the
+saving is then understated.
+
+Usage:
+    python scripts/benchmark_startup.py [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROFILES = {
+    "web": [],
+    "web+tasks": [
+        "quiz.tasks",
+        "QuizGeneratorModel.quiz_craft_package.quiz_describer",
+        "QuizGeneratorModel.quiz_craft_package.quiz_stream_generator",
+    ],
+}
+
+WORKER_MODULES = ("quiz.tasks", "quiz.workers", "quiz.backends")
+
+CHILD = """
+import importlib
+import json
+import os
+import sys
+import time
+
+started = time.perf_counter()
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app.settings")
+from django.core.wsgi import get_wsgi_application
+from django.urls import get_resolver
+
+get_wsgi_application()
+get_resolver().url_patterns  # Views are imported with the URL patterns
+missing = []
+for module in sys.argv[1:]:
+    try:
+        importlib.import_module(module)
+    except ImportError:
+        missing.append(module)
+seconds = time.perf_counter() - started
+with open("/proc/self/status") as status:
+    rss = next(
+        int(line.split()[1]) / 1024
+        for line in status
+        if line.startswith("VmRSS")
+    )
+print(json.dumps({
+    "seconds": seconds,
+    "rss": rss,
+    "modules": len(sys.modules),
+    "worker_modules": [m for m in %r if m in sys.modules],
+    "missing": missing,
+}))
+""" % (
+    WORKER_MODULES,
+)
+
+
+def run(modules):
+    """
+    Start the profile in a fresh interpreter.
+
+    Args:
+        modules: Modules imported after the web application.
+
+    Returns:
+        dict: Startup seconds, resident memory in megabytes, number of
+            imported modules, imported worker modules and modules that
+            could not be imported.
+    """
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD, *modules],
+        cwd=BASE_DIR,
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--runs", type=int, default=5)
+    runs = parser.parse_args().runs
+    results = {}
+    for name, modules in PROFILES.items():
+        samples = [run(modules) for _ in range(runs)]
+        results[name] = {
+            "seconds": statistics.median(s["seconds"] for s in samples),
+            "rss": statistics.median(s["rss"] for s in samples),
+            "modules": samples[-1]["modules"],
+            "worker_modules": samples[-1]["worker_modules"],
+        }
+        result = results[name]
+        print(
+            f"{name:>10}: {result['seconds'] * 1000:8.1f}ms "
+            f"{result['rss']:7.1f}MB {result['modules']:5d} modules, "
+            f"worker modules: {', '.join(result['worker_modules']) or '-'}"
+        )
+        for module in samples[-1]["missing"]:
+            print(f"{'':>10}  not imported: {module}")
+    web, tasks = results["web"], results["web+tasks"]
+    print(
+        f"    saving: {(tasks['seconds'] - web['seconds']) * 1000:8.1f}ms "
+        f"{tasks['rss'] - web['rss']:7.1f}MB "
+        f"{tasks['modules'] - web['modules']:5d} modules"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+#!/bin/sh
+
+# Periodic tasks: dispatch of deferred generation jobs, compaction of the
+# token blacklist and flush of buffered last login times
+celery -A app beat -l info --schedule /tmp/celerybeat-schedule
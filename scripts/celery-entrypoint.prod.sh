@@ -1,3 +1,11 @@
 #!/bin/sh
 
-celery -A app worker -l info --concurrency 4 -E
\ No newline at end of file
+# CELERY_POOL=gevent runs generation tasks as green threads, so one process
+# handles many concurrent generations (use CELERY_CONCURRENCY=100 or more).
+# Generations are dispatched only into GENERATION_SLOTS, raise it together
+# with the concurrency.
+# The gevent pool sends no soft time limits and does not terminate revoked
+# tasks, generation tasks check both after every chunk instead.
+# CELERY_QUEUES=bulk starts a worker only for generations from large materials,
+# CELERY_QUEUES=deferred one only for generations deferred to off-peak hours
+celery -A app worker -l info -P ${CELERY_POOL:-prefork} --concurrency ${CELERY_CONCURRENCY:-4} -Q ${CELERY_QUEUES:-celery,bulk,deferred} -E
\ No newline at end of file
@@ -1,3 +1,3 @@
 #!/bin/sh
 
-watchmedo auto-restart --directory=./ --pattern=*.py --recursive -- celery -A app worker --concurrency=1 --loglevel=INFO
\ No newline at end of file
+watchmedo auto-restart --directory=./ --pattern=*.py --recursive -- celery -A app worker -P ${CELERY_POOL:-prefork} --concurrency=${CELERY_CONCURRENCY:-1} -Q ${CELERY_QUEUES:-celery,bulk,deferred} --loglevel=INFO
\ No newline at end of file
@@ -0,0 +1,106 @@
+"""
+Load test of the token refresh endpoint.
+
+Every worker logs in once and then refreshes its token in a chain, each
+refresh uses the refresh token returned by the previous one, like
+clients do. Run it against a build before and after a change of the
+refresh view with the same options to compare throughput.
+
+Usage:
+    python scripts/load_test_refresh.py --username user --password pass \
+        [--url http://localhost:8000/api/auth/] [--workers 16] \
+        [--duration 30]
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+
+
+def post(url, data):
+    """
+    Post JSON data.
+
+    Args:
+        url: URL of the endpoint.
+        data: Data of the request.
+
+    Returns:
+        dict: Data of the response.
+    """
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(data).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.loads(response.read())
+
+
+def worker(args, deadline, latencies, errors):
+    """
+    Refresh a chain of tokens until the deadline.
+
+    Args:
+        args: Options of the load test.
+        deadline: Time to stop at.
+        latencies: List for seconds of successful refreshes.
+        errors: List for errors.
+    """
+    credentials = {"username": args.username, "password": args.password}
+    refresh = post(args.url + "login/", credentials)["refresh"]
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        try:
+            refresh = post(args.url + "refresh/", {"refresh": refresh})[
+                "refresh"
+            ]
+        except (urllib.error.URLError, KeyError) as e:
+            errors.append(e)
+            refresh = post(args.url + "login/", credentials)["refresh"]
+            continue
+        latencies.append(time.monotonic() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--url", default="http://localhost:8000/api/auth/")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30)
+    args = parser.parse_args()
+    latencies, errors = [], []
+    deadline = time.monotonic() + args.duration
+    threads = [
+        threading.Thread(
+            target=worker, args=(args, deadline, latencies, errors)
+        )
+        for _ in range(args.workers)
+    ]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.monotonic() - started
+    if not latencies:
+        print(f"No successful refreshes, {len(errors)} errors")
+        return
+    latencies.sort()
+    print(
+        f"{len(latencies)} refreshes in {seconds:.1f}s: "
+        f"{len(latencies) / seconds:.1f}/s, {len(errors)} errors"
+    )
+    print(
+        f"latency: p50 {statistics.median(latencies) * 1000:.1f}ms "
+        f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f}ms "
+        f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms"
+    )
+
+
+if __name__ == "__main__":
+    main()